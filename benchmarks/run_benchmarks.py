@@ -0,0 +1,312 @@
+"""
+Benchmark suite for the hot paths of SERPENS.
+
+Covers particle creation ('create_particle'), integration ('SerpensSimulation.advance_integrate'), DTFE construction
+and evaluation (2D and 3D) and snapshot loading ('SerpensAnalyzer.pull_data') on seeded synthetic particle clouds
+around the sources of the Jupiter (Io-Source) and WASP-49 systems from resources/objects.json.
+Every case runs in a fresh process. Throughput, wall time and peak memory are stored as JSON, such that runs on
+different commits can be compared. Timings are measured without memory tracing; the peak of the Python heap is
+measured in a separate run of every case.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --benchmarks dtfe3d --sizes 1000 10000 100000 1000000
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier run>.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import subprocess
+import multiprocessing
+from datetime import datetime
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+SYSTEMS = ["Jupiter (Io-Source)", "WASP-49"]
+
+# Default cloud sizes per benchmark. Particle creation and integration are too slow for the largest clouds.
+DEFAULT_SIZES = {
+    "create_sputter": [10 ** 3, 10 ** 4],
+    "create_thermal": [10 ** 3, 10 ** 4],
+    "integrate": [10 ** 3, 10 ** 4, 10 ** 5],
+    "dtfe2d": [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+    "dtfe3d": [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+    "pull_data": [10 ** 3, 10 ** 4, 10 ** 5]
+}
+
+G = 6.6743e-11
+
+
+def load_system(system):
+    """
+    Returns the celestial objects of a system and the name of its source.
+    """
+    from src.parameters import Parameters
+    Parameters.modify_objects(celestial_name=system)
+    celest = Parameters.celest
+    source = [k for k, v in celest.items() if isinstance(v, dict) and v.get("source", False)][0]
+    return celest, source
+
+
+def synthetic_cloud(system, n, seed):
+    """
+    Seeded synthetic torus of test particles along the orbit of the system's source, centered on its primary at the
+    origin. Returns positions, velocities, the primary's mass and radius, and the source's radius and semi-major axis.
+    """
+    celest, source = load_system(system)
+    primary = celest[celest[source]["primary"]]
+    a = celest[source]["a"]
+    rng = np.random.default_rng(seed)
+
+    phi = rng.uniform(0, 2 * np.pi, n)
+    r = a * (1 + 0.1 * rng.standard_normal(n))
+    z = 0.05 * a * rng.standard_normal(n)
+    positions = np.c_[r * np.cos(phi), r * np.sin(phi), z]
+
+    v_circ = np.sqrt(G * primary["m"] / np.abs(r))
+    velocities = np.c_[-v_circ * np.sin(phi), v_circ * np.cos(phi), np.zeros(n)]
+    velocities += 0.05 * v_circ[:, None] * rng.standard_normal((n, 3))
+    return positions, velocities, primary, celest[source]
+
+
+def setup_simulation(system, n, seed):
+    """
+    SERPENS simulation of a system with a synthetic cloud of n sodium test particles around its source.
+    Needs to be called inside a (temporary) working directory.
+    """
+    from serpens_simulation import SerpensSimulation
+    from src.parameters import NewParams, Parameters
+    from src.species import Species
+
+    NewParams(species=[Species('Na', n_th=0, n_sp=0, mass_per_sec=1e4, lifetime=4 * 3600)], celestial_name=system,
+              int_spec={"seed": seed})()
+    sim = SerpensSimulation()
+    _, source = load_system(system)
+    sim.object_to_source(source, Parameters.species["species1"])
+
+    positions, velocities, _, _ = synthetic_cloud(system, n, seed)
+    primary = sim.particles[sim.obj_primary_dict[source]]
+    positions += np.asarray(primary.xyz)
+    velocities += np.asarray(primary.vxyz)
+    source_hash = sim.particles[source].hash.value
+    for index, (pos, vel) in enumerate(zip(positions, velocities)):
+        identifier = f"bench_{index}"
+        sim.add(x=pos[0], y=pos[1], z=pos[2], vx=vel[0], vy=vel[1], vz=vel[2], hash=identifier, test_particle=True)
+        sim.particles[identifier].params["beta"] = 0.
+        sim.particles[identifier].params["serpens_species"] = Parameters.species["species1"].id
+        sim.particles[identifier].params["serpens_weight"] = 1.
+        sim.particles[identifier].params["source_hash"] = source_hash
+    sim.rebx.save("rebx.bin")
+    return sim
+
+
+def bench_create(system, n, seed, process):
+    from src.create_particle import create_particle, set_seed
+    from src.parameters import NewParams, Parameters
+    from src.species import Species
+
+    n_th, n_sp = (n, 0) if process == "thermal" else (0, n)
+    NewParams(species=[Species('Na', n_th=n_th, n_sp=n_sp, mass_per_sec=1e4)], celestial_name=system)()
+    set_seed(seed)
+    celest, source = load_system(system)
+    source_state = np.array([[celest[source]["a"], 0, 0], [0, 1e4, 0]])
+    species = Parameters.species["species1"]
+
+    start = time.perf_counter()
+    create_particle(species.id, process=process, source=source_state, source_r=celest[source]["r"], num=n)
+    elapsed = time.perf_counter() - start
+    return {"time": elapsed, "throughput": n / elapsed, "unit": "particles/s"}
+
+
+def bench_dtfe(system, n, seed, d):
+    from src import DTFE, DTFE3D
+
+    positions, velocities, _, _ = synthetic_cloud(system, n, seed)
+    module = DTFE if d == 2 else DTFE3D
+
+    # Compile (or load from the cache) the numba kernels outside the timed region.
+    start = time.perf_counter()
+    module.warmup()
+    compile_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dtfe = module.DTFE(positions[:, :d], velocities[:, :d], np.ones(n))
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    dtfe.density(*positions[:, :d].T)
+    density_time = time.perf_counter() - start
+
+    num_simplices = len(dtfe.delaunay.simplices)
+    return {"time": build_time, "throughput": num_simplices / build_time, "unit": "simplices/s",
+            "particles_per_s": n / build_time, "simplices": num_simplices, "density_time": density_time,
+            "compile_time": compile_time}
+
+
+def bench_integrate(system, n, seed):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            sim = setup_simulation(system, n, seed)
+            sim.recorder.start(0)
+            start = time.perf_counter()
+            sim.advance_integrate()
+            elapsed = time.perf_counter() - start
+            phases = sim.recorder.stop()
+            sim.snapshot_writer.close()
+        finally:
+            os.chdir(cwd)
+    return {"time": elapsed, "throughput": n / elapsed, "unit": "particles/s",
+            "phases": {k: v for k, v in phases.items() if k.startswith("time_")}}
+
+
+def bench_pull_data(system, n, seed, snapshots=5):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        try:
+            sim = setup_simulation(system, n, seed)
+            for _ in range(snapshots):
+                sim.t += 3600.
+                sim.snapshot_writer.submit_simulation(sim, "archive.bin")
+            sim.snapshot_writer.close()
+            sim.rebx.save("rebx.bin")
+
+            from serpens_analyzer import SerpensAnalyzer
+            analyzer = SerpensAnalyzer()
+            start = time.perf_counter()
+            for timestep in range(1, snapshots + 1):
+                analyzer.pull_data(timestep)
+            elapsed = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+    return {"time": elapsed, "throughput": snapshots / elapsed, "unit": "snapshots/s",
+            "particles_per_s": snapshots * n / elapsed}
+
+
+BENCHMARKS = {
+    "create_sputter": lambda system, n, seed: bench_create(system, n, seed, "sputter"),
+    "create_thermal": lambda system, n, seed: bench_create(system, n, seed, "thermal"),
+    "integrate": bench_integrate,
+    "dtfe2d": lambda system, n, seed: bench_dtfe(system, n, seed, 2),
+    "dtfe3d": lambda system, n, seed: bench_dtfe(system, n, seed, 3),
+    "pull_data": bench_pull_data
+}
+
+
+def run_case(benchmark, system, n, seed):
+    """
+    Runs a single benchmark case. Executed in a fresh process, such that the peak memory belongs to this case only.
+    """
+    result = BENCHMARKS[benchmark](system, n, seed)
+    result.update({
+        "benchmark": benchmark,
+        "system": system,
+        "n": n,
+        "seed": seed,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    })
+    return result
+
+
+def traced_peak(benchmark, system, n, seed):
+    """
+    Peak memory allocated through Python (in MB) of a benchmark case. Executed in a separate fresh process, since
+    tracing slows down Python-heavy code considerably and would distort the timings of 'run_case'.
+    """
+    tracemalloc.start()
+    BENCHMARKS[benchmark](system, n, seed)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 1024 ** 2
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, reference_path):
+    """
+    Prints the throughput ratio of matching cases between this run and a reference run.
+    """
+    with open(reference_path, "r") as f:
+        reference = json.load(f)
+    reference_cases = {(r["benchmark"], r["system"], r["n"]): r for r in reference["results"]}
+
+    print(f"Comparison to {reference_path} (commit {reference.get('commit')}):")
+    for r in results:
+        ref = reference_cases.get((r["benchmark"], r["system"], r["n"]))
+        if ref is None:
+            continue
+        print(f"\t {r['benchmark']:<15} {r['system']:<22} n={r['n']:<8} "
+              f"throughput x{r['throughput'] / ref['throughput']:.2f}, "
+              f"peak RSS x{r['peak_rss_mb'] / ref['peak_rss_mb']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SERPENS benchmark suite")
+    parser.add_argument("--benchmarks", nargs="+", default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument("--systems", nargs="+", default=SYSTEMS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=None,
+                        help="Cloud sizes (default: per benchmark, 10^3 to 10^6)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None,
+                        help="Result file (default: benchmarks/results/<date>-<commit>.json)")
+    parser.add_argument("--compare", default=None, help="Earlier result file to compare with")
+    parser.add_argument("--no-traced-memory", action="store_true",
+                        help="Skip the additional traced run per case that measures the Python heap peak")
+    args = parser.parse_args()
+
+    commit = git_commit()
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for benchmark in args.benchmarks:
+        for system in args.systems:
+            for n in (args.sizes or DEFAULT_SIZES[benchmark]):
+                with context.Pool(processes=1) as pool:
+                    result = pool.apply(run_case, (benchmark, system, n, args.seed))
+                if not args.no_traced_memory:
+                    with context.Pool(processes=1) as pool:
+                        result["peak_traced_mb"] = pool.apply(traced_peak, (benchmark, system, n, args.seed))
+                results.append(result)
+                print(f"{benchmark:<15} {system:<22} n={n:<8} {result['time']:9.3f} s "
+                      f"{result['throughput']:12.1f} {result['unit']:<12} peak RSS {result['peak_rss_mb']:.0f} MB")
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(ROOT, "benchmarks", "results"), exist_ok=True)
+        output = os.path.join(ROOT, "benchmarks", "results",
+                              f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{commit or 'unknown'}.json")
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "date": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "cpu_count": multiprocessing.cpu_count(),
+            "results": results
+        }, f, indent=2)
+    print(f"Results saved to {output}")
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
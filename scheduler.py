@@ -1,10 +1,25 @@
 import os as os
+import glob
+import json
 import shutil
+import hashlib
+import multiprocessing
 import dill
+import numpy as np
 from serpens_simulation import SerpensSimulation
+from src import __version__
 from src.parameters import Parameters, NewParams
 from src.species import Species
 
+# Integration specifics that do not change the result of a simulation and are therefore not part of its cache key.
+# The number of threads does not change the particles of seeded simulations (see 'create_parallel' in
+# src/create_particle.py).
+CACHE_IGNORED_INT_SPEC = ("num_sim_advances", "num_threads", "snapshot_queue_size", "instrumentation_log", "profile",
+                          "memory_budget")
+# Part of the cache key. Increased whenever the results for equal parameters change, such that older results are not
+# reused (2: particle creation independent of the number of threads).
+CACHE_VERSION = 2
+
 
 class SerpensScheduler:
     """
@@ -74,46 +89,171 @@ class SerpensScheduler:
     def run(self, *args, **kwargs):
         """
         Runs and saves all simulations previously set by the 'schedule' function.
+        Every simulation runs in a separate process inside its own run directory
+        'schedule_archive/simulation-<description>', such that simulations neither share files nor the 'Parameters'
+        singleton.
+        Results are cached by a hash of the effective parameters (see 'parameter_hash'). A simulation whose result
+        already exists is skipped, and a simulation that was previously run for fewer advances continues from the
+        checkpoint of the cached result. Only simulations with a seed are cached, since others are not reproducible.
 
         Keyword Arguments
         -----------------
-        save_freq : int         (default: 1)
-            Save frequency of the simulation. A value of 5 means that the simulation gets saved every 5th advance.
         sim_advances : int      (default: Value from Parameters.int_spec)
             Number of simulation advances done.
+        processes : int         (default: Number of available CPU cores, at most the number of scheduled simulations)
+            Number of simulations running at once.
+            The available CPU cores are divided among them for particle creation and integration.
         """
 
         print("Starting scheduled simulations.")
-        save_freq = kwargs.get("save_freq", 1)
-        for k, v in self.sims.items():
-            v()
-            num_advances = kwargs.get("sim_advances", Parameters.int_spec["num_sim_advances"])
-            with open("Parameters.pickle", 'wb') as f:
-                dill.dump(v, f, protocol=dill.HIGHEST_PROTOCOL)
-            #sim = SerpensSimulation(filename, snapshot)
-            sim = SerpensSimulation()
-            sim.advance(num_advances, save_freq=save_freq)
-
-            path = f"schedule_archive/simulation-{k}"
+        if len(self.sims) == 0:
+            return
 
-            if os.path.exists(path):
-                shutil.rmtree(path)
-            os.makedirs(path)
+        processes = kwargs.get("processes", None)
+        if processes is None:
+            processes = min(multiprocessing.cpu_count(), len(self.sims))
+        processes = max(1, min(processes, len(self.sims)))
+        threads = max(1, multiprocessing.cpu_count() // processes)
 
-            shutil.copy2(f"{os.getcwd()}/archive.bin", f"{os.getcwd()}/{path}")
-            shutil.copy2(f"{os.getcwd()}/hash_library.pickle", f"{os.getcwd()}/{path}")
-            shutil.copy2(f'{os.getcwd()}/Parameters.txt', f"{os.getcwd()}/{path}")
-            shutil.copy2(f'{os.getcwd()}/Parameters.pkl', f"{os.getcwd()}/{path}")
+        jobs = [(k, v, kwargs.get("sim_advances", None), os.path.abspath(f"schedule_archive/simulation-{k}"), threads)
+                for k, v in self.sims.items()]
 
-            del sim
-
-            Parameters.reset()
+        # A fresh process for every simulation, as parameter changes persist within a process.
+        with multiprocessing.get_context("spawn").Pool(processes=processes, maxtasksperchild=1) as pool:
+            for description in pool.imap_unordered(run_scheduled, jobs):
+                print(f"Finished simulation '{description}'.")
 
         print("=============================")
         print("COMPLETED ALL SIMULATIONS")
         print("=============================")
 
 
+def run_scheduled(job):
+    """
+    Not meant for external use.
+    Runs a single scheduled simulation inside its run directory. Executed by the worker processes of
+    'SerpensScheduler.run'.
+
+    Arguments
+    ---------
+    job : tuple
+        Description, 'NewParams' instance, number of advances (None for the value from Parameters.int_spec),
+        run directory and number of threads for the simulation.
+    """
+    description, new_params, num_advances, path, threads = job
+
+    new_params()
+    Parameters.modify_spec(int_spec={"num_threads": threads})
+    if num_advances is None:
+        num_advances = Parameters.int_spec["num_sim_advances"]
+    # Without a seed, the particle creation is not reproducible and the result cannot be reused.
+    cacheable = Parameters.int_spec.get("seed") is not None
+    key = parameter_hash()
+
+    cached_path = find_cached_result(os.path.dirname(path), key, preferred=path) if cacheable else None
+    if cached_path is not None and cached_path != path:
+        print(f"Reusing cached result of '{cached_path}' for simulation '{description}'.")
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        shutil.copytree(cached_path, path)
+    elif cached_path is None and os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+    os.chdir(path)
+
+    completed_advances = 0
+    steady_state = False
+    if cached_path is not None:
+        with open("cache.json", "r") as f:
+            manifest = json.load(f)
+        completed_advances = manifest["advances"]
+        steady_state = manifest.get("steady_state", False)
+
+    if completed_advances >= num_advances or steady_state:
+        print(f"Simulation '{description}' already exists. Skipping.")
+        return description
+
+    with open("Parameters.pickle", 'wb') as f:
+        dill.dump(new_params, f, protocol=dill.HIGHEST_PROTOCOL)
+
+    if completed_advances > 0:
+        print(f"Continuing simulation '{description}' after {completed_advances} advances.")
+        sim = SerpensSimulation.from_checkpoint()
+    else:
+        sim = SerpensSimulation()
+        species = [Parameters.species[f"species{i + 1}"] for i in range(Parameters.num_species)]
+        for name, obj in Parameters.celest.items():
+            if isinstance(obj, dict) and obj.get("source", False):
+                sim.object_to_source(name, species)
+
+    advances_done = sim.advance(num_advances - completed_advances)
+    sim.snapshot_writer.close()
+
+    # Written last, such that interrupted simulations are never treated as cached results.
+    # A simulation that stopped at steady state is complete for any number of advances.
+    if cacheable:
+        with open("cache.json", "w") as f:
+            json.dump({"key": key, "advances": completed_advances + advances_done,
+                       "steady_state": advances_done < num_advances - completed_advances,
+                       "version": __version__}, f)
+
+    return description
+
+
+def parameter_hash():
+    """
+    Returns a hash of the currently applied parameters (species, integration and thermal specifics, celestial system,
+    seed) and the SERPENS version. Used as cache key for scheduled simulations.
+    """
+    def serializable(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return vars(obj)
+
+    params = Parameters()
+    int_spec = {k: v for k, v in params.int_spec.items() if k not in CACHE_IGNORED_INT_SPEC}
+    description = {
+        "version": __version__,
+        "cache_version": CACHE_VERSION,
+        "int_spec": int_spec,
+        "therm_spec": params.therm_spec,
+        "celest": params.celest,
+        "species": [params.get_species(num=i + 1) for i in range(params.num_species)]
+    }
+    encoded = json.dumps(description, sort_keys=True, default=serializable)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def find_cached_result(archive_path, key, preferred=None):
+    """
+    Searches the run directories inside 'archive_path' for a completed simulation with the given cache key.
+    Returns the path of the run directory or None.
+
+    Arguments
+    ---------
+    archive_path : str
+        Directory containing the run directories.
+    key : str
+        Cache key as returned by 'parameter_hash'.
+    preferred : str     (default: None)
+        Run directory to check first.
+    """
+    manifests = sorted(glob.glob(os.path.join(archive_path, "*", "cache.json")))
+    if preferred is not None:
+        manifests.insert(0, os.path.join(preferred, "cache.json"))
+
+    for manifest in manifests:
+        try:
+            with open(manifest, "r") as f:
+                if json.load(f)["key"] == key:
+                    return os.path.dirname(manifest)
+        except (OSError, ValueError, KeyError):
+            # Missing or incomplete manifest
+            continue
+    return None
+
 
 if __name__ == "__main__":
     ssch = SerpensScheduler()
@@ -138,4 +278,4 @@ if __name__ == "__main__":
                             "r_max": 16}
                   )
 
-    ssch.run(save_freq=2)
+    ssch.run()
@@ -1,20 +1,20 @@
 import numpy as np
 import os as os
-import glob
 import shutil
 import rebound
 import reboundx
 import pickle
-import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 import functools
 import warnings
+import multiprocessing
+import queue
+import threading
 
 from datetime import datetime
-from src import DTFE, DTFE3D
+from src.compact_archive import CompactArchive
 from src.parameters import Parameters, NewParams
-from src.visualize import Visualize
+from src import profiling
+from src.profiling import profiled
 
 warnings.filterwarnings('ignore', category=RuntimeWarning, module='rebound')
 
@@ -45,6 +45,50 @@ def ensure_data_loaded(method):
     return wrapper
 
 
+# Analyzer instance of a worker process of the parallel analysis (see 'SerpensAnalyzer.density_series').
+_worker_analyzer = None
+
+
+def _init_analysis_worker(init_kwargs, save_path):
+    """
+    Internal use only.
+    Initializer of the worker processes of the parallel analysis. Every worker opens its own simulation archive
+    through a separate analyzer instance, renders off-screen and compiles the DTFE kernels once.
+    """
+    global _worker_analyzer
+    os.environ["MPLBACKEND"] = "Agg"
+    from src import DTFE, DTFE3D
+    DTFE.warmup()
+    DTFE3D.warmup()
+
+    _worker_analyzer = SerpensAnalyzer(**init_kwargs)
+    if save_path is not None:
+        _worker_analyzer.save = True
+        _worker_analyzer.path = save_path
+
+
+def _density_task(task):
+    """
+    Internal use only.
+    Density estimation of a single timestep in a worker process.
+    """
+    timestep, species_num, d, los = task
+    return _worker_analyzer._species_density(timestep, species_num, d=d, los=los)
+
+
+def _render_task(task):
+    """
+    Internal use only.
+    Renders and saves a single frame in a worker process.
+    """
+    timestep, perspective, kwargs = task
+    if perspective == "los":
+        _worker_analyzer.plot_lineofsight(timestep, show=False, **kwargs)
+    else:
+        _worker_analyzer.plot_planar(timestep, show=False, **kwargs)
+    return timestep
+
+
 class SerpensAnalyzer:
     """
     This is the SERPENS analyzer class.
@@ -90,11 +134,13 @@ class SerpensAnalyzer:
             raise Exception("Parameters.pkl not found.")
 
         self.sa = self._load_simulation_archive()
+        self.compact_archive = CompactArchive("archive_compact.bin") if os.path.exists("archive_compact.bin") else None
         self.save = save_output
         self.save_arch = save_archive
         self.save_index = 1
 
         self.params = Parameters()
+        profiling.configure()
 
         with open('source_parameters.pkl', 'rb') as f:
             self.source_parameter_sets = pickle.load(f)
@@ -106,7 +152,6 @@ class SerpensAnalyzer:
         self.particle_species = None
         self.particle_weights = None
         self.cached_timestep = None
-        self.rotated_timesteps = []
 
         self.cutoffs = {"z": z_cutoff, "r": r_cutoff, "v": v_cutoff}
         self.reference_system = reference_system
@@ -134,6 +179,8 @@ class SerpensAnalyzer:
             if save_archive:
                 print("\t archive...")
                 shutil.copy2(f"{os.getcwd()}/archive.bin", f"{os.getcwd()}/output/{self.path}")
+                if self.compact_archive is not None:
+                    shutil.copy2(f"{os.getcwd()}/archive_compact.bin", f"{os.getcwd()}/output/{self.path}")
 
     @staticmethod
     def _load_simulation_archive():
@@ -169,66 +216,139 @@ class SerpensAnalyzer:
         elif plane == '3d':
             return planet.x, planet.y, planet.z
 
-    def _rotate_reference_system(self):
+    @staticmethod
+    def _primary_of(sim, source_hash) -> rebound.Particle:
         """
         Internal use only.
-        Applies a rotation (coordinate transformation) to all particles if the reference system is geocentric.
+        Returns the primary of a source in a given simulation (the first particle if 'source_hash' is None).
         """
-        phase = np.arctan2(self.get_primary(self.reference_system).y, self.get_primary(self.reference_system).x)
+        if source_hash is not None:
+            return sim.particles[rebound.hash(sim.particles[source_hash].params['source_primary'])]
+        else:
+            return sim.particles[0]
 
-        inc = self.get_primary(self.reference_system).orbit().inc
+    @staticmethod
+    def _rotate_reference_system(sim, reference_system):
+        """
+        Internal use only.
+        Applies a rotation (coordinate transformation) to all particles if the reference system is geocentric.
+        Returns the applied rotation as a matrix, such that particles stored outside the REBOUND simulation
+        (compact archive) can be transformed alike.
+        """
+        primary = SerpensAnalyzer._primary_of(sim, reference_system)
+        phase = np.arctan2(primary.y, primary.x)
+        inc = primary.orbit().inc
 
         reb_rot = rebound.Rotation(angle=phase, axis='z')
         reb_rot_inc = rebound.Rotation(angle=inc, axis='y')
-        for particle in self.sim.particles:
+        for particle in sim.particles:
             particle.rotate(reb_rot.inverse())
             particle.rotate(reb_rot_inc)
 
+        rot_z = np.array([[np.cos(phase), np.sin(phase), 0], [-np.sin(phase), np.cos(phase), 0], [0, 0, 1]])
+        rot_y = np.array([[np.cos(inc), 0, np.sin(inc)], [0, 1, 0], [-np.sin(inc), 0, np.cos(inc)]])
+        return rot_y @ rot_z
+
     def get_primary(self, source_hash) -> rebound.Particle:
-        if source_hash is not None:
-            return self.sim.particles[
-                rebound.hash(self.sim.particles[source_hash].params['source_primary'])]
-        else:
-            return self.sim.particles[0]
+        return self._primary_of(self.sim, source_hash)
 
-    def pull_data(self, timestep):
-        """
-        Serializes particle vectors and attributes for a given timestep.
-        Sets REBOUND simulation instance at given timestep.
-        Gets called by the @ensure_data_loaded decorator.
+    @staticmethod
+    def _read_snapshot(sa, compact_archive, timestep, reference_system):
         """
-        if self.cached_timestep == timestep:
-            return
-        else:
-            self.cached_timestep = timestep
+        Internal use only.
+        Decodes a snapshot and extracts the particle arrays. Does not modify the analyzer, such that it can run on a
+        background thread with its own archive handles (see 'stream').
 
-        self.sim = self.sa[int(timestep)]
-        _ = reboundx.Extras(self.sim, "rebx.bin")
+        Arguments
+        ---------
+        sa : rebound.Simulationarchive
+            Simulation archive to read from.
+        compact_archive : CompactArchive or None
+            Compact archive holding the test particles (if used by the simulation).
+        timestep : int
+            Index of the snapshot.
+        reference_system : str or None
+            Reference system to rotate into (see '__init__').
+
+        Returns
+        -------
+        Dictionary with the simulation ("sim"), its REBOUNDx instance ("rebx") and unmasked particle arrays.
+        """
+        sim = sa[int(timestep)]
+        rebx = reboundx.Extras(sim, "rebx.bin")
 
-        if self.reference_system is not None:
-            if timestep not in self.rotated_timesteps:
-                self._rotate_reference_system()
-                self.rotated_timesteps.append(timestep)
+        rotation = None
+        if reference_system is not None:
+            rotation = SerpensAnalyzer._rotate_reference_system(sim, reference_system)
 
-        self.particle_positions = np.zeros((self.sim.N, 3), dtype="float64")
-        self.particle_velocities = np.zeros((self.sim.N, 3), dtype="float64")
-        self.particle_hashes = np.zeros(self.sim.N, dtype="uint32")
-        self.sim.serialize_particle_data(xyz=self.particle_positions, vxvyvz=self.particle_velocities,
-                                         hash=self.particle_hashes)
+        positions = np.zeros((sim.N, 3), dtype="float64")
+        velocities = np.zeros((sim.N, 3), dtype="float64")
+        hashes = np.zeros(sim.N, dtype="uint32")
+        sim.serialize_particle_data(xyz=positions, vxvyvz=velocities, hash=hashes)
 
-        self.particle_species = np.zeros(self.sim.N, dtype="int")
-        self.particle_weights = np.zeros(self.sim.N, dtype="float64")
-        self._particle_source_hashes = np.zeros(self.sim.N, dtype="uint32")
+        species = np.zeros(sim.N, dtype="int")
+        weights = np.zeros(sim.N, dtype="float64")
+        source_hashes = np.zeros(sim.N, dtype="uint32")
 
-        for k1 in range(self.sim.N):
+        for k1 in range(sim.N):
             try:
-                part = self.sim.particles[rebound.hash(int(self.particle_hashes[k1]))]  # Get particle
-                self.particle_species[k1] = part.params["serpens_species"]
-                self.particle_weights[k1] = part.params["serpens_weight"]
-                self._particle_source_hashes[k1] = part.params["source_hash"]
+                part = sim.particles[rebound.hash(int(hashes[k1]))]  # Get particle
+                species[k1] = part.params["serpens_species"]
+                weights[k1] = part.params["serpens_weight"]
+                source_hashes[k1] = part.params["source_hash"]
             except AttributeError:
                 continue
 
+        snapshot = {
+            "sim": sim,
+            "rebx": rebx,
+            "positions": positions,
+            "velocities": velocities,
+            "hashes": hashes,
+            "species": species,
+            "weights": weights,
+            "source_hashes": source_hashes
+        }
+        if compact_archive is not None:
+            # Test particles are stored in the compact archive, 'archive.bin' only holds the active particles.
+            snapshot = SerpensAnalyzer._merge_compact(snapshot, compact_archive[int(timestep)], rotation)
+        return snapshot
+
+    @staticmethod
+    def _merge_compact(snapshot, compact, rotation=None):
+        """
+        Internal use only.
+        Appends the test particles of a compact archive snapshot to the particle arrays of a snapshot (see
+        '_read_snapshot'). Positions and velocities are transformed by 'rotation' like the REBOUND particles.
+        """
+        compact_positions, compact_velocities = compact["xyz"], compact["vxyz"]
+        if rotation is not None:
+            compact_positions = compact_positions @ rotation.T
+            compact_velocities = compact_velocities @ rotation.T
+        merged = dict(snapshot)
+        merged["positions"] = np.concatenate((snapshot["positions"], compact_positions))
+        merged["velocities"] = np.concatenate((snapshot["velocities"], compact_velocities))
+        merged["hashes"] = np.concatenate((snapshot["hashes"], compact["hash"]))
+        merged["species"] = np.concatenate((snapshot["species"], compact["species"]))
+        merged["weights"] = np.concatenate((snapshot["weights"], compact["weight"]))
+        merged["source_hashes"] = np.concatenate((snapshot["source_hashes"], compact["source_hash"]))
+        return merged
+
+    def _set_snapshot(self, timestep, snapshot):
+        """
+        Internal use only.
+        Makes an extracted snapshot (see '_read_snapshot') the current data of the analyzer and applies the masks.
+        """
+        self.cached_timestep = timestep
+        self.sim = snapshot["sim"]
+        self._rebx = snapshot["rebx"]
+        self.particle_positions = snapshot["positions"]
+        self.particle_velocities = snapshot["velocities"]
+        self.particle_hashes = snapshot["hashes"]
+        self.particle_species = snapshot["species"]
+        self.particle_weights = snapshot["weights"]
+        self._particle_source_hashes = snapshot["source_hashes"]
+
         self.source_hashes = []
         # Error correction:
         for h in np.unique(self._particle_source_hashes):
@@ -241,6 +361,84 @@ class SerpensAnalyzer:
         self.num_sources = len(self.source_hashes)
         self._apply_masks()
 
+    @profiled
+    def pull_data(self, timestep):
+        """
+        Serializes particle vectors and attributes for a given timestep.
+        Sets REBOUND simulation instance at given timestep.
+        Gets called by the @ensure_data_loaded decorator.
+        """
+        if self.cached_timestep == timestep:
+            return
+        self._set_snapshot(timestep, self._read_snapshot(self.sa, self.compact_archive, timestep,
+                                                         self.reference_system))
+
+    def stream(self, timesteps=None, prefetch=2):
+        """
+        Iterates over snapshots in order. The next 'prefetch' snapshots are decoded on a background thread with its own
+        archive handles, such that decoding overlaps with the computation done on the current snapshot.
+        Every yielded snapshot is loaded as the current data of the analyzer, so all analyzer functions can be used
+        inside the loop without reloading.
+
+        Arguments
+        ---------
+        timesteps : iterable    (default: None -> all snapshots)
+            Timesteps to iterate over.
+        prefetch : int      (default: 2)
+            Number of snapshots decoded ahead.
+
+        Yields
+        ------
+        Tuples (timestep, data), where 'data' is a dictionary of the masked particle arrays "positions", "velocities",
+        "hashes", "species", "weights", as well as the simulation time "t".
+        """
+        timesteps = list(range(len(self.sa))) if timesteps is None else [int(ts) for ts in timesteps]
+        buffer = queue.Queue(maxsize=max(1, int(prefetch)))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def produce():
+            try:
+                sa = self._load_simulation_archive()
+                compact_archive = CompactArchive("archive_compact.bin") if self.compact_archive is not None else None
+                for ts in timesteps:
+                    if stop.is_set():
+                        return
+                    put((ts, self._read_snapshot(sa, compact_archive, ts, self.reference_system), None))
+            except Exception as exc:
+                put((None, None, exc))
+            put(None)
+
+        producer = threading.Thread(target=produce, name="serpens-snapshot-prefetch", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is None:
+                    return
+                ts, snapshot, exc = item
+                if exc is not None:
+                    raise RuntimeError("Reading a snapshot in the background failed.") from exc
+                self._set_snapshot(ts, snapshot)
+                yield ts, {
+                    "positions": self.particle_positions,
+                    "velocities": self.particle_velocities,
+                    "hashes": self.particle_hashes,
+                    "species": self.particle_species,
+                    "weights": self.particle_weights,
+                    "t": self.sim.t
+                }
+        finally:
+            stop.set()
+            producer.join()
+
     def _apply_masks(self):
         """
         Internal use only.
@@ -297,8 +495,38 @@ class SerpensAnalyzer:
         self.particle_species = self.particle_species[overall_mask]
         self.particle_weights = self.particle_weights[overall_mask]
 
+    def _dtfe_options(self, precision, plane):
+        """
+        Internal use only.
+        Keyword arguments of the DTFE for a precision. In single precision, coordinates are recentred on the primary.
+        """
+        if precision == "double":
+            return {"precision": precision}
+        origin = self._calculate_offsets(plane)
+        return {"precision": precision, "origin": origin if plane == '3d' else origin[:2]}
+
+    def _field_estimator(self, estimator, precision, spatial_sort, plane, points, velocities, weights):
+        """
+        Internal use only.
+        Returns the density estimator ('dtfe', 'kde' or 'sectors') of the particles projected onto a plane ('xy', 'yz'
+        or '3d').
+        """
+        # Imported on use, such that loading the analyzer does not import numba (and plotting libraries, see below).
+        if estimator == "kde":
+            from src import KDE
+            return KDE.KDE(points, velocities, weights)
+        if estimator == "sectors":
+            from src.partitioned_dtfe import PartitionedDTFE
+            center = self._calculate_offsets(plane)
+            return PartitionedDTFE(points, weights, center=center if plane == '3d' else center[:2])
+        from src import DTFE, DTFE3D
+        module = DTFE3D if plane == '3d' else DTFE
+        return module.DTFE(points, velocities, weights, spatial_sort=spatial_sort,
+                           **self._dtfe_options(precision, plane))
+
     @ensure_data_loaded
-    def delaunay_field_estimation(self, timestep: int, species, d=2, los=False):
+    def delaunay_field_estimation(self, timestep: int, species, d=2, los=False, precision="double", estimator="dtfe",
+                                  spatial_sort=False):
         """
         Main function to get density values by initializing the DTFE estimator at a certain timestep.
         Automatically runs the "pull_data" function through the decorator.
@@ -322,7 +550,23 @@ class SerpensAnalyzer:
             Therefore, apply mask to filter out particles behind the primary before calculating densities if 'True'.
             Important to set to 'False' if we consider looking on the orbital plane. Particles won't be masked as they
             are not hidden.
+        precision : str     (default: "double")
+            "double" or "single". Single precision halves the memory of the DTFE fields, with coordinates recentred
+            on the primary of the reference system (see src/DTFE.py for the tolerance).
+        estimator : str     (default: "dtfe")
+            "dtfe" for the Delaunay tessellation field estimator or "kde" for an adaptive kernel density estimator
+            (see src/KDE.py). The kernel estimator scales as O(N log N) and is robust for nearly coplanar clouds.
+            It has no tessellation, so the returned Delaunay object is None.
+            "sectors" tessellates overlapping sectors of orbital phase around the primary in separate processes
+            (see src/partitioned_dtfe.py), for clouds whose tessellation does not fit into memory or to use several
+            cores. It gives the DTFE densities and returns no Delaunay object either.
+        spatial_sort : bool     (default: False)
+            Tessellate the particles in Morton order, which speeds up the Delaunay construction (mostly in 2D).
+            The vertices of the returned Delaunay object are then in Morton order, not in the order of the particles.
         """
+        if estimator not in ("dtfe", "kde", "sectors"):
+            raise ValueError(f"Invalid estimator '{estimator}'. Use 'dtfe', 'kde' or 'sectors'.")
+
         points_mask = np.where(self.particle_species == species.id)
 
         points = self.particle_positions[points_mask]
@@ -332,10 +576,15 @@ class SerpensAnalyzer:
 
         # Physical weight calculation:
         total_injected = timestep * (species.n_sp + species.n_th)
-        remaining_part = len(points[:, 0])
-        mass_in_system = remaining_part / total_injected * species.mass_per_sec * self.sim.t
-        number_of_particles = mass_in_system / species.m
-        phys_weights = number_of_particles * weights/np.sum(weights)
+        if total_injected > 0 and species.mass_per_sec:
+            remaining_part = len(points[:, 0])
+            mass_in_system = remaining_part / total_injected * species.mass_per_sec * self.sim.t
+            number_of_particles = mass_in_system / species.m
+            phys_weights = number_of_particles * weights/np.sum(weights)
+        else:
+            # Species that are only spawned as daughters are weighted by physical particles
+            # (see 'SpeciesRegistry.particles_per_weight' in src/species.py).
+            phys_weights = weights
 
         if d == 2:
 
@@ -356,17 +605,20 @@ class SerpensAnalyzer:
                     full_size_mask[indices_to_keep] = True
                     masks_for_each_source.append(full_size_mask)
 
-                dtfe = DTFE.DTFE(points[:, 1:3], velocities[:, 1:3], phys_weights)
+                dtfe = self._field_estimator(estimator, precision, spatial_sort, 'yz', points[:, 1:3],
+                                             velocities[:, 1:3], phys_weights)
 
                 dens = dtfe.density(points[:, 1], points[:, 2]) / 1e4
                 dens[np.logical_or.reduce(masks_for_each_source)] = 0
 
             else:
-                dtfe = DTFE.DTFE(points[:, :2], velocities[:, :2], phys_weights)
+                dtfe = self._field_estimator(estimator, precision, spatial_sort, 'xy', points[:, :2],
+                                             velocities[:, :2], phys_weights)
                 dens = dtfe.density(points[:, 0], points[:, 1]) / 1e4
 
         elif d == 3:
-            dtfe = DTFE3D.DTFE(points, velocities, phys_weights)
+            dtfe = self._field_estimator(estimator, precision, spatial_sort, '3d', points, velocities,
+                                         phys_weights)
             dens = dtfe.density(points[:, 0], points[:, 1], points[:, 2]) / 1e6
 
         else:
@@ -413,6 +665,7 @@ class SerpensAnalyzer:
         kwargs : Keyword arguments
             Passed to Visualizer (see src/visualize.py)
         """
+        from src.visualize import Visualize
 
         ts_list = np.atleast_1d(timestep).astype(int)
 
@@ -447,21 +700,32 @@ class SerpensAnalyzer:
                 vis.set_title(fr"Particle Densities $log_{{10}} (N/\mathrm{{cm}}^{{{-d}}})$ around Planetary Body", size=25, color='w')
 
             if self.save:
-                vis(show_bool=show, save_path=self.path, filename=f'TD_{ts}_000{self.save_index}')
+                filename = f'TD_{ts}_000{self.save_index}'
+                vis(show_bool=show, save_path=self.path, filename=filename)
                 self.save_index += 1
 
                 # Handle saving bugs...
-                list_of_files = glob.glob(f'./output/{self.path}/plots/*')
-                latest_file = max(list_of_files, key=os.path.getctime)
-                if os.path.getsize(latest_file) < 50000:
-                    print("\t Detected low filesize (threshold at 50 KB). Possibly encountered a saving bug. Retrying process.")
-                    os.remove(latest_file)
+                self._check_saved_frame(filename)
 
             else:
                 vis(show_bool=show)
 
             del vis
 
+    def _check_saved_frame(self, filename):
+        """
+        Internal use only.
+        Checks the size of a frame written by the visualizer. Frames below 50 KB are possibly affected by a saving bug
+        and are removed. Only the frame's own file is checked, since other worker processes (see 'render_series')
+        write to the same directory. Returns whether the frame is kept.
+        """
+        path = f'./output/{self.path}/plots/SERPENS_{filename}.png'
+        if os.path.exists(path) and os.path.getsize(path) < 50000:
+            print("\t Detected low filesize (threshold at 50 KB). Possibly encountered a saving bug. Retrying process.")
+            os.remove(path)
+            return False
+        return True
+
     def plot_lineofsight(self, timestep, show=True, scatter=True, **kwargs):
         """
         Returns a plot of the system from a line of sight perspective.
@@ -482,6 +746,7 @@ class SerpensAnalyzer:
         kwargs : Keyword arguments
             Passed to Visualizer (see src/visualize.py)
         """
+        from src.visualize import Visualize
 
         ts_list = np.atleast_1d(timestep).astype(int).tolist()
 
@@ -517,17 +782,12 @@ class SerpensAnalyzer:
                     vis.add_densityscatter(k, -points[:, 1][mask], points[:, 2][mask], dens[mask], d=2, zorder=10)
 
             if self.save:
-                vis(show_bool=show, save_path=self.path, filename=f'LOS_{ts}_{self.save_index}')
+                filename = f'LOS_{ts}_{self.save_index}'
+                vis(show_bool=show, save_path=self.path, filename=filename)
                 self.save_index += 1
 
                 # Handle saving bugs...
-                list_of_files = glob.glob(f'./output/{self.path}/plots/*')
-                latest_file = max(list_of_files, key=os.path.getctime)
-                if os.path.getsize(latest_file) < 50000:
-                    print("\t Detected low filesize (threshold at 50 KB). "
-                          "Possibly encountered a saving bug. Retrying process.")
-                    os.remove(latest_file)
-                else:
+                if self._check_saved_frame(filename):
                     running_index += 1
             else:
                 vis(show_bool=show)
@@ -535,6 +795,106 @@ class SerpensAnalyzer:
 
             del vis
 
+    def _species_density(self, timestep, species_num, d=2, los=False):
+        """
+        Internal use only.
+        Returns positions and densities (see 'delaunay_field_estimation') of a species at a timestep.
+        """
+        self.pull_data(timestep)
+        all_species = [s['species'][f'species{i + 1}'] for s in self.source_parameter_sets for i in
+                       range(len(s['species']))]
+        Parameters.modify_species(*all_species)
+
+        species = self.params.get_species(num=species_num)
+        points = self.particle_positions[np.where(self.particle_species == species.id)]
+        if len(points) == 0:
+            return points, np.zeros(0)
+        # The tessellation is not returned, so it may be built in Morton order.
+        dens, _ = self.delaunay_field_estimation(timestep, species, d=d, los=los, spatial_sort=True)
+        return points, dens
+
+    def _run_parallel(self, task, arguments, processes=None, save_path=None):
+        """
+        Internal use only.
+        Distributes tasks over a pool of worker processes, each holding its own analyzer (see '_init_analysis_worker').
+        Results are returned in the order of 'arguments'.
+        """
+        init_kwargs = {
+            "z_cutoff": self.cutoffs["z"],
+            "r_cutoff": self.cutoffs["r"],
+            "v_cutoff": self.cutoffs["v"],
+            "reference_system": self.reference_system
+        }
+        processes = min(processes or multiprocessing.cpu_count(), len(arguments))
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=processes, initializer=_init_analysis_worker,
+                          initargs=(init_kwargs, save_path)) as pool:
+            return pool.map(task, arguments, chunksize=1)
+
+    def density_series(self, timesteps, species_num=1, d=2, los=False, processes=None):
+        """
+        Density estimation of many timesteps in parallel. Timesteps are distributed over a pool of worker processes.
+
+        Arguments
+        ---------
+        timesteps : array-like
+            Timesteps at which to calculate densities.
+        species_num : int   (default: 1)
+            The number/index of the species.
+        d : int     (default: 2)
+            Dimension of analysis (see 'delaunay_field_estimation').
+        los : bool      (default: False)
+            Line of sight masking (see 'delaunay_field_estimation').
+        processes : int     (default: None -> number of CPU cores)
+            Number of worker processes.
+
+        Returns
+        -------
+        List of tuples (positions, densities), one per timestep and in the order of 'timesteps'.
+        """
+        timesteps = np.atleast_1d(timesteps).astype(int).tolist()
+        return self._run_parallel(_density_task, [(ts, species_num, d, los) for ts in timesteps], processes)
+
+    def render_series(self, timesteps, perspective="topdown", processes=None, **kwargs):
+        """
+        Renders and saves plots of many timesteps in parallel (see 'plot_planar' and 'plot_lineofsight').
+        Needs 'save_output=True' at the initialization of the analyzer, since the frames are written to disk by the
+        worker processes.
+
+        Arguments
+        ---------
+        timesteps : array-like
+            Timesteps to render.
+        perspective : str   (default: "topdown")
+            "topdown" for 'plot_planar' or "los" for 'plot_lineofsight'.
+        processes : int     (default: None -> number of CPU cores)
+            Number of worker processes.
+        kwargs : Keyword arguments
+            Passed to 'plot_planar' or 'plot_lineofsight'. Automatic levels ('lvlmin'/'lvlmax' set to 'auto') are
+            resolved once from the densities of all species at the last timestep, for both perspectives, such that all
+            frames share the same color scale.
+        """
+        if not self.save:
+            raise ValueError("Rendering in parallel needs 'save_output=True', frames are written to disk.")
+        if perspective not in ("topdown", "los"):
+            raise ValueError(f"Invalid perspective '{perspective}'. Use 'topdown' or 'los'.")
+
+        timesteps = np.atleast_1d(timesteps).astype(int).tolist()
+        if "auto" in (kwargs.get("lvlmin"), kwargs.get("lvlmax")):
+            # Same densities as the frames: 'plot_lineofsight' uses d=2 with line of sight masking.
+            los = perspective == "los"
+            d = 2 if los else kwargs.get("d", 2)
+            num_species = sum(len(s['species']) for s in self.source_parameter_sets)
+            dens = np.concatenate([self._species_density(timesteps[-1], k + 1, d=d, los=los)[1]
+                                   for k in range(num_species)])
+            dens = dens[dens > 0]
+            if kwargs.get("lvlmin") == "auto":
+                kwargs["lvlmin"] = np.log10(np.min(dens)) - .5
+            if kwargs.get("lvlmax") == "auto":
+                kwargs["lvlmax"] = np.log10(np.max(dens)) + .5
+
+        self._run_parallel(_render_task, [(ts, perspective, kwargs) for ts in timesteps], processes,
+                           save_path=self.path)
 
     @ensure_data_loaded
     def plot3d(self, timestep, species_num=1, log_cutoff=None, show_star=False):
@@ -551,6 +911,10 @@ class SerpensAnalyzer:
         log_cutoff : float      (default: None)
             Include a log(density) cutoff. log in base 10.
         """
+        import pandas as pd
+        import plotly.express as px
+        import plotly.graph_objects as go
+
         species = self.params.get_species(num=species_num)
         pos = self.particle_positions[np.where(self.particle_species == species.id)]
         dens, _ = self.delaunay_field_estimation(timestep, species, d=3)
@@ -5,23 +5,70 @@ import multiprocessing
 import concurrent.futures
 import pickle
 import warnings
-from src.create_particle import create_particle
+import os
+from src.create_particle import create_parallel, set_seed, get_rng_state, set_rng_state
+from src import create_particle as particle_creation
+from src.network import spawn_daughters
+from src.shadow import shadow_mask
+from src.compact_archive import write_compact_snapshot
 from src.parameters import Parameters, NewParams
+from src.snapshot_writer import SnapshotWriter
+from src.instrumentation import AdvanceRecorder, rss, peak_rss, simulation_nbytes, worker_copies_within_budget
+from src import profiling
+from src.profiling import profiled
 from tqdm import tqdm
 import time
 
 warnings.filterwarnings('ignore', category=RuntimeWarning, module='rebound')
 
+DOCS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'docs')
 
+
+def num_threads():
+    """
+    Number of threads used for particle creation and integration.
+    Set by 'num_threads' in the integration specifics, defaults to the number of available CPU cores.
+    """
+    threads = Parameters.int_spec["num_threads"]
+    return multiprocessing.cpu_count() if threads is None else max(1, int(threads))
+
+
+@profiled
 def weight_operator(sim_pointer, rebx_operator, dt):
+    """
+    Not meant for external use.
+    REBOUNDx operator applying the loss of the superparticles' weights in each timestep.
+    If 'radiation_pressure_shield' is set, test particles in the shadow of an active body decay with the shielded
+    lifetime of their species and feel no radiation pressure (beta = 0).
+    """
     sim = sim_pointer.contents
-    params = Parameters()
-    id_weight_multiplicator = {s.id: np.exp(-sim.dt/s.network) for _, s in params.species.items()}
+    registry = Parameters.species_registry()
+    decay = registry.decay_factors(sim.dt)
+    code = registry.code
+
+    if not Parameters.int_spec.get("radiation_pressure_shield", False):
+        decay = decay.tolist()
+        for particle in sim.particles[sim.N_active:]:
+            particle.params['serpens_weight'] *= decay[code[particle.params["serpens_species"]]]
+        return
 
-    for particle in sim.particles[sim.N_active:]:
-        particle.params['serpens_weight'] *= id_weight_multiplicator[particle.params["serpens_species"]]
+    particles = sim.particles[sim.N_active:]
+    codes = np.array([code[particle.params["serpens_species"]] for particle in particles], dtype="int")
 
+    # The star (radiation source) is the first particle, every other active particle casts a shadow.
+    xyz = np.zeros((sim.N, 3), dtype="float64")
+    radii = np.zeros(sim.N, dtype="float64")
+    sim.serialize_particle_data(xyz=xyz, r=radii)
+    shadow = shadow_mask(xyz[sim.N_active:], xyz[0], radii[0], xyz[1:sim.N_active], radii[1:sim.N_active])
 
+    factors = np.where(shadow, registry.decay_factors(sim.dt, shielded=True)[codes], decay[codes]).tolist()
+    beta = np.where(shadow, 0., registry.beta[codes]).tolist()
+    for particle, factor, b in zip(particles, factors, beta):
+        particle.params['serpens_weight'] *= factor
+        particle.params['beta'] = b
+
+
+@profiled
 def heartbeat(sim_pointer):
     """
     TODO: Fix the hashing
@@ -48,10 +95,11 @@ def heartbeat(sim_pointer):
             break
 
 
+@profiled
 def create(source_state, source_r, phys_process, species):
     """
     Creates a batch of particles to be added to a SERPENS simulation.
-    Utilizes multiprocessing and returns an array of particle state vectors.
+    Utilizes multithreading and returns an array of particle state vectors.
 
     Arguments
     ---------
@@ -75,30 +123,8 @@ def create(source_state, source_r, phys_process, species):
     if n == 0 or n is None:
         return np.array([])
 
-    # Use the number of available CPU cores
-    num_processes = min([multiprocessing.cpu_count(), n])
-
-    def add_with_multiprocessing():
-        per_create = int(n / num_processes)
-        part_state = create_particle(species.id, process=phys_process, source=source_state, source_r=source_r,
-                                     num=per_create)
-        return part_state
-
-    # Create a ThreadPoolExecutor with the desired number of threads/processes
-    with concurrent.futures.ThreadPoolExecutor(max_workers=num_processes) as executor:
-        # Submit function multiple times for parallel execution
-        future_to_result = {executor.submit(add_with_multiprocessing): None for _ in range(num_processes)}
-
-        # Collect the results from the futures
-        results = []
-        for future in concurrent.futures.as_completed(future_to_result):
-            result = future.result()
-            results.append(result)
-
-    # Results as ndarray and reshape before returning
-    results = np.asarray(results).reshape(np.shape(results)[0] * np.shape(results)[1], 6)
-
-    return results
+    # Seeded simulations create the same particles for any number of threads (see 'create_parallel').
+    return create_parallel(species.id, phys_process, source_state, source_r, n, num_threads())
 
 
 class SerpensSimulation(rebound.Simulation):
@@ -137,6 +163,9 @@ class SerpensSimulation(rebound.Simulation):
         self.serpens_iter = 0
         self.source_obj_dict = {}
         self.obj_primary_dict = {}
+        self.snapshot_writer = SnapshotWriter(max_queued=Parameters.int_spec["snapshot_queue_size"])
+        self.recorder = AdvanceRecorder(log_path=Parameters.int_spec["instrumentation_log"])
+        profiling.configure()
 
         if init_serpens:
             self.rebound_setup()
@@ -150,15 +179,9 @@ class SerpensSimulation(rebound.Simulation):
         """
         print("Initializing new simulation instance...")
 
-        self.integrator = "whfast"  # Fast and unbiased symplectic Wisdom-Holman integrator.
-        self.collision = "direct"  # Brute force collision search and scales as O(N^2).
-        self.collision_resolve = "merge"
-        if Parameters.int_spec["fix_source_circular_orbit"]:
-            self.heartbeat = heartbeat
-
-        # SI units:
-        self.units = ('m', 's', 'kg')
-        self.G = 6.6743e-11
+        self._configure_integration()
+        if Parameters.int_spec["seed"] is not None:
+            set_seed(Parameters.int_spec["seed"])
 
         # REBOUNDx Additional Forces
         self.rebx = reboundx.Extras(self)
@@ -175,6 +198,7 @@ class SerpensSimulation(rebound.Simulation):
                 continue
             else:
                 v_copy = v.copy()
+                v_copy.pop('source', None)
                 if self.N == 0:
                     self.add(**v_copy, hash=k)
                     self.particles[0].params["radiation_source"] = 1
@@ -186,6 +210,10 @@ class SerpensSimulation(rebound.Simulation):
         # Init save
         self.save_to_file("archive.bin", delete_file=True)
         self.rebx.save("rebx.bin")
+        if os.path.exists("archive_compact.bin"):
+            os.remove("archive_compact.bin")
+        if Parameters.int_spec["compact_snapshots"]:
+            write_compact_snapshot("archive_compact.bin", self.t, [])
 
         with open(f"Parameters.txt", "w") as f:
             f.write(f"{self.params.__str__()}")
@@ -197,6 +225,72 @@ class SerpensSimulation(rebound.Simulation):
 
         return self
 
+    def _configure_integration(self):
+        """
+        Not meant for external use.
+        Sets integrator, collision algorithm, heartbeat and units.
+        """
+        self.integrator = "whfast"  # Fast and unbiased symplectic Wisdom-Holman integrator.
+        self.collision = "direct"  # Brute force collision search and scales as O(N^2).
+        self.collision_resolve = "merge"
+        if Parameters.int_spec["fix_source_circular_orbit"]:
+            self.heartbeat = heartbeat
+
+        # SI units:
+        self.units = ('m', 's', 'kg')
+        self.G = 6.6743e-11
+
+    def save_checkpoint(self):
+        """
+        Saves the full simulation state to 'checkpoint.bin', 'rebx.bin' and 'serpens_state.pkl', including the state
+        of the random number generators of the particle creation.
+        Unlike the snapshots of the archive, the checkpoint always contains all particles in double precision.
+        It gets overwritten at the end of every call to 'advance' and allows for continuing a simulation using
+        'from_checkpoint'.
+        """
+        self.save_to_file("checkpoint.bin", delete_file=True)
+        self.rebx.save("rebx.bin")
+
+        state = {
+            "serpens_iter": self.serpens_iter,
+            "num_sources": self.num_sources,
+            "source_obj_dict": self.source_obj_dict,
+            "obj_primary_dict": {k: v for k, v in self.obj_primary_dict.items() if v is None or isinstance(v, str)},
+            "source_parameter_sets": self.source_parameter_sets,
+            "rng_state": get_rng_state()
+        }
+        with open("serpens_state.pkl", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def from_checkpoint(cls):
+        """
+        Restores a simulation from the checkpoint files in the working directory (see 'save_checkpoint').
+        Further advances append to the existing archive.
+        The parameters of the simulation need to be set (e.g. through 'NewParams') before calling this function.
+        """
+        with open("serpens_state.pkl", "rb") as f:
+            state = pickle.load(f)
+        checkpoint = rebound.Simulation("checkpoint.bin")
+
+        sim = cls(init_serpens=False)
+        sim._configure_integration()
+        for particle in checkpoint.particles:
+            sim.add(particle, test_particle=True)
+        sim.N_active = checkpoint.N_active
+        sim.t = checkpoint.t
+        sim.rebx = reboundx.Extras(sim, "rebx.bin")
+
+        sim.serpens_iter = state["serpens_iter"]
+        sim.num_sources = state["num_sources"]
+        sim.source_obj_dict = state["source_obj_dict"]
+        sim.obj_primary_dict = state["obj_primary_dict"]
+        sim.source_parameter_sets = state["source_parameter_sets"]
+        if "rng_state" in state:
+            # A resumed simulation continues the random streams of the interrupted one.
+            set_rng_state(state["rng_state"])
+        return sim
+
     def add(self, particle=None, test_particle=False, **kwargs):
         if not isinstance(particle, str):
             if particle is None:
@@ -235,10 +329,12 @@ class SerpensSimulation(rebound.Simulation):
                 for s in range(self.params.num_species):
                     species = self.params.get_species(num=s + 1)
 
-                    rth = create(source_state, source.r, "thermal", species)
-                    rsp = create(source_state, source.r, "sputter", species)
+                    with self.recorder.phase("create"):
+                        rth = create(source_state, source.r, "thermal", species)
+                        rsp = create(source_state, source.r, "sputter", species)
 
                     r = np.vstack((rth.reshape(len(rth), 6), rsp.reshape(len(rsp), 6)))
+                    self.recorder.add("mem_creation_buffers", rth.nbytes + rsp.nbytes + r.nbytes)
 
                     for index, coord in enumerate(r):
                         identifier = f"{species.id}_{self.serpens_iter}_{source_index}_{index}"
@@ -256,7 +352,9 @@ class SerpensSimulation(rebound.Simulation):
             all_species = [s['species'][f'species{i+1}'] for s in self.source_parameter_sets for i in range(len(s['species']))]
             Parameters.modify_species(*all_species)
 
-        self.rebx.save("rebx.bin")
+        with self.recorder.phase("save_rebx"):
+            self.rebx.save("rebx.bin")
+        self.recorder.add("bytes_rebx", os.path.getsize("rebx.bin"))
         return
 
     def object_to_source(self, name, species):
@@ -287,6 +385,7 @@ class SerpensSimulation(rebound.Simulation):
                   celestial_name=parameter_set['celest']['SYSTEM-NAME']
                   )()
 
+    @profiled
     def advance_integrate(self):
         source0_str = self.source_obj_dict["source0"]
         primary = self.particles[rebound.hash(self.particles[source0_str].params['source_primary'])]
@@ -294,7 +393,7 @@ class SerpensSimulation(rebound.Simulation):
         adv = orbital_period0 * self.params.int_spec["sim_advance"]
         self.dt = adv / 10
 
-        threads_count = multiprocessing.cpu_count()
+        threads_count = self._budget_worker_copies(num_threads())
 
         particle_indices = list(range(self.N_active, self.N))
         particle_splits = np.array_split(particle_indices, threads_count)
@@ -304,31 +403,34 @@ class SerpensSimulation(rebound.Simulation):
         processes = []
         processes_rebx = []
         processes_operators = []
-        for i in range(threads_count):
-            copy = self.copy()
-
-            copy.integrator = "whfast"
-            copy.collision = "direct"
-            copy.collision_resolve = "merge"
-            if Parameters.int_spec["fix_source_circular_orbit"]:
-                copy.heartbeat = heartbeat
-            copy_rebx = reboundx.Extras(copy, "rebx.bin")
-
-            weightop = copy_rebx.create_operator("weightloss")
-            weightop.operator_type = "recorder"
-            weightop.step_function = weight_operator
-            copy_rebx.add_operator(weightop, dtfraction=1., timing="post")
-            processes_operators.append(weightop)
-
-            indices_to_keep_set = set(proc_indices[i])
-            for j in reversed(range(copy.N)):
-                if j not in indices_to_keep_set:
-                    copy.remove(index=j)
-
-            processes.append(copy)
-            processes_rebx.append(copy_rebx)
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=threads_count) as executor:
+        with self.recorder.phase("copy"):
+            for i in range(threads_count):
+                copy = self.copy()
+
+                copy.integrator = "whfast"
+                copy.collision = "direct"
+                copy.collision_resolve = "merge"
+                if Parameters.int_spec["fix_source_circular_orbit"]:
+                    copy.heartbeat = heartbeat
+                copy_rebx = reboundx.Extras(copy, "rebx.bin")
+
+                weightop = copy_rebx.create_operator("weightloss")
+                weightop.operator_type = "recorder"
+                weightop.step_function = weight_operator
+                copy_rebx.add_operator(weightop, dtfraction=1., timing="post")
+                processes_operators.append(weightop)
+
+                indices_to_keep_set = set(proc_indices[i])
+                for j in reversed(range(copy.N)):
+                    if j not in indices_to_keep_set:
+                        copy.remove(index=j)
+
+                processes.append(copy)
+                processes_rebx.append(copy_rebx)
+        self.recorder.set("mem_worker_copies", sum(simulation_nbytes(p) for p in processes))
+
+        with self.recorder.phase("integrate"), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=threads_count) as executor:
             future_to_result = {
                 executor.submit(
                     lambda x: x.integrate(adv * (self.serpens_iter + 1), exact_finish_time=0), p): p for p in processes
@@ -337,51 +439,223 @@ class SerpensSimulation(rebound.Simulation):
             for future in concurrent.futures.as_completed(future_to_result):
                 future.result()
 
-        n_active = self.N_active
-        del self.particles
+        with self.recorder.phase("merge"):
+            n_active = self.N_active
+            del self.particles
+
+            for i in range(n_active):
+                self.add(processes[0].particles[i])
+
+            for simulation, rebx in zip(processes, processes_rebx):
+                for p in simulation.particles[simulation.N_active:]:
+                    self.add(p)
+                rebx.detach(simulation)
+
+            self.N_active = n_active
+            self.t = processes[0].t
+        self.recorder.set("worker_copies", threads_count)
+
+    def _over_memory_budget(self, additional=0):
+        """
+        Internal use only.
+        Checks whether the current resident memory plus 'additional' bytes exceeds 'memory_budget' (in MB) of the
+        integration specifics. Always False if no budget is set.
+        """
+        budget = Parameters.int_spec["memory_budget"]
+        return budget is not None and rss() + additional > budget * 1024 ** 2
+
+    def _flush_snapshots_for_budget(self, additional=0):
+        """
+        Internal use only.
+        Every queued snapshot holds a full copy of the simulation. If the memory budget would be exceeded, waits for
+        the snapshot writer to finish before continuing.
+        """
+        if self.snapshot_writer.pending and self._over_memory_budget(additional):
+            self.snapshot_writer.flush()
+            self.recorder.add("budget_flushes", 1)
 
-        for i in range(n_active):
-            self.add(processes[0].particles[i])
+    def _budget_worker_copies(self, threads_count):
+        """
+        Internal use only.
+        Returns the number of worker copies for the integration that fit into the memory budget (see
+        'worker_copies_within_budget' in src/instrumentation.py).
+        Test particles are split among the copies, while active particles are duplicated in each copy. Every copy is
+        complete until it gets pruned, which adds one full simulation to the peak memory regardless of the number of
+        copies.
+        """
+        budget = Parameters.int_spec["memory_budget"]
+        if budget is None:
+            return threads_count
 
-        for simulation, rebx in zip(processes, processes_rebx):
-            for p in simulation.particles[simulation.N_active:]:
-                self.add(p)
-            rebx.detach(simulation)
+        per_particle = simulation_nbytes(self) / max(self.N, 1)
+        test_particles = self.N - self.N_active
+        self._flush_snapshots_for_budget(per_particle * (self.N + test_particles + threads_count * self.N_active))
 
-        self.N_active = n_active
-        self.t = processes[0].t
+        copies = worker_copies_within_budget(threads_count, self.N, self.N_active, per_particle, rss(),
+                                             budget * 1024 ** 2)
+        if self._over_memory_budget(per_particle * (self.N + test_particles + copies * self.N_active)):
+            print(f"Warning: Memory budget of {budget} MB is exceeded in advance {self.serpens_iter}.")
+        return copies
 
     def advance_single(self):
         # ADD & REMOVE PARTICLES
-        self._add_particles()
-        self.advance_integrate()
+        n_before = self.N
+        with self.recorder.phase("add_particles"):
+            self._add_particles()
+        self.recorder.set("injected", self.N - n_before)
 
-        source0_str = self.source_obj_dict["source0"]
-        primary = self.particles[rebound.hash(self.particles[source0_str].params['source_primary'])]
-        #orbital_period0 = self.particles["source0"].orbit(primary=primary).P
-        boundary0 = self.params.int_spec["r_max"] * self.particles[source0_str].orbit(primary=primary).a
+        spawn = Parameters.int_spec.get("spawn_daughters", False)
+        if spawn:
+            hashes_before = self._test_particle_hashes()
+            weights_before = self._test_particle_params()[1]
 
-        remove = []
-        for particle in self.particles[self.N_active:]:
+        self.advance_integrate()
 
-            #species = self.params.get_species(id=species_id)
-            #mass_inject_per_advance = species.mass_per_sec * self.params.int_spec["sim_advance"] * orbital_period0
-            #pps = species.particles_per_superparticle(mass_inject_per_advance)
+        if spawn:
+            with self.recorder.phase("spawn"):
+                spawned = self._spawn_daughters(hashes_before, weights_before)
+            self.recorder.set("spawned", spawned)
+
+        with self.recorder.phase("cull"):
+            source0_str = self.source_obj_dict["source0"]
+            primary = self.particles[rebound.hash(self.particles[source0_str].params['source_primary'])]
+            #orbital_period0 = self.particles["source0"].orbit(primary=primary).P
+            boundary0 = self.params.int_spec["r_max"] * self.particles[source0_str].orbit(primary=primary).a
+
+            remove = []
+            for particle in self.particles[self.N_active:]:
+
+                #species = self.params.get_species(id=species_id)
+                #mass_inject_per_advance = species.mass_per_sec * self.params.int_spec["sim_advance"] * orbital_period0
+                #pps = species.particles_per_superparticle(mass_inject_per_advance)
+
+                particle_distance = np.linalg.norm(np.asarray(particle.xyz) - np.asarray(primary.xyz))
+
+                if particle_distance > boundary0: #or w * pps < 1e10:
+                    try:
+                        remove.append(particle.hash)
+                    except RuntimeError:
+                        print("Removal error occurred.")
+                        pass
+
+            for hash in remove:
+                self.remove(hash=hash)
+        self.recorder.set("removed", len(remove))
+        self.recorder.set("alive", self.N - self.N_active)
+
+        # Written in the background while the next advance integrates. 'rebx.bin' is written synchronously at
+        # injection, since the worker copies of the next advance are initialized from it.
+        with self.recorder.phase("save"):
+            self._flush_snapshots_for_budget(simulation_nbytes(self))
+            if self.params.int_spec["compact_snapshots"]:
+                self.snapshot_writer.submit(write_compact_snapshot, "archive_compact.bin", self.t,
+                                            self._compact_blocks())
+                self.snapshot_writer.submit_simulation(self, "archive.bin", active_only=True)
+            else:
+                self.snapshot_writer.submit_simulation(self, "archive.bin")
+
+    def _test_particle_hashes(self):
+        """
+        Internal use only.
+        Hashes of the test particles.
+        """
+        hashes = np.zeros(self.N, dtype="uint32")
+        self.serialize_particle_data(hash=hashes)
+        return hashes[self.N_active:]
 
-            particle_distance = np.linalg.norm(np.asarray(particle.xyz) - np.asarray(primary.xyz))
+    def _test_particle_params(self):
+        """
+        Internal use only.
+        Species ids, weights and source hashes of the test particles.
+        """
+        num_test = self.N - self.N_active
+        species = np.zeros(num_test, dtype="int")
+        weights = np.zeros(num_test, dtype="float64")
+        source_hashes = np.zeros(num_test, dtype="uint32")
+        for i, particle in enumerate(self.particles[self.N_active:]):
+            species[i] = particle.params["serpens_species"]
+            weights[i] = particle.params["serpens_weight"]
+            source_hashes[i] = particle.params["source_hash"]
+        return species, weights, source_hashes
+
+    def _spawn_daughters(self, hashes_before, weights_before):
+        """
+        Internal use only.
+        Spawns superparticles of the daughter species of the chemical networks from the weight the test particles
+        lost during the last integration (see 'spawn_daughters' in src/network.py). Daughters start at the position
+        of their parent. Returns the number of spawned particles.
 
-            if particle_distance > boundary0: #or w * pps < 1e10:
-                try:
-                    remove.append(particle.hash)
-                except RuntimeError:
-                    print("Removal error occurred.")
-                    pass
+        Arguments
+        ---------
+        hashes_before : array-like
+            Hashes of the test particles before the integration.
+        weights_before : array-like
+            Weights of the test particles before the integration.
+        """
+        xyz = np.zeros((self.N, 3), dtype="float64")
+        vxyz = np.zeros((self.N, 3), dtype="float64")
+        hashes = np.zeros(self.N, dtype="uint32")
+        self.serialize_particle_data(xyz=xyz, vxvyvz=vxyz, hash=hashes)
+        xyz, vxyz, hashes = xyz[self.N_active:], vxyz[self.N_active:], hashes[self.N_active:]
+        species, weights, source_hashes = self._test_particle_params()
+
+        # Match the particles to their weights before the integration. Merged particles have disappeared.
+        lost = np.zeros(len(hashes))
+        if len(hashes_before) > 0:
+            order = np.argsort(hashes_before)
+            position = order[np.minimum(np.searchsorted(hashes_before, hashes, sorter=order), len(order) - 1)]
+            matched = hashes_before[position] == hashes
+            lost[matched] = weights_before[position[matched]] - weights[matched]
+
+        # Weights of different species stand for different numbers of physical particles.
+        source0_str = self.source_obj_dict["source0"]
+        primary = self.particles[rebound.hash(self.particles[source0_str].params['source_primary'])]
+        adv = self.particles[source0_str].orbit(primary=primary).P * self.params.int_spec["sim_advance"]
+
+        registry = Parameters.species_registry()
+        parents, daughter_ids, daughter_weights, velocities = spawn_daughters(
+            registry, species, lost, vxyz, particle_creation.rng, Parameters.int_spec.get("daughter_min_weight", 0.),
+            registry.particles_per_weight(adv))
+
+        beta = registry.beta[registry.codes(daughter_ids)]
+        for index, (parent, daughter_id) in enumerate(zip(parents.tolist(), daughter_ids.tolist())):
+            identifier = f"{daughter_id}_{self.serpens_iter}_daughter_{index}"
+            self.add(x=xyz[parent, 0], y=xyz[parent, 1], z=xyz[parent, 2],
+                     vx=velocities[index, 0], vy=velocities[index, 1], vz=velocities[index, 2],
+                     hash=identifier, test_particle=True)
+
+            self.particles[identifier].params["beta"] = beta[index]
+            self.particles[identifier].params["serpens_species"] = daughter_id
+            self.particles[identifier].params["serpens_weight"] = daughter_weights[index]
+            self.particles[identifier].params["source_hash"] = int(source_hashes[parent])
+        return len(parents)
+
+    def _compact_blocks(self):
+        """
+        Internal use only.
+        Collects the test particles per source for the compact snapshot format (see src/compact_archive.py).
+        """
+        xyz = np.zeros((self.N, 3), dtype="float64")
+        vxyz = np.zeros((self.N, 3), dtype="float64")
+        hashes = np.zeros(self.N, dtype="uint32")
+        self.serialize_particle_data(xyz=xyz, vxvyvz=vxyz, hash=hashes)
 
-        for hash in remove:
-            self.remove(hash=hash)
+        species, weights, source_hashes = self._test_particle_params()
+        species, weights = species.astype("uint8"), weights.astype("float32")
 
-        self.save_to_file("archive.bin")
-        self.rebx.save("rebx.bin")
+        blocks = []
+        for source_index in range(self.num_sources):
+            source = self.particles[self.source_obj_dict[f"source{source_index}"]]
+            primary = self.particles[rebound.hash(source.params['source_primary'])]
+            mask = source_hashes == source.hash.value
+            blocks.append((source.hash.value, np.r_[primary.xyz, primary.vxyz], {
+                "hash": hashes[self.N_active:][mask],
+                "species": species[mask],
+                "weight": weights[mask],
+                "xyz": xyz[self.N_active:][mask],
+                "vxyz": vxyz[self.N_active:][mask]
+            }))
+        return blocks
 
     def advance(self, num_sim_advances, verbose=False):
         """
@@ -393,56 +667,80 @@ class SerpensSimulation(rebound.Simulation):
         ---------
         num_sim_advances : int
             Number of advances to simulate.
-        save_freq : int     (default: 1)
-            Number of advances after which SERPENS saves the simulation instance.
         verbose : bool      (default: False)
             Enable printing of logs.
+
+        Returns
+        -------
+        Number of advances done, which is lower than 'num_sim_advances' if the simulation stopped at steady state.
         """
         start_time = time.time()
+        advances_done = 0
         steady_state_counter = 0
         steady_state_breaker = None
 
-        for _ in tqdm(range(num_sim_advances), disable=verbose):
-            if verbose:
-                print(f"Starting SERPENS advance {self.serpens_iter} ... ")
-
-            n_before = self.N
-            self.advance_single()
-
-            if verbose:
-                t = self.t
-                print(f"Advance done! \n"
-                      f"Simulation time [h]: {np.around(t / 3600, 2)} \n"
-                      f"Simulation runtime [s]: {np.around(time.time() - start_time, 2)} \n"
-                      f"Number of particles: {self.N}")
-
-            # Handle steady state (1/2)
-            if np.abs(self.N - n_before) < 50:
-                steady_state_counter += 1
-                if steady_state_counter == 10 and self.params.int_spec["stop_at_steady_state"] is True:
-                    print("Steady state reached!")
-                    print("Stopping after another successful revolution...")
-                    steady_state_breaker = 1
-            else:
-                steady_state_counter = 0
-
-            # Handle steady state (2/2)
-            if steady_state_breaker is not None:
-                print(f"Advances left: {1 / self.params.int_spec['sim_advance'] - steady_state_breaker}")
-                if steady_state_breaker == 1 / self.params.int_spec["sim_advance"]:
-                    break
+        try:
+            for _ in tqdm(range(num_sim_advances), disable=verbose):
+                if verbose:
+                    print(f"Starting SERPENS advance {self.serpens_iter} ... ")
+
+                n_before = self.N
+                bytes_before = self.snapshot_writer.bytes_written
+                self.recorder.start(self.serpens_iter)
+                profiling.start(f"advance_{self.serpens_iter:04d}")
+                self.advance_single()
+                advances_done += 1
+                profiling.stop()
+                # Snapshots are written asynchronously. Counts bytes that were written during this advance.
+                self.recorder.set("bytes_snapshots", self.snapshot_writer.bytes_written - bytes_before)
+                self.recorder.set("t", self.t)
+                self.recorder.set("mem_snapshot_queue", self.snapshot_writer.pending_bytes)
+                self.recorder.set("mem_rss", rss())
+                self.recorder.set("mem_peak_rss", peak_rss())
+                self.recorder.stop()
+
+                if verbose:
+                    t = self.t
+                    print(f"Advance done! \n"
+                          f"Simulation time [h]: {np.around(t / 3600, 2)} \n"
+                          f"Simulation runtime [s]: {np.around(time.time() - start_time, 2)} \n"
+                          f"Number of particles: {self.N}")
+                    print(f"Phases: \n{self.recorder.summary()}")
+
+                # Handle steady state (1/2)
+                if np.abs(self.N - n_before) < 50:
+                    steady_state_counter += 1
+                    if steady_state_counter == 10 and self.params.int_spec["stop_at_steady_state"] is True:
+                        print("Steady state reached!")
+                        print("Stopping after another successful revolution...")
+                        steady_state_breaker = 1
                 else:
-                    steady_state_breaker += 1
-
-            # End iteration
-            self.serpens_iter += 1
-            if verbose:
-                print("\t ... done!\n============================================")
+                    steady_state_counter = 0
+
+                # Handle steady state (2/2)
+                if steady_state_breaker is not None:
+                    print(f"Advances left: {1 / self.params.int_spec['sim_advance'] - steady_state_breaker}")
+                    if steady_state_breaker == 1 / self.params.int_spec["sim_advance"]:
+                        break
+                    else:
+                        steady_state_breaker += 1
+
+                # End iteration
+                self.serpens_iter += 1
+                if verbose:
+                    print("\t ... done!\n============================================")
+
+        finally:
+            profiling.stop()
+            # Make sure all snapshots are on disk before returning.
+            self.snapshot_writer.flush()
+            self.save_checkpoint()
 
         self.print_simulation_end_message()
+        return advances_done
 
     @staticmethod
     def print_simulation_end_message():
-        with open('docs/sim_end_message.txt', 'r') as f:
+        with open(os.path.join(DOCS_PATH, 'sim_end_message.txt'), 'r') as f:
             end_message = f.read()
         print(end_message)
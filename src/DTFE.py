@@ -4,37 +4,37 @@ from scipy.spatial import Delaunay
 import numba
 from numba import float32, float64, int64
 from typing import Union
+from src.profiling import profiled
 
 
-@numba.jit(nopython=True, nogil=True)
+@numba.jit(nopython=True, nogil=True, cache=True)
 def triangle_area(sim: int64[:], points: float64[:, :]):
     return abs(np.linalg.det(np.stack((points[sim[1]] - points[sim[0]],
                                        points[sim[2]] - points[sim[0]])))) / 2
 
 
-@numba.jit(nopython=True, nogil=True)
-def compute_densities(pts: float64[:, :], simps: float64[:, :],
-                      m: Union[float64, float64[:]]) -> np.ndarray:
+@numba.jit(nopython=True, nogil=True, cache=True)
+def compute_densities(pts: float64[:, :], simps: float64[:, :], m: float64[:],
+                      rho: Union[float32[:], float64[:]]) -> None:
+    # Volumes are accumulated in double precision, 'rho' may be single precision.
     M = len(pts)
-    rho = np.zeros(M, dtype='float64')
+    vol_sum = np.zeros(M, dtype='float64')
     for sim in simps:
         vol = triangle_area(sim, pts)
         for index in sim:
-            rho[index] += vol
-    return (2 + 1) * m / rho
+            vol_sum[index] += vol
+    for i in range(M):
+        # Points that are not part of any simplex (e.g. duplicates) get an infinite density, as in numpy.
+        rho[i] = (2 + 1) * m[i] / vol_sum[i] if vol_sum[i] > 0 else np.inf
 
 
-@numba.jit(nopython=True, nogil=True)
-def compute_gradients(pts: float64[:, :], simps: float64[:, :], rho: float64[:],
-                      v: float64[:, :]) -> tuple:
-    N = len(simps)
-    Drho = np.zeros((N, 2), dtype='float64')
-    Dv = np.zeros((N, 2, 2), dtype='float64')
-
+@numba.jit(nopython=True, nogil=True, cache=True)
+def compute_density_gradients(pts: float64[:, :], simps: float64[:, :], rho: Union[float32[:], float64[:]],
+                              Drho: Union[float32[:, :], float64[:, :]]) -> None:
+    # Gradients are computed in double precision and written to the (possibly single precision) output.
     for i, s in enumerate(simps):
         [p0, p1, p2] = pts[s]
-        [r0, r1, r2] = rho[s]
-        [v0, v1, v2] = v[s]
+        [r0, r1, r2] = rho[s].astype(np.float64)
 
         A: float64[:, :] = np.stack((p1 - p0, p2 - p0))
         det = A[0, 0] * A[1, 1] - A[1, 0] * A[0, 1]
@@ -42,11 +42,25 @@ def compute_gradients(pts: float64[:, :], simps: float64[:, :], rho: float64[:],
                          [-A[1, 0] / det, A[0, 0] / det]])
         # Ainv: float64[:,:] = np.linalg.inv(A)
         Drho[i] = Ainv @ np.array([r1 - r0, r2 - r0])
+
+
+@numba.jit(nopython=True, nogil=True, cache=True)
+def compute_velocity_gradients(pts: float64[:, :], simps: float64[:, :], v: Union[float32[:, :], float64[:, :]],
+                               Dv: Union[float32[:, :, :], float64[:, :, :]]) -> None:
+    # Gradients are computed in double precision and written to the (possibly single precision) output.
+    for i, s in enumerate(simps):
+        [p0, p1, p2] = pts[s]
+        [v0, v1, v2] = v[s].astype(np.float64)
+
+        A: float64[:, :] = np.stack((p1 - p0, p2 - p0))
+        det = A[0, 0] * A[1, 1] - A[1, 0] * A[0, 1]
+        Ainv = np.array([[A[1, 1] / det, -A[0, 1] / det],
+                         [-A[1, 0] / det, A[0, 0] / det]])
+        # Ainv: float64[:,:] = np.linalg.inv(A)
         Dv[i] = Ainv @ np.stack((v1 - v0, v2 - v0))
-    return (Drho, Dv)
 
 
-@numba.jit(nopython=True, nogil=True)
+@numba.jit(nopython=True, nogil=True, cache=True)
 def map_affine(a, b, c):
     assert (len(a) == len(b) == len(c))
     result = np.zeros_like(a)
@@ -55,42 +69,170 @@ def map_affine(a, b, c):
     return result
 
 
+def morton_order(points):
+    """
+    Returns the permutation sorting points along a Morton (Z-order) curve. Neighbouring points in this order are close
+    in space, which improves the memory locality of the Delaunay construction.
+    """
+    d = points.shape[1]
+    bits = 64 // d
+    lower = points.min(axis=0)
+    extent = (points.max(axis=0) - lower).max()
+    scale = (2 ** bits - 1) / extent if extent > 0 else 0.
+    cells = ((points - lower) * scale).astype(np.uint64)
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(bits):
+        for axis in range(d):
+            codes |= ((cells[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(bit * d + axis)
+    return np.argsort(codes, kind='stable')
+
+
 # The Delaunay Tesselation Field Estimator
 class DTFE:
-    def __init__(self, points, velocities, m):
+    @profiled
+    def __init__(self, points, velocities, m, precision="double", origin=None, spatial_sort=False):
+        """
+        Arguments
+        ---------
+        points : array-like (shape (N, 2))
+            Particle positions.
+        velocities : array-like (shape (N, 2))
+            Particle velocities.
+        m : float or array-like (shape (N,))
+            Mass (weight) of the particles.
+        precision : str     (default: "double")
+            "double" or "single". In single precision, densities, velocities and gradients are stored as float32,
+            which halves their memory. They are still computed in double precision (as is the tessellation).
+            Compared to double precision with the same origin, interpolated densities deviate by a relative amount
+            of about 1e-6 (below 1e-4 at the particle positions themselves).
+        origin : array-like (shape (2,))     (default: None)
+            Positions are shifted by this origin (e.g. the position of the source's primary) before the tessellation,
+            which keeps the coordinates small. Queries use the unshifted coordinates. In single precision, the center
+            of the bounding box is used if no origin is given.
+        spatial_sort : bool     (default: False)
+            Tessellate the particles in Morton (Z-curve) order, which speeds up the Qhull build of spatially
+            unordered clouds (such as particles in injection order). All per-particle arrays ('rho', 'velocities')
+            and the vertices of 'delaunay' are then in tessellation order, i.e. 'points[order]'. Interpolated fields
+            do not depend on the order.
+        """
+        if precision not in ("double", "single"):
+            raise ValueError(f"Invalid precision '{precision}'. Use 'double' or 'single'.")
+        self.dtype = np.dtype('float64') if precision == "double" else np.dtype('float32')
+
+        points = np.asarray(points, dtype='float64')
+        if origin is None and precision == "single":
+            origin = (points.min(axis=0) + points.max(axis=0)) / 2
+        self.origin = None if origin is None else np.asarray(origin, dtype='float64')
+
         #print("Delaunay Tesselation Field Estimator initialization:")
-        self.velocities = velocities
-        #print("\t-Evaluate Delaunay tessellation")
-        self.delaunay = Delaunay(points)
+        # Fixed (contiguous) argument types, such that the cached kernels are reused.
+        velocities = np.asarray(velocities)
+        m = np.broadcast_to(np.asarray(m, dtype='float64'), (len(points),))
+        self.order = morton_order(points) if spatial_sort else None
+        if self.order is not None:
+            points, velocities, m = points[self.order], velocities[self.order], m[self.order]
+            self._inverse = np.empty_like(self.order)
+            self._inverse[self.order] = np.arange(len(self.order))
+        self.velocities = np.ascontiguousarray(velocities, dtype=self.dtype)
+        m = np.ascontiguousarray(m)
 
-        # Area of a triangle
+        #print("\t-Evaluate Delaunay tessellation")
+        self.delaunay = Delaunay(points if self.origin is None else points - self.origin)
 
         # The density estimate
         #print("\t-Evaluate density estimate")
-        self.rho = compute_densities(self.delaunay.points, self.delaunay.simplices, m)
-        # The gradients
-        #print("\t-Evaluate gradients")
-        self.Drho, self.Dv = compute_gradients(self.delaunay.points, self.delaunay.simplices,
-                                               self.rho, self.velocities)
+        self.rho = np.empty(len(points), dtype=self.dtype)
+        compute_densities(self.delaunay.points, self.delaunay.simplices, m, self.rho)
+
+        # The gradients are evaluated on first use (density-only analyses never need the velocity gradients).
+        self._Drho = None
+        self._Dv = None
+        # Location of the last query points (see '_locate').
+        self._location = None
+
+    @property
+    def Drho(self):
+        """
+        Density gradient per simplex. Computed on first use.
+        """
+        if self._Drho is None:
+            Drho = np.empty((len(self.delaunay.simplices), 2), dtype=self.dtype)
+            compute_density_gradients(self.delaunay.points, self.delaunay.simplices, self.rho, Drho)
+            self._Drho = Drho
+        return self._Drho
+
+    @property
+    def Dv(self):
+        """
+        Velocity gradient per simplex. Computed on first use of 'v', 'theta', 'omega', 'sigma' or 'gradV'.
+        """
+        if self._Dv is None:
+            Dv = np.empty((len(self.delaunay.simplices), 2, 2), dtype=self.dtype)
+            compute_velocity_gradients(self.delaunay.points, self.delaunay.simplices, self.velocities, Dv)
+            self._Dv = Dv
+        return self._Dv
+
+    def _locate(self, x, y):
+        """
+        Internal use only.
+        Returns the simplices containing the query points, the query points in the (shifted) coordinates of the
+        tessellation and the index of the reference vertex of each simplex.
+        The location of the last query is cached, such that evaluating several fields on the same points locates
+        them only once. Queries at the particle positions themselves use the incident simplex of each vertex.
+        """
+        q = np.c_[x, y] if self.origin is None else np.c_[x, y] - self.origin
+        if self._location is not None and self._location[0].shape == q.shape and np.array_equal(self._location[0], q):
+            return self._location[1], q, self._location[2]
+
+        vertices = self.delaunay.points if self.order is None else self.delaunay.points[self._inverse]
+        if q.shape == vertices.shape and np.array_equal(q, vertices):
+            pointIndex = np.arange(len(q)) if self.order is None else self._inverse.copy()
+            simplexIndex = self.delaunay.vertex_to_simplex[pointIndex]
+            # Particles that are not vertices (e.g. duplicate points) are located as usual. Qhull maps them to a
+            # simplex of a nearby vertex, which does not contain them as a vertex.
+            missing = np.flatnonzero((simplexIndex == -1) |
+                                     ~(self.delaunay.simplices[simplexIndex] == pointIndex[:, None]).any(axis=1))
+            if len(missing) > 0:
+                simplexIndex[missing] = self.delaunay.find_simplex(q[missing])
+                pointIndex[missing] = self.delaunay.simplices[simplexIndex[missing]][..., 0]
+        else:
+            simplexIndex = self.delaunay.find_simplex(q)
+            pointIndex = self.delaunay.simplices[simplexIndex][..., 0]
+        self._location = (q, simplexIndex, pointIndex)
+        return simplexIndex, q, pointIndex
 
     # The interpolations
     def density(self, x, y):
-        simplexIndex = self.delaunay.find_simplex(np.c_[x, y])
-        pointIndex = self.delaunay.simplices[simplexIndex][..., 0]
-        m = map_affine(self.rho[pointIndex], self.Drho[simplexIndex], np.c_[x, y] - self.delaunay.points[pointIndex])
+        simplexIndex, q, pointIndex = self._locate(x, y)
+        offsets = (q - self.delaunay.points[pointIndex]).astype(self.dtype, copy=False)
+        m = map_affine(self.rho[pointIndex], self.Drho[simplexIndex], offsets).astype('float64', copy=False)
         m[simplexIndex == -1] = 0
         return m
 
     def v(self, x, y):
-        simplexIndex = self.delaunay.find_simplex(np.c_[x, y])
-        pointIndex = self.delaunay.simplices[simplexIndex][..., 0]
-        return map_affine(self.velocities[pointIndex], self.Dv[simplexIndex],
-                          np.c_[x, y] - self.delaunay.points[pointIndex])
+        simplexIndex, q, pointIndex = self._locate(x, y)
+        offsets = (q - self.delaunay.points[pointIndex]).astype(self.dtype, copy=False)
+        # Dv[i, j, k] is the derivative of the k-th velocity component along the j-th axis.
+        Dv = np.ascontiguousarray(self.Dv[simplexIndex].transpose(0, 2, 1))
+        return map_affine(self.velocities[pointIndex], Dv, offsets).astype('float64', copy=False)
 
     def theta(self, x, y):
-        simplexIndex = self.delaunay.find_simplex(np.c_[x, y])
+        simplexIndex = self._locate(x, y)[0]
         return self.Dv[simplexIndex][..., 0, 0] + self.Dv[simplexIndex][..., 1, 1]
 
     def omega(self, x, y):
-        simplexIndex = self.delaunay.find_simplex(np.c_[x, y])
+        simplexIndex = self._locate(x, y)[0]
         return self.Dv[simplexIndex][..., 1, 0] - self.Dv[simplexIndex][..., 0, 1]
+
+
+def warmup():
+    """
+    Compiles the kernels for the argument types used by 'DTFE', or loads them from the on-disk cache
+    (__pycache__ next to this file). Call once per process, e.g. in the initializer of a worker pool, to keep the
+    compilation out of the first density estimation.
+    """
+    points = np.random.default_rng(0).uniform(size=(16, 2))
+    for precision in ("double", "single"):
+        dtfe = DTFE(points, points, 1., precision=precision)
+        dtfe.density(*points.T)
+        dtfe.v(*points.T)
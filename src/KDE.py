@@ -0,0 +1,103 @@
+# Load the numpy and scipy libraries
+import numpy as np
+from scipy.spatial import cKDTree
+from src.profiling import profiled
+
+# Normalization of the cubic spline kernel in 1, 2 and 3 dimensions.
+CUBIC_SPLINE_NORM = {1: 2 / 3, 2: 10 / (7 * np.pi), 3: 1 / np.pi}
+
+# Number of query points handled at once, which bounds the memory of the neighbour lists to CHUNK_SIZE * k entries.
+CHUNK_SIZE = 2 ** 16
+
+
+def cubic_spline(r, h, d):
+    """
+    Cubic spline (M4) kernel with smoothing length h and compact support 2h in d dimensions.
+    """
+    q = r / h
+    w = np.where(q < 1, 1 - 1.5 * q ** 2 + 0.75 * q ** 3, np.where(q < 2, 0.25 * (2 - q) ** 3, 0.))
+    return CUBIC_SPLINE_NORM[d] / h ** d * w
+
+
+# Adaptive (SPH-style) kernel density estimator
+class KDE:
+    """
+    Kernel density estimator with adaptive smoothing lengths, as an alternative to the DTFE for very large or nearly
+    coplanar clouds. Densities are gathered over the k nearest neighbours of a query point, whose smoothing length is
+    half the distance to its k-th neighbour. Building the k-d tree is O(N log N), each query O(k log N).
+    Same interface as 'DTFE.DTFE' and 'DTFE3D.DTFE' (in 2 and 3 dimensions), except that there is no tessellation
+    ('delaunay' is None) and no velocity gradients.
+    """
+
+    @profiled
+    def __init__(self, points, velocities, m, k=32, workers=-1):
+        """
+        Arguments
+        ---------
+        points : array-like (shape (N, d))
+            Particle positions.
+        velocities : array-like (shape (N, d))
+            Particle velocities.
+        m : float or array-like (shape (N,))
+            Mass (weight) of the particles.
+        k : int     (default: 32)
+            Number of neighbours within the support of the kernel.
+        workers : int   (default: -1)
+            Number of threads used for the neighbour queries (-1: all cores).
+        """
+        self.points = np.asarray(points, dtype='float64')
+        self.velocities = np.asarray(velocities, dtype='float64')
+        self.m = np.broadcast_to(np.asarray(m, dtype='float64'), (len(self.points),))
+        self.d = self.points.shape[1]
+        self.k = max(1, min(int(k), len(self.points) - 1))
+        self.workers = workers
+
+        self.tree = cKDTree(self.points)
+        self.delaunay = None
+        self._rho = None
+
+    def _gather(self, q, values=None, exclude_self=False):
+        """
+        Internal use only.
+        Returns the kernel sum of the masses (and of the masses times 'values') over the neighbours of the query
+        points q. If 'exclude_self', q are the particle positions and each particle is left out of its own sum
+        (its self-contribution W(0, h) would bias the density upwards by about 5/k in 2D and 8/k in 3D).
+        """
+        rho = np.empty(len(q))
+        weighted = None if values is None else np.empty((len(q),) + values.shape[1:])
+        for start in range(0, len(q), CHUNK_SIZE):
+            chunk = slice(start, start + CHUNK_SIZE)
+            dist, index = self.tree.query(q[chunk], k=self.k + exclude_self, workers=self.workers)
+            dist, index = dist.reshape(len(dist), -1), index.reshape(len(index), -1)
+            if exclude_self:
+                dist, index = dist[:, 1:], index[:, 1:]
+            h = dist[:, -1:] / 2
+            # Query points on top of k identical particles have no extent; they get an infinite density.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                w = self.m[index] * cubic_spline(dist, h, self.d)
+            w[~np.isfinite(w)] = np.inf
+            rho[chunk] = w.sum(axis=1)
+            if values is not None:
+                weighted[chunk] = np.einsum('ij,ij...->i...', w, values[index])
+        return rho, weighted
+
+    @property
+    def rho(self):
+        """
+        Density at the particle positions. Computed on first use.
+        """
+        if self._rho is None:
+            self._rho = self._gather(self.points, exclude_self=True)[0]
+        return self._rho
+
+    # The interpolations
+    @profiled
+    def density(self, *coords):
+        q = np.c_[coords]
+        if q.shape == self.points.shape and np.array_equal(q, self.points):
+            return self.rho.copy()
+        return self._gather(q)[0]
+
+    def v(self, *coords):
+        rho, momentum = self._gather(np.c_[coords], self.velocities)
+        return momentum / rho[:, None]
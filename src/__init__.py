@@ -1 +1,3 @@
-# This file is needed for the source folder.
\ No newline at end of file
+# This file is needed for the source folder.
+
+__version__ = "0.3.1"
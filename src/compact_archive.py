@@ -0,0 +1,185 @@
+"""
+Compact snapshot format for SERPENS test particles.
+
+Test particles are massless and only needed for the density estimation, so they do not need to be stored as full
+REBOUND particle structs. Each snapshot stores one block per source. Positions and velocities are stored as float32
+relative to the source's primary (whose state is kept in double precision), species as uint8 and weights as float32.
+Blocks are split into chunks, which are byte-shuffled column-wise and zlib compressed.
+
+Layout of a snapshot:
+    snapshot header     <4s d I>            magic, simulation time, number of blocks
+    block header        <I 6d Q I>          source hash, primary state (x, y, z, vx, vy, vz), particles, chunks
+    chunk               <Q> + payload       length of the compressed payload, payload
+"""
+
+import os
+import struct
+import zlib
+import numpy as np
+
+
+MAGIC = b"SRPC"
+CHUNK_SIZE = 2 ** 16
+
+PARTICLE_DTYPE = np.dtype([
+    ("hash", "<u4"),
+    ("source_hash", "<u4"),
+    ("species", "u1"),
+    ("weight", "<f4"),
+    ("xyz", "<f4", (3,)),
+    ("vxyz", "<f4", (3,))
+])
+
+_SNAPSHOT_HEADER = struct.Struct("<4sdI")
+_BLOCK_HEADER = struct.Struct("<I6dQI")
+_CHUNK_HEADER = struct.Struct("<Q")
+
+
+def _pack_chunk(chunk):
+    """
+    Internal use only.
+    Stores each field contiguously and shuffles the bytes of each field, such that equal significance bytes of
+    consecutive values are adjacent. This increases the compression ratio of the float fields considerably.
+    """
+    n = len(chunk)
+    columns = []
+    for name in PARTICLE_DTYPE.names:
+        column = np.ascontiguousarray(chunk[name])
+        itemsize = column.dtype.itemsize if column.ndim == 1 else column.dtype.itemsize * column.shape[1]
+        columns.append(column.view(np.uint8).reshape(n, itemsize).T.tobytes())
+    return zlib.compress(b"".join(columns), 6)
+
+
+def _unpack_chunk(payload, n):
+    """
+    Internal use only.
+    Inverse of '_pack_chunk'.
+    """
+    raw = np.frombuffer(zlib.decompress(payload), dtype=np.uint8)
+    chunk = np.empty(n, dtype=PARTICLE_DTYPE)
+    offset = 0
+    for name in PARTICLE_DTYPE.names:
+        field = chunk[name]
+        itemsize = field.dtype.itemsize if field.ndim == 1 else field.dtype.itemsize * field.shape[1]
+        size = n * itemsize
+        column = raw[offset:offset + size].reshape(itemsize, n).T
+        field[...] = np.ascontiguousarray(column).view(field.dtype).reshape(field.shape)
+        offset += size
+    return chunk
+
+
+def write_compact_snapshot(filename, t, blocks):
+    """
+    Append a snapshot to a compact archive.
+
+    Arguments
+    ---------
+    filename : str
+        Path to the compact archive. Created if it does not exist.
+    t : float
+        Simulation time of the snapshot.
+    blocks : list
+        One entry per source as a tuple (source_hash, primary_state, particles).
+        'primary_state' is an array-like of shape (6,) containing position and velocity of the source's primary.
+        'particles' is a dict with entries "hash", "species", "weight", "xyz" and "vxyz" (absolute coordinates).
+
+    Returns
+    -------
+    Number of bytes written.
+    """
+    buffer = [_SNAPSHOT_HEADER.pack(MAGIC, t, len(blocks))]
+    for source_hash, primary_state, particles in blocks:
+        primary_state = np.asarray(primary_state, dtype="float64").reshape(6)
+        n = len(particles["hash"])
+
+        data = np.empty(n, dtype=PARTICLE_DTYPE)
+        data["hash"] = particles["hash"]
+        data["source_hash"] = source_hash
+        data["species"] = particles["species"]
+        data["weight"] = particles["weight"]
+        data["xyz"] = np.asarray(particles["xyz"], dtype="float64") - primary_state[:3]
+        data["vxyz"] = np.asarray(particles["vxyz"], dtype="float64") - primary_state[3:]
+
+        chunks = [data[i:i + CHUNK_SIZE] for i in range(0, n, CHUNK_SIZE)]
+        buffer.append(_BLOCK_HEADER.pack(source_hash, *primary_state, n, len(chunks)))
+        for chunk in chunks:
+            payload = _pack_chunk(chunk)
+            buffer.append(_CHUNK_HEADER.pack(len(payload)))
+            buffer.append(payload)
+
+    data = b"".join(buffer)
+    with open(filename, "ab") as f:
+        f.write(data)
+    return len(data)
+
+
+class CompactArchive:
+    """
+    Read access to a compact archive written by 'write_compact_snapshot'.
+    Indexing works like for a REBOUND Simulationarchive and returns a dictionary of particle arrays in absolute
+    (double precision) coordinates.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._offsets = []
+        self._index()
+
+    def _index(self):
+        """
+        Internal use only.
+        Records the file offset of every snapshot. Only headers are read.
+        """
+        size = os.path.getsize(self.filename)
+        with open(self.filename, "rb") as f:
+            offset = 0
+            while offset + _SNAPSHOT_HEADER.size <= size:
+                f.seek(offset)
+                magic, _, num_blocks = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+                if magic != MAGIC:
+                    raise ValueError(f"Corrupt compact archive '{self.filename}' at byte {offset}.")
+                position = offset + _SNAPSHOT_HEADER.size
+                for _ in range(num_blocks):
+                    f.seek(position)
+                    *_, num_chunks = _BLOCK_HEADER.unpack(f.read(_BLOCK_HEADER.size))
+                    position += _BLOCK_HEADER.size
+                    for _ in range(num_chunks):
+                        f.seek(position)
+                        length, = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+                        position += _CHUNK_HEADER.size + length
+                if position > size:
+                    # Incomplete trailing snapshot (e.g. interrupted write)
+                    break
+                self._offsets.append(offset)
+                offset = position
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        offset = self._offsets[index]
+        with open(self.filename, "rb") as f:
+            f.seek(offset)
+            _, t, num_blocks = _SNAPSHOT_HEADER.unpack(f.read(_SNAPSHOT_HEADER.size))
+            parts = []
+            for _ in range(num_blocks):
+                source_hash, *primary_state, n, num_chunks = _BLOCK_HEADER.unpack(f.read(_BLOCK_HEADER.size))
+                primary_state = np.asarray(primary_state)
+                for _ in range(num_chunks):
+                    length, = _CHUNK_HEADER.unpack(f.read(_CHUNK_HEADER.size))
+                    parts.append((_unpack_chunk(f.read(length), min(n, CHUNK_SIZE)), primary_state))
+                    n -= CHUNK_SIZE
+
+        data = np.concatenate([p for p, _ in parts]) if parts else np.empty(0, dtype=PARTICLE_DTYPE)
+        origin = np.concatenate([np.repeat(s[None, :], len(p), axis=0) for p, s in parts]) if parts \
+            else np.empty((0, 6))
+
+        return {
+            "t": t,
+            "hash": data["hash"].copy(),
+            "source_hash": data["source_hash"].copy(),
+            "species": data["species"].astype("int"),
+            "weight": data["weight"].astype("float64"),
+            "xyz": data["xyz"].astype("float64") + origin[:, :3],
+            "vxyz": data["vxyz"].astype("float64") + origin[:, 3:]
+        }
@@ -1,11 +1,89 @@
+import concurrent.futures
 import numpy as np
 from src.parameters import Parameters
+from src.emission import surface_map, day_side_map
+from src.profiling import profiled
 
-from scipy.optimize import fmin
-from scipy.stats import truncnorm, maxwell, norm, rv_continuous
 
+# Random number generator of the particle creation. Re-seeded through 'set_seed'.
+rng = np.random.default_rng()
 
-def random_pos(source_r, lat_dist, long_dist, num=1, **kwargs):
+# Number of tasks a batch of particles is split into (see 'create_parallel'). Fixed, such that seeded simulations
+# create the same particles for any number of threads.
+CREATION_TASKS = 16
+
+
+def set_seed(seed):
+    """
+    Seeds the random number generation of the particle creation.
+    Also seeds numpy's global state.
+
+    Arguments
+    ---------
+    seed : int
+        Seed value.
+    """
+    global rng
+    rng = np.random.default_rng(seed)
+    np.random.seed(seed)
+
+
+def get_rng_state():
+    """
+    Returns the states of the random number generators of the particle creation (see 'set_seed'), such that a
+    simulation can be continued with the same random streams (see 'set_rng_state').
+    """
+    return {"generator": rng.bit_generator.state, "numpy": np.random.get_state()}
+
+
+def set_rng_state(state):
+    """
+    Restores the states of the random number generators of the particle creation.
+
+    Arguments
+    ---------
+    state : dict
+        States as returned by 'get_rng_state'.
+    """
+    global rng
+    generator = getattr(np.random, state["generator"]["bit_generator"])()
+    generator.state = state["generator"]
+    rng = np.random.Generator(generator)
+    np.random.set_state(state["numpy"])
+
+
+def uniform_samples(num, dim, generator=None):
+    """
+    Returns samples of the unit hypercube with shape (num, dim).
+    If 'qmc_sampler' of the integration specifics is "sobol" or "halton", the samples are a randomly scrambled
+    low-discrepancy sequence, which covers the hypercube more evenly than pseudo-random samples (less injection noise
+    for the same number of particles). Every call uses a new scrambling.
+
+    Arguments
+    ---------
+    num : int
+        Number of samples.
+    dim : int
+        Dimension of the hypercube.
+    generator : numpy.random.Generator      (default: None)
+        Random number generator to draw from. Defaults to the generator of the particle creation (see 'set_seed').
+    """
+    generator = rng if generator is None else generator
+    sampler = Parameters.int_spec.get("qmc_sampler")
+    if sampler is None:
+        return generator.random((num, dim))
+
+    from scipy.stats import qmc
+    if sampler == "sobol":
+        # Sobol sequences are balanced in blocks of powers of two. The first 'num' points of the block are used.
+        engine = qmc.Sobol(d=dim, scramble=True, seed=generator)
+        return engine.random_base2(int(np.ceil(np.log2(max(num, 1)))))[:num]
+    elif sampler == "halton":
+        return qmc.Halton(d=dim, scramble=True, seed=generator).random(num)
+    raise ValueError(f"Invalid QMC sampler '{sampler}'. Use 'sobol', 'halton' or null.")
+
+
+def random_pos(source_r, lat_dist, long_dist, num=1, generator=None, **kwargs):
     """
     Generates random positions on the source object with radius r. The source's center is the center of the
     coordinate system. Also returns latitudes and longitudes of the positions on the source.
@@ -22,52 +100,58 @@ def random_pos(source_r, lat_dist, long_dist, num=1, **kwargs):
         Longitude distribution from which to sample. Valid are "truncnorm" and "uniform".
     num : int
         Number of positions to sample.
+    generator : numpy.random.Generator      (default: None)
+        Random number generator to draw from. Defaults to the generator of the particle creation (see 'set_seed').
 
     Keyword Arguments
     -----------------
     Distribution shape parameters:
     a_lat, b_lat, loc_lat, std_lat
     a_long, b_long, loc_long, std_long
+    The truncated normal distributions have mean 'loc' and standard deviation 'std' and are truncated to [a, b].
     """
     # Coordinates:
     # Inertial system Cartesian coordinates. x-axis points from star away, y in direction of orbit.
+    generator = rng if generator is None else generator
     valid_dist = {"truncnorm": 0, "uniform": 1}
-    latitudes = np.zeros(num)
-    longitudes = np.zeros(num)
-    if lat_dist in valid_dist:
-        if valid_dist[lat_dist] == 0:
-            lower = kwargs.get("a_lat", -np.pi / 2)
-            upper = kwargs.get("b_lat", np.pi / 2)
-            center = kwargs.get("loc_lat", 0)
-            std = kwargs.get("std_lat", 1)
-            a, b = (lower - center) / std, (upper - center) / std
-            for i in range(num):
-                latitudes[i] = truncnorm.rvs(a, b, loc=center, size=1)[0]
-        else:
-            lower = kwargs.get("a_lat", -np.pi / 2)
-            upper = kwargs.get("b_lat", np.pi / 2)
-            for i in range(num):
-                latitudes[i] = np.random.default_rng().uniform(lower, upper)
-    else:
+    if lat_dist not in valid_dist:
         raise ValueError("Invalid latitude distribution encountered in positional calculation.")
+    if long_dist not in valid_dist:
+        raise ValueError("Invalid longitude distribution encountered in positional calculation.")
 
-    if long_dist in valid_dist:
-        if valid_dist[long_dist] == 0:
-            lower = kwargs.get("a_long", -np.pi)
-            upper = kwargs.get("b_long", np.pi)
-            center = kwargs.get("loc_long", 0)
-            std = kwargs.get("std_long", 1)
-            a, b = (lower - center) / std, (upper - center) / std
-            for i in range(num):
-                longitudes[i] = truncnorm.rvs(a, b, loc=center, size=1)[0]
-        else:
-            lower = kwargs.get("a_long", -np.pi)
-            upper = kwargs.get("b_long", np.pi)
-            for i in range(num):
-                longitudes[i] = np.random.default_rng().uniform(lower, upper)
+    lat_params = (kwargs.get("a_lat", -np.pi / 2), kwargs.get("b_lat", np.pi / 2),
+                  kwargs.get("loc_lat", 0), kwargs.get("std_lat", 1))
+    long_params = (kwargs.get("a_long", -np.pi), kwargs.get("b_long", np.pi),
+                   kwargs.get("loc_long", 0), kwargs.get("std_long", 1))
+
+    if valid_dist[lat_dist] == 0 or valid_dist[long_dist] == 0:
+        # Non-uniform ejection is drawn from a precomputed emission map (see src/emission.py).
+        latitudes, longitudes, _ = surface_map(lat_dist, long_dist, lat_params, long_params).sample(num, generator)
+    elif Parameters.int_spec.get("qmc_sampler") is not None:
+        u = uniform_samples(num, 2, generator)
+        latitudes = lat_params[0] + (lat_params[1] - lat_params[0]) * u[:, 0]
+        longitudes = long_params[0] + (long_params[1] - long_params[0]) * u[:, 1]
     else:
-        raise ValueError("Invalid longitude distribution encountered in positional calculation.")
+        latitudes = generator.uniform(lat_params[0], lat_params[1], size=num)
+        longitudes = generator.uniform(long_params[0], long_params[1], size=num)
+
+    return surface_pos(source_r, latitudes, longitudes), latitudes, longitudes
 
+
+def surface_pos(source_r, latitudes, longitudes):
+    """
+    Positions on the source object with radius r at the given latitudes and longitudes, relative to the source's
+    center.
+
+    Arguments
+    ---------
+    source_r : float
+        Radius of the source object.
+    latitudes : array-like
+        Latitudes of the positions.
+    longitudes : array-like
+        Longitudes of the positions.
+    """
     # Spherical Coordinates. x towards Sun. Change y sign to preserve direction of rotation.
     # Regarding latitude: In spherical coordinates 0 = Northpole, pi = Southpole
 
@@ -77,7 +161,7 @@ def random_pos(source_r, lat_dist, long_dist, num=1, **kwargs):
 
     pos = np.array([x, y, z]).T
 
-    return pos, latitudes, longitudes
+    return pos
 
 
 def random_temp(source, temp_min, temp_max, latitude, longitude):
@@ -94,26 +178,28 @@ def random_temp(source, temp_min, temp_max, latitude, longitude):
         Minimum temperature on the source.
     temp_max : float
         Maximum temperature on the source.
-    latitude : float
-        Latitude at which to calculate temperature.
-    longitude : float
-        Longitude at which to calculate temperature
+    latitude : array-like
+        Latitudes at which to calculate temperatures.
+    longitude : array-like
+        Longitudes at which to calculate temperatures.
     """
-    longitude_wrt_sun = longitude - np.arctan2(source[0][1], source[0][0])
+    latitude = np.atleast_1d(latitude)
+    # Wrapped to [0, 2pi), such that the day side is a single interval.
+    longitude_wrt_sun = np.mod(np.atleast_1d(longitude) - np.arctan2(source[0][1], source[0][0]), 2 * np.pi)
     Params = Parameters()
     if not Params.therm_spec["spherical_symm_ejection"]:
         # Coordinate system relevant. If x-axis away from star a longitude -np.pi / 2 < longitude_wrt_sun < np.pi / 2 points away from the star!
         # (refer Wurz, P., 2002, "Monte-Carlo simulation of Mercury's exosphere"; -np.pi / 2 < longitude_wrt_sun < np.pi / 2)
-        if np.pi / 2 < longitude_wrt_sun < 3 * np.pi / 2:
-            temp = temp_min + (temp_max - temp_min) * (np.abs(np.cos(longitude_wrt_sun)) * np.cos(latitude)) ** (1 / 4)
-        else:
-            temp = np.repeat(temp_min, len(latitude))
+        day_side = (np.pi / 2 < longitude_wrt_sun) & (longitude_wrt_sun < 3 * np.pi / 2)
+        temp = np.full(len(latitude), float(temp_min))
+        temp[day_side] += (temp_max - temp_min) * (np.abs(np.cos(longitude_wrt_sun[day_side])) *
+                                                   np.cos(latitude[day_side])) ** (1 / 4)
     else:
         temp = np.repeat((temp_max + temp_min) / 2, len(latitude))
     return temp
 
 
-def random_vel_thermal(species_id, temp):
+def random_vel_thermal(species_id, temp, generator=None):
     """
     Generates a random thermal velocity vector
 
@@ -121,57 +207,52 @@ def random_vel_thermal(species_id, temp):
     ---------
     species_id : int
         id of the species for which to sample the velocity. Relevant for the Maxwell distribution.
-    temp : float
-        Local temperature.
+    temp : array-like
+        Local temperatures, one per particle.
+    generator : numpy.random.Generator      (default: None)
+        Random number generator to draw from. Defaults to the generator of the particle creation (see 'set_seed').
     """
-    Params = Parameters()
-    species = Params.get_species(id=species_id)
+    registry = Parameters.species_registry()
+    mass = registry.mass[registry.code[species_id]]
+
+    from scipy.stats import maxwell, norm
 
     k_B = 1.380649e-23
+    temp = np.atleast_1d(temp)
     vel = np.zeros((len(temp), 3))
-    for i in range(len(temp)):
-        scale = np.sqrt((k_B * temp[i]) / species.m)
-        v1 = maxwell.rvs(scale=scale)
-        v2 = norm.rvs(scale=1)  # Maxwellian only has positive values. For hemispheric coverage we need Gaussian (or other dist)
-        v3 = norm.rvs(scale=1)  # Maxwellian only has positive values. For hemispheric coverage we need Gaussian (or other dist)
-        vel[i] = np.array([v1, v2, v3])
+    scale = np.sqrt((k_B * temp) / mass)
+    generator = rng if generator is None else generator
+    vel[:, 0] = maxwell.rvs(scale=scale, size=len(temp), random_state=generator)
+    # Maxwellian only has positive values. For hemispheric coverage we need Gaussian (or other dist)
+    vel[:, 1:] = norm.rvs(scale=1, size=(len(temp), 2), random_state=generator)
 
     return vel
 
 
-def random_vel_sputter(species_id, num=1):
+def random_vel_sputter(species_id, num=1, generator=None):
     """
     Gives a random sputter velocity vector for an atom given the at the beginning defined sputtering model.
     :return: vel: ndarray. Randomly generated velocity vector depending on defined model.
     TODO: Refactor
     """
-    Params = Parameters()
-    species = Params.get_species(id=species_id)
-    sput_model = species.sput_spec["sput_model"]
+    registry = Parameters.species_registry()
+    code = registry.code[species_id]
 
     # ___________________________________________________
 
+    # Uniform samples of the speed quantile, azimuth and elevation.
+    u = uniform_samples(num, 3, generator)
+
     # MAXWELLIAN MODEL
     def model_maxwell():
 
-        model_maxwell_max = species.sput_spec["model_maxwell_max"]
-
-        scale = model_maxwell_max / np.sqrt(2)
-
-        ran_vel_sputter_maxwell = np.zeros((num, 3))
-        for i in range(num):
-            maxwell_ran_speed = maxwell.rvs(scale=scale)
+        from scipy.stats import maxwell
 
-            ran_azi = np.random.default_rng().uniform(0, 2 * np.pi)
-            ran_elev = np.random.default_rng().uniform(0, np.pi / 2)
+        model_maxwell_max = registry.maxwell_max[code]
 
-            v1 = np.cos(ran_azi) * np.sin(ran_elev)
-            v2 = np.sin(ran_azi) * np.sin(ran_elev)
-            v3 = np.cos(ran_elev)
+        scale = model_maxwell_max / np.sqrt(2)
 
-            ran_vel_sputter_maxwell[i] = maxwell_ran_speed * np.array(
-                [v3, v2, -v1])  # Rotated, s.t. reference direction along x-axis. Otherwise, the azimuth may point into the source. For same reason ele only goes to pi/2.
-        return ran_vel_sputter_maxwell
+        return maxwell.ppf(u[:, 0], scale=scale)
 
     # MODEL 1
     def model_wurz():
@@ -180,74 +261,38 @@ def random_vel_sputter(species_id, num=1):
     # MODEL 2
     def model_smyth():
 
-        v_b = species.sput_spec["model_smyth_v_b"]
-        v_M = species.sput_spec["model_smyth_v_M"]
-        a = species.sput_spec["model_smyth_a"]
-
-        def rejection_method():
-
-            def phi_neg(x):
-
-                def phi(x):
-                    f_v = 1 / v_b * (x / v_b) ** 3 \
-                          * (v_b ** 2 / (v_b ** 2 + x ** 2)) ** a \
-                          * (1 - np.sqrt((x ** 2 + v_b ** 2) / (v_M ** 2)))
-                    return f_v
-
-                def phi_int(x):
-                    integral_bracket = (1 + x ** 2) ** (5 / 2) * v_b / v_M / (2 * a - 5) - (1 + x ** 2) ** (
-                                3 / 2) * v_b / v_M / (2 * a - 3) - x ** 4 / (2 * (a - 2)) - a * x ** 2 / (
-                                                   2 * (a - 2) * (a - 1)) - 1 / (2 * (a - 2) * (a - 1))
-
-                    f_v_integrated = integral_bracket * (1 + x ** 2) ** (-a)
-                    return f_v_integrated
-
-                upper_bound = np.sqrt((v_M / v_b) ** 2 - 1)
-                normalization = 1 / (phi_int(upper_bound) - phi_int(0))
-                f_pdf = normalization * phi(x)
-                return -f_pdf
-
-            vmax = fmin(phi_neg, v_b, full_output=True, disp=False)
-            height = -vmax[1]
-
-            v_rv = np.zeros((num,3))
-            for i in range(num):
-                while True:
-                    x_rv = np.random.uniform(0, np.sqrt(v_M**2 - v_b**2))
-                    y_rv = np.random.uniform(0, height)
-                    if y_rv < -phi_neg(x_rv):
-                        break
-
-                ran_azi = np.random.default_rng().uniform(0, 2 * np.pi)
-                ran_elev = np.random.default_rng().uniform(0, np.pi / 2)
-
-                v1 = np.cos(ran_azi) * np.sin(ran_elev)
-                v2 = np.sin(ran_azi) * np.sin(ran_elev)
-                v3 = np.cos(ran_elev)
-
-                v_rv[i] = x_rv * np.array([v3, v2, -v1])  # Rotated, s.t. reference direction along x-axis. Otherwise, the azimuth may point into the source. For same reason ele only goes to pi/2. Hemisphere pointing up -> Hemisphere pointing right
-            return v_rv
-
-        ran_vel_sputter_smyth = rejection_method()
-        return ran_vel_sputter_smyth
+        # Inverse transform sampling of the tabulated cumulative distribution, precomputed per species.
+        cdf, speeds = registry.smyth_table[code]
+        return np.interp(u[:, 0], cdf, speeds)
 
     # ___________________________________________________
 
-    valid_model = {"maxwell": 0, "wurz": 1, "smyth": 2}
-    if sput_model in valid_model:
-        if valid_model[sput_model] == 0:
-            vel = model_maxwell()
-        elif valid_model[sput_model] == 1:
-            vel = model_wurz()
-        else:
-            vel = model_smyth()
+    sput_model = registry.sput_model[code]
+    if sput_model == registry.sput_models["maxwell"]:
+        speed = model_maxwell()
+    elif sput_model == registry.sput_models["wurz"]:
+        speed = model_wurz()
+    elif sput_model == registry.sput_models["smyth"]:
+        speed = model_smyth()
     else:
         raise ValueError("Invalid sputtering model")
 
+    ran_azi = 2 * np.pi * u[:, 1]
+    ran_elev = np.pi / 2 * u[:, 2]
+
+    v1 = np.cos(ran_azi) * np.sin(ran_elev)
+    v2 = np.sin(ran_azi) * np.sin(ran_elev)
+    v3 = np.cos(ran_elev)
+
+    # Rotated, s.t. reference direction along x-axis. Otherwise, the azimuth may point into the source.
+    # For same reason ele only goes to pi/2. Hemisphere pointing up -> Hemisphere pointing right
+    vel = speed[:, None] * np.c_[v3, v2, -v1]
+
     return vel
 
 
-def create_particle(species_id, process, source, source_r, num=1, **kwargs):
+@profiled
+def create_particle(species_id, process, source, source_r, num=1, generator=None, **kwargs):
     """
     Generate a set of state vectors containing position and velocity for new particles.
     The velocity of the particle depends on the physical process that generates it.
@@ -264,6 +309,8 @@ def create_particle(species_id, process, source, source_r, num=1, **kwargs):
         Radius of the source object.
     num : int
         Number of state vectors (particles) to generate.
+    generator : numpy.random.Generator      (default: None)
+        Random number generator to draw from. Defaults to the generator of the particle creation (see 'set_seed').
 
     Keyword Arguments
     -----------------
@@ -283,28 +330,79 @@ def create_particle(species_id, process, source, source_r, num=1, **kwargs):
 
     out = np.zeros((num, 6), dtype="float64")
 
-    if valid_process[process] == 0:
+    if valid_process[process] == 0 and not (Params.therm_spec["spherical_symm_ejection"] or
+                                            Parameters.int_spec.get("qmc_sampler") is not None):
+        # Day-side temperature model of 'random_temp'. Positions and their insolation are drawn from a map in the
+        # frame of the star, which is rotated to the current phase of the source.
+        ran_lat, ran_long, insolation = day_side_map().sample(num, rng if generator is None else generator)
+        ran_long += np.arctan2(source[0][1], source[0][0])
+        ran_pos = surface_pos(source_r, ran_lat, ran_long)
+        ran_temp = temp_min + (temp_max - temp_min) * insolation ** (1 / 4)
+
+        ran_vel_not_rotated_in_place = random_vel_thermal(species_id, ran_temp, generator)
+
+    elif valid_process[process] == 0:
         ran_pos, ran_lat, ran_long = random_pos(source_r, lat_dist="uniform", long_dist="uniform", a_long=0,
-                                                b_long=2 * np.pi, num=num)
+                                                b_long=2 * np.pi, num=num, generator=generator)
         ran_temp = random_temp(source, temp_min, temp_max, ran_lat, ran_long)
 
-        ran_vel_not_rotated_in_place = random_vel_thermal(species_id, ran_temp)
+        ran_vel_not_rotated_in_place = random_vel_thermal(species_id, ran_temp, generator)
 
     else:
 
-        ran_pos, ran_lat, ran_long = random_pos(source_r, lat_dist="uniform", long_dist="uniform", num=num)
-        ran_vel_not_rotated_in_place = random_vel_sputter(species_id, num=num)
+        ran_pos, ran_lat, ran_long = random_pos(source_r, lat_dist="uniform", long_dist="uniform", num=num,
+                                                generator=generator)
+        ran_vel_not_rotated_in_place = random_vel_sputter(species_id, num=num, generator=generator)
+
+    # Rotation matrices in order to get velocity vectors aligned with surface-normal.
+    # Counterclockwise along z-axis (local longitude). Clockwise along y-axis (local latitude).
+    cos_long, sin_long = np.cos(ran_long), np.sin(ran_long)
+    cos_lat, sin_lat = np.cos(ran_lat), np.sin(ran_lat)
+    zeros, ones = np.zeros(num), np.ones(num)
+    rot_z = np.stack([[cos_long, -sin_long, zeros], [sin_long, cos_long, zeros], [zeros, zeros, ones]]).transpose(2, 0, 1)
+    rot_y = np.stack([[cos_lat, zeros, -sin_lat], [zeros, ones, zeros], [sin_lat, zeros, cos_lat]]).transpose(2, 0, 1)
+    rot = rot_y @ rot_z
+
+    ran_vel = (rot @ ran_vel_not_rotated_in_place[..., None])[..., 0]
 
-    for part in range(num):
-        # Rotation matrix in order to get velocity vector aligned with surface-normal.
-        # Counterclockwise along z-axis (local longitude). Clockwise along y-axis (local latitude).
-        rot_z = np.array([[np.cos(ran_long[part]), -np.sin(ran_long[part]), 0], [np.sin(ran_long[part]), np.cos(ran_long[part]), 0], [0, 0, 1]])
-        rot_y = np.array([[np.cos(ran_lat[part]), 0, -np.sin(ran_lat)[part]], [0, 1, 0], [np.sin(ran_lat[part]), 0, np.cos(ran_lat[part])]])
-        rot = rot_y @ rot_z
+    out[:, :3] = ran_pos + np.asarray(source[0][:3])
+    out[:, 3:] = ran_vel + np.asarray(source[1][:3])
 
-        ran_vel = rot @ ran_vel_not_rotated_in_place[part]
+    return out
 
-        out[part][:3] = np.array([ran_pos[part][0] + source[0][0], ran_pos[part][1] + source[0][1], ran_pos[part][2] + source[0][2]])
-        out[part][3:] = np.array([ran_vel[0] + source[1][0], ran_vel[1] + source[1][1], ran_vel[2] + source[1][2]])
 
-    return out
\ No newline at end of file
+def create_parallel(species_id, process, source, source_r, num, threads):
+    """
+    Creates 'num' particles with 'create_particle' in threads. The particles are split into a fixed number of tasks
+    (the remainder is handed out to the first tasks), each drawing from its own random stream spawned from the
+    generator of the particle creation. Results are returned in task order, such that the particles only depend on
+    the state of that generator, not on the number of threads or their scheduling.
+
+    Arguments
+    ---------
+    species_id : int
+        id of the species the particles belong to.
+    process : str
+        Physical process responsible for particle creation (valid are "thermal" and "sputter").
+    source : array-like (shape (6,))
+        State vector of the source object.
+    source_r : float
+        Radius of the source object.
+    num : int
+        Number of particles to generate.
+    threads : int
+        Number of threads.
+    """
+    if num == 0:
+        return np.zeros((0, 6), dtype="float64")
+    tasks = min(CREATION_TASKS, num)
+    sizes = np.full(tasks, num // tasks)
+    sizes[:num % tasks] += 1
+    streams = np.random.SeedSequence(int(rng.integers(2 ** 63))).spawn(tasks)
+
+    def create_task(size, stream):
+        return create_particle(species_id, process, source, source_r, num=int(size),
+                               generator=np.random.default_rng(stream))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(threads, tasks))) as executor:
+        return np.concatenate(list(executor.map(create_task, sizes, streams)))
@@ -0,0 +1,159 @@
+import functools
+import numpy as np
+
+# Default cell size of the surface maps in radians (0.5 degrees).
+MAP_RESOLUTION = np.pi / 360
+
+
+class AliasTable:
+    """
+    Walker's alias method (in Vose's formulation) for sampling from a discrete distribution in O(1) per sample.
+    """
+
+    def __init__(self, weights):
+        """
+        Arguments
+        ---------
+        weights : array-like
+            Non-negative (unnormalized) probabilities of the outcomes.
+        """
+        weights = np.asarray(weights, dtype="float64").ravel()
+        if len(weights) == 0 or np.any(weights < 0) or not weights.sum() > 0:
+            raise ValueError("Alias table needs non-negative weights with a positive sum.")
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = list(np.flatnonzero(scaled < 1))
+        large = list(np.flatnonzero(scaled >= 1))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Remaining entries have a probability of 1 up to rounding.
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, num, generator):
+        """
+        Returns 'num' outcome indices drawn with the numpy random generator 'generator'.
+        """
+        index = generator.integers(0, len(self.prob), size=num)
+        return np.where(generator.random(num) < self.prob[index], index, self.alias[index])
+
+
+class EmissionMap:
+    """
+    Discretized probability map of ejection positions on the surface of a source in latitude and longitude.
+    Cells are drawn with an alias table, positions are uniform within a cell. A field given at the cell corners
+    (e.g. the insolation of 'day_side_map') is interpolated bilinearly to the drawn positions.
+    """
+
+    def __init__(self, lat_edges, long_edges, weights, field=None):
+        """
+        Arguments
+        ---------
+        lat_edges : array-like (shape (L + 1,))
+            Cell edges in latitude.
+        long_edges : array-like (shape (K + 1,))
+            Cell edges in longitude.
+        weights : array-like (shape (L, K))
+            Probability (mass) of the cells.
+        field : array-like (shape (L + 1, K + 1))     (default: None)
+            Values of a field at the cell corners.
+        """
+        self.lat_edges = np.asarray(lat_edges, dtype="float64")
+        self.long_edges = np.asarray(long_edges, dtype="float64")
+        weights = np.asarray(weights, dtype="float64")
+        if weights.shape != (len(self.lat_edges) - 1, len(self.long_edges) - 1):
+            raise ValueError("Emission map weights do not match the cell edges.")
+        self.field = None if field is None else np.asarray(field, dtype="float64")
+        if self.field is not None and self.field.shape != (len(self.lat_edges), len(self.long_edges)):
+            raise ValueError("Emission map field does not match the cell edges.")
+        self.weights = weights / weights.sum()
+        self.table = AliasTable(self.weights)
+
+    def sample(self, num, generator):
+        """
+        Returns latitudes and longitudes of 'num' positions drawn from the map, and the field at these positions
+        (None if the map has no field).
+        """
+        i, j = np.divmod(self.table.sample(num, generator), self.weights.shape[1])
+        u = generator.random((2, num))
+        latitudes = self.lat_edges[i] + u[0] * (self.lat_edges[i + 1] - self.lat_edges[i])
+        longitudes = self.long_edges[j] + u[1] * (self.long_edges[j + 1] - self.long_edges[j])
+        if self.field is None:
+            return latitudes, longitudes, None
+        values = ((1 - u[0]) * ((1 - u[1]) * self.field[i, j] + u[1] * self.field[i, j + 1]) +
+                  u[0] * ((1 - u[1]) * self.field[i + 1, j] + u[1] * self.field[i + 1, j + 1]))
+        return latitudes, longitudes, values
+
+
+def cell_masses(dist, lower, upper, center, std, resolution=MAP_RESOLUTION):
+    """
+    Cell edges on [lower, upper] and the probability mass of every cell under a "uniform" or "truncnorm" distribution.
+    The truncated normal is a normal distribution with mean 'center' and standard deviation 'std', truncated to
+    [lower, upper].
+    """
+    edges = np.linspace(lower, upper, max(1, int(np.ceil((upper - lower) / resolution))) + 1)
+    if dist == "uniform":
+        return edges, np.diff(edges)
+    elif dist == "truncnorm":
+        from scipy.stats import norm
+        return edges, np.diff(norm.cdf(edges, loc=center, scale=std))
+    raise ValueError(f"Invalid distribution '{dist}' in emission map.")
+
+
+@functools.lru_cache(maxsize=64)
+def surface_map(lat_dist, long_dist, lat_params, long_params, resolution=MAP_RESOLUTION):
+    """
+    Emission map of independent latitude and longitude distributions. Maps are built once per set of parameters.
+
+    Arguments
+    ---------
+    lat_dist : str
+        Latitude distribution. Valid are "truncnorm" and "uniform".
+    long_dist : str
+        Longitude distribution. Valid are "truncnorm" and "uniform".
+    lat_params : tuple
+        Lower bound, upper bound, center and standard deviation of the latitude distribution.
+    long_params : tuple
+        Lower bound, upper bound, center and standard deviation of the longitude distribution.
+    resolution : float      (default: MAP_RESOLUTION)
+        Cell size in radians.
+    """
+    lat_edges, lat_mass = cell_masses(lat_dist, *lat_params, resolution=resolution)
+    long_edges, long_mass = cell_masses(long_dist, *long_params, resolution=resolution)
+    return EmissionMap(lat_edges, long_edges, np.outer(lat_mass, long_mass))
+
+
+@functools.lru_cache(maxsize=8)
+def day_side_map(resolution=MAP_RESOLUTION):
+    """
+    Emission map of thermal ejection in the frame of the star, with the insolation (cosine of the stellar zenith
+    angle, 0 on the night side) as field. Latitudes and longitudes are uniform, as for spherically symmetric
+    ejection. Longitudes are measured from the anti-stellar point in [0, 2pi), such that the sub-stellar point lies
+    at pi (see 'random_temp' in src/create_particle.py). The geometry only rotates with the phase of the source,
+    so a single map serves all phases.
+
+    The insolation is interpolated, not the temperature, which is steep near the terminator: with the terminator on
+    cell edges, the interpolation error of the insolation is of relative order resolution^2 / 8.
+
+    Arguments
+    ---------
+    resolution : float      (default: MAP_RESOLUTION)
+        Cell size in radians.
+    """
+    lat_edges, lat_mass = cell_masses("uniform", -np.pi / 2, np.pi / 2, 0, 1, resolution=resolution)
+    long_edges, long_mass = cell_masses("uniform", 0, 2 * np.pi, 0, 1, resolution=resolution)
+    cos_lat, cos_long = np.cos(lat_edges), -np.cos(long_edges)
+    # The cosine at the poles and the terminator is not exactly 0 in floating point, which the fourth root of the
+    # temperature model would amplify.
+    cos_lat[np.abs(cos_lat) < 1e-12] = 0
+    cos_long[np.abs(cos_long) < 1e-12] = 0
+    insolation = np.outer(np.maximum(cos_lat, 0), np.maximum(cos_long, 0))
+    return EmissionMap(lat_edges, long_edges, np.outer(lat_mass, long_mass), field=insolation)
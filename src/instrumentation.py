@@ -0,0 +1,220 @@
+import os
+import sys
+import csv
+import json
+import time
+import ctypes
+import resource
+import rebound
+from contextlib import contextmanager
+
+# Approximate heap footprint of a single REBOUNDx particle parameter (list node, parameter struct, value and allocator
+# overhead). SERPENS test particles carry four parameters.
+REBX_PARAM_BYTES = 96
+REBX_PARAMS_PER_PARTICLE = 4
+
+
+def rss():
+    """
+    Current resident set size of the process in bytes.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def simulation_nbytes(sim):
+    """
+    Estimated memory footprint of the particles of a REBOUND simulation (including REBOUNDx parameters) in bytes.
+    """
+    return sim.N * (ctypes.sizeof(rebound.Particle) + REBX_PARAMS_PER_PARTICLE * REBX_PARAM_BYTES)
+
+
+def worker_copies_within_budget(copies, num_particles, num_active, particle_nbytes, used_nbytes, budget_nbytes):
+    """
+    Number of worker copies of a simulation that fit into a memory budget, at most 'copies'.
+    Copies are created one after another, each one as a full copy that gets pruned to the active particles and its
+    share of the test particles. The peak therefore holds one transient full copy, all test particles once more, and
+    the active particles once per copy. Only the last term depends on the number of copies. If even a single copy
+    exceeds the budget, fewer copies would only slow down the integration, and 'copies' is returned unchanged.
+
+    Arguments
+    ---------
+    copies : int
+        Requested number of copies.
+    num_particles : int
+        Number of particles of the simulation.
+    num_active : int
+        Number of active particles of the simulation.
+    particle_nbytes : float
+        Memory per particle in bytes.
+    used_nbytes : float
+        Memory in use before the copies are created in bytes.
+    budget_nbytes : float
+        Memory budget in bytes.
+    """
+    def peak(c):
+        return used_nbytes + particle_nbytes * (num_particles + (num_particles - num_active) + c * num_active)
+
+    if peak(1) > budget_nbytes:
+        return copies
+    fitting = (budget_nbytes - peak(0)) // max(particle_nbytes * num_active, 1)
+    return int(max(1, min(copies, fitting)))
+
+
+def append_csv(path, record):
+    """
+    Appends a record as a row to a CSV file. The header is written when the file is new. If the record has fields
+    that are not yet columns of the file, the existing rows are rewritten with the extended header.
+
+    Arguments
+    ---------
+    path : str
+        Path to the CSV file.
+    record : dict
+        Fields of the row.
+    """
+    fields = []
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "r", newline="") as f:
+            fields = next(csv.reader(f), [])
+
+    missing = [k for k in record if k not in fields]
+    if fields and missing:
+        with open(path, "r", newline="") as f:
+            rows = list(csv.DictReader(f))
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields + missing)
+            writer.writeheader()
+            writer.writerows(rows)
+            writer.writerow(record)
+        return
+
+    with open(path, "a", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields or list(record))
+        if not fields:
+            writer.writeheader()
+        writer.writerow(record)
+
+
+class AdvanceRecorder:
+    """
+    Records wall time per phase and counters (particles injected, removed and alive, bytes written, ...) for every
+    SERPENS advance.
+    Records are kept in memory ('records') and can be exported as JSON lines or CSV, such that runs can be compared.
+    """
+
+    def __init__(self, log_path=None):
+        """
+        Arguments
+        ---------
+        log_path : str      (default: None)
+            If given, every finished advance is appended to this file. Files ending with '.csv' are written as CSV,
+            otherwise as JSON lines.
+        """
+        self.log_path = log_path
+        self.records = []
+        self._current = None
+
+    def start(self, advance, **kwargs):
+        """
+        Start recording a new advance. Keyword arguments are stored as additional fields of the record.
+
+        Arguments
+        ---------
+        advance : int
+            Index of the advance.
+        """
+        self._current = {"advance": advance, **kwargs}
+        self._start_time = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Context manager measuring the wall time of a phase. Time of repeated phases within an advance is summed up.
+
+        Arguments
+        ---------
+        name : str
+            Name of the phase. Stored as 'time_<name>' in seconds.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(f"time_{name}", time.perf_counter() - start)
+
+    def add(self, name, value):
+        """
+        Add to a counter of the current advance.
+        """
+        if self._current is not None:
+            self._current[name] = self._current.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        Set a field of the current advance.
+        """
+        if self._current is not None:
+            self._current[name] = value
+
+    def stop(self):
+        """
+        Finish the current advance and write it to the log file if set.
+        Returns the finished record.
+        """
+        record = self._current
+        if record is None:
+            return None
+        record["time_total"] = time.perf_counter() - self._start_time
+        self.records.append(record)
+        self._current = None
+
+        if self.log_path is not None:
+            if self.log_path.endswith(".csv"):
+                append_csv(self.log_path, record)
+            else:
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+        return record
+
+    def to_jsonl(self, path):
+        """
+        Export all records as JSON lines.
+        """
+        with open(path, "w") as f:
+            for record in self.records:
+                f.write(json.dumps(record) + "\n")
+
+    def to_csv(self, path):
+        """
+        Export all records as CSV. Columns are the union of all recorded fields.
+        """
+        fields = []
+        for record in self.records:
+            fields.extend(k for k in record if k not in fields)
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.records)
+
+    def summary(self, record=None):
+        """
+        Returns a printable summary of the phase times of a record (default: last record).
+        """
+        record = self.records[-1] if record is None else record
+        phases = [(k[5:], v) for k, v in record.items() if k.startswith("time_") and k != "time_total"]
+        s = "".join(f"\t {name}: {v:.3f} s \n" for name, v in phases)
+        counters = [(k, v) for k, v in record.items() if not k.startswith("time_") and k != "advance"]
+        s += "".join(f"\t {name}: {v} \n" for name, v in counters)
+        return s
@@ -1,10 +1,126 @@
+import re
 import numpy as np
 
 
+def product_counts(products):
+    """
+    Number of every product of a reaction, e.g. ("O+", "O+", "H+", "2e") -> {"O+": 2, "H+": 1, "e": 2}.
+    """
+    counts = {}
+    for product in products:
+        match = re.fullmatch(r"(\d+)(.+)", product)
+        count, name = (int(match.group(1)), match.group(2)) if match else (1, product)
+        counts[name] = counts.get(name, 0) + count
+    return counts
+
+
+def spawn_daughters(registry, species_ids, lost_weights, velocities, generator, min_weight=0.,
+                    particles_per_weight=None):
+    """
+    Daughter superparticles of decayed parents. Every parent undergoes one reaction of its species' network, drawn
+    according to the branching ratios, and spawns one superparticle per product species of the simulation. Daughters
+    carry the physical particles lost by the parent times the multiplicity of the product, in units of the daughter's
+    weight, and get the velocity change of the reaction in a random direction on top of the parent's velocity.
+    All steps are batched over the parents.
+    Returns the parent indices, species ids, weights and velocities of the daughters.
+
+    Arguments
+    ---------
+    registry : SpeciesRegistry
+        Lookup tables of the species of the simulation (see src/species.py).
+    species_ids : array-like (shape (N,))
+        Species ids of the parents.
+    lost_weights : array-like (shape (N,))
+        Weight lost by the parents.
+    velocities : array-like (shape (N, 3))
+        Velocities of the parents.
+    generator : numpy.random.Generator
+        Random number generator for the reaction selection and the directions of the velocity changes.
+    min_weight : float      (default: 0)
+        Daughters with lower weights are not spawned.
+    particles_per_weight : array-like       (default: None)
+        Number of physical particles a unit weight stands for, per species code (see
+        'SpeciesRegistry.particles_per_weight'). By default, weights of all species stand for the same number.
+    """
+    codes = registry.codes(species_ids)
+    lost_weights = np.asarray(lost_weights, dtype="float64")
+    parents = np.flatnonzero((codes >= 0) & (lost_weights > 0))
+    codes = codes[parents]
+
+    reactions = registry.select_reactions(codes, generator.random(len(parents)))
+    daughters = registry.daughters[codes, reactions]
+    weights = lost_weights[parents, None] * registry.multiplicity[codes, reactions]
+    if particles_per_weight is not None:
+        particles_per_weight = np.asarray(particles_per_weight, dtype="float64")
+        weights = weights * particles_per_weight[codes, None] / particles_per_weight[np.maximum(daughters, 0)]
+    index, slot = np.nonzero((daughters >= 0) & (weights > 0) & (weights >= min_weight))
+
+    # Isotropic directions of the velocity changes.
+    cos_theta = generator.uniform(-1, 1, len(index))
+    phi = generator.uniform(0, 2 * np.pi, len(index))
+    sin_theta = np.sqrt(1 - cos_theta ** 2)
+    directions = np.c_[sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta]
+    kick = registry.delta_v[codes[index], reactions[index]]
+
+    parent_velocities = np.asarray(velocities, dtype="float64")[parents[index]]
+    return (parents[index], registry.ids[daughters[index, slot]], weights[index, slot],
+            parent_velocities + kick[:, None] * directions)
+
+
+class CompiledNetwork:
+    """
+    Numeric representation of a reaction network.
+    Holds the lifetimes, rates and velocity changes of the reactions as float arrays and their products as a table,
+    together with the total loss rate and the cumulative branching ratios, s.t. the decay of a species and the
+    selection of a reaction are lookups.
+    """
+    def __init__(self, reagents, products, lifetimes, delta_v):
+        """
+        Arguments
+        ---------
+        reagents : list
+            Reagent of every reaction (e.g. "e", "y", "H+").
+        products : list
+            Products of every reaction as space separated string (e.g. "O+ 2e").
+        lifetimes : array-like
+            Lifetime (inverse reaction rate) of every reaction in seconds.
+        delta_v : array-like
+            Velocity change of the reacting particle for every reaction in m/s.
+        """
+        self.reagents = tuple(reagents)
+        self.products = tuple(tuple(p.split()) for p in products)
+        self.lifetimes = np.asarray(lifetimes, dtype="float64")
+        self.delta_v = np.asarray(delta_v, dtype="float64")
+        self.rates = 1 / self.lifetimes
+        self.total_rate = float(np.sum(self.rates))
+        self.lifetime = 1 / self.total_rate
+
+        # Cumulative branching ratios. Reaction i is selected for a uniform sample u if
+        # branching[i-1] <= u < branching[i].
+        self.branching = np.cumsum(self.rates) / self.total_rate
+        self.branching[-1] = 1.
+
+        for array in (self.lifetimes, self.delta_v, self.rates, self.branching):
+            array.flags.writeable = False
+
+    def __len__(self):
+        return len(self.lifetimes)
+
+    def __repr__(self):
+        return f"CompiledNetwork({len(self)} reactions, lifetime [s] = {self.lifetime:.4g})"
+
+    def select(self, u):
+        """
+        Indices of the reactions selected by uniform samples u in [0, 1).
+        """
+        return np.minimum(np.searchsorted(self.branching, u, side="right"), len(self) - 1)
+
+
 class Network:
     """
     Chemical network of a species.
     Instead of a whole network a single number can be passed as lifetime of a species.
+    Networks of reactions are compiled into a 'CompiledNetwork'.
     """
     def __init__(self, id, e_scaling=1):
         """
@@ -19,6 +135,7 @@ class Network:
         """
         self._species_weights = None
         self._network = None
+        self._reactions = []
         self._shielded_network = None
         self.e_scaling = e_scaling
         u = 1.660539066e-27
@@ -133,19 +250,15 @@ class Network:
             ["Reagents", "Products", "Lifetime" (inverse reaction rate) [, "Velocity change"]]
         """
         for r in reac:
+            reagent, products, lifetime = r[:3]
+            delta_v = r[3] if len(r) > 3 else 0
 
-            if len(r) == 3:
-                r.append(0)
+            if reagent == "e":
+                lifetime = self.e_scaling * lifetime
 
-            if r[0] == "e":
-                r.insert(0, self.e_scaling * r.pop(2))
-            else:
-                r.insert(0, r.pop(2))
+            self._reactions.append((reagent, products, lifetime, delta_v))
 
-            if self._network is not None:
-                self._network = np.vstack((self._network, np.asarray(r)))
-            else:
-                self._network = np.asarray(r)
+        self._network = CompiledNetwork(*zip(*self._reactions))
 
     @property
     def network(self):
@@ -155,6 +268,7 @@ class Network:
     def network(self, tau):
         if isinstance(tau, (float, int)):
             self._network = tau
+            self._reactions = []
         else:
             print("Could not set network lifetime")
 
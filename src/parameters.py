@@ -1,6 +1,21 @@
-from src.species import Species
+from src.species import Species, SpeciesRegistry
 import json
 import copy
+import os
+import functools
+
+# Resources are located relative to the package, such that simulations can run in any working directory.
+RESOURCES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources')
+
+
+@functools.lru_cache(maxsize=None)
+def _load_systems():
+    """
+    Internal use only.
+    Parses resources/objects.json once per process. Callers need to copy what they modify.
+    """
+    with open(os.path.join(RESOURCES_PATH, 'objects.json'), 'r') as f:
+        return json.load(f)
 
 
 class DefaultFields:
@@ -24,7 +39,7 @@ class DefaultFields:
 
     def _get_default_parameters(self):
         self.species = {}
-        with open('resources/input_parameters.json', 'r') as f:
+        with open(os.path.join(RESOURCES_PATH, 'input_parameters.json'), 'r') as f:
             params = json.load(f)
             self.int_spec = params[0]["INTEGRATION_SPECIFICS"]
             self.therm_spec = params[0]["THERMAL_EVAP_PARAMETERS"]
@@ -54,6 +69,7 @@ class Parameters:
     celest = None
     species = {}
     num_species = 0
+    _registry = None
 
     def __new__(cls):
         """
@@ -68,6 +84,7 @@ class Parameters:
             cls.species = default.species
             cls.celest = default.celest
             cls.num_species = len(cls.species)
+            cls._registry = None
 
             cls._instance = object.__new__(cls)
 
@@ -107,10 +124,7 @@ class Parameters:
             return self.species[f"species{num}"]
 
         elif id is not None:
-            for i in range(self.num_species):
-                if self.species[f"species{i + 1}"].id == id:
-                    return self.species[f"species{i + 1}"]
-            return None
+            return self.species_registry().get(id)
 
         elif name is not None:
             for i in range(self.num_species):
@@ -122,6 +136,19 @@ class Parameters:
         else:
             return
 
+    @classmethod
+    def species_registry(cls):
+        """
+        Returns the lookup tables of the current species (see 'SpeciesRegistry' in src/species.py).
+        Built on first access and rebuilt after the species have been modified or reset.
+        """
+        Parameters()
+        registry = cls._registry
+        if registry is None:
+            registry = SpeciesRegistry([cls.species[f"species{i + 1}"] for i in range(cls.num_species)])
+            cls._registry = registry
+        return registry
+
     def get_current_parameters(self):
         """
         Get a copy of the current parameters.
@@ -144,6 +171,7 @@ class Parameters:
             for index, arg in enumerate(args):
                 cls.species[f"species{index + 1}"] = arg
             cls.num_species = len(args)
+            cls._registry = None
             #print("Species loaded.")
 
     @classmethod
@@ -164,11 +192,10 @@ class Parameters:
             applied to the object.
         """
         if celestial_name is not None:
-            with open('resources/objects.json', 'r') as f:
-                systems = json.load(f)
-                cls.celest = [objects for condition, objects in
-                              zip([s['SYSTEM-NAME'] == f"{celestial_name}" for s in systems], systems) if
-                              condition][0]
+            systems = _load_systems()
+            cls.celest = copy.deepcopy([objects for condition, objects in
+                                        zip([s['SYSTEM-NAME'] == f"{celestial_name}" for s in systems], systems) if
+                                        condition][0])
 
         if object is not None:
             if as_new_source:
@@ -0,0 +1,214 @@
+"""
+Domain-decomposed DTFE densities.
+
+The cloud is split into sectors of orbital phase around a center (e.g. the primary of the source). Every sector is
+tessellated in a separate process together with a ghost layer of particles within 'margin' of the sector, and only the
+densities of the particles owned by the sector are returned. The full tessellation is never held in memory at once,
+and the sectors are tessellated in parallel.
+
+The density of a particle only depends on the simplices around it. These are identical to the simplices of the full
+tessellation if their circumspheres are empty of all particles and if the particle only lies on the hull of the
+sector's tessellation where it lies on the hull of the full cloud. This is checked for every simplex whose
+circumsphere reaches beyond the ghost layer and for every hull facet. Sectors with violations are repeated with twice
+the margin. For these checks, the parent process holds a kd-tree and the convex hull of the cloud, which are linear in
+the number of particles.
+"""
+
+import multiprocessing
+import warnings
+import numpy as np
+from scipy.spatial import cKDTree, ConvexHull
+from src.profiling import profiled
+
+
+def sector_distance(points, lower, upper):
+    """
+    Distance of points (relative to the center) to the wedge of orbital phases [lower, upper) in the plane of the
+    first two coordinates. In 3D, the wedge extends along the third axis. Wedges must not be wider than pi.
+    """
+    phi = np.arctan2(points[:, 1], points[:, 0])
+    r = np.hypot(points[:, 0], points[:, 1])
+    width = upper - lower
+    # Angular distance to the wedge, 0 inside.
+    offset = np.mod(phi - lower, 2 * np.pi)
+    angle = np.where(offset < width, 0., np.minimum(offset - width, 2 * np.pi - offset))
+    return np.where(angle < np.pi / 2, r * np.sin(angle), r)
+
+
+def circumspheres(vertices):
+    """
+    Centers and radii of the circumspheres of simplices given by their vertices (shape (S, d + 1, d)).
+    Degenerate simplices get an infinite radius.
+    """
+    edges = vertices[:, 1:] - vertices[:, :1]
+    rhs = (edges ** 2).sum(axis=2) / 2
+    with np.errstate(all='ignore'):
+        det = np.linalg.det(edges)
+        regular = np.abs(det) > 0
+        center = np.full(rhs.shape, np.nan)
+        center[regular] = np.linalg.solve(edges[regular], rhs[regular][..., None])[..., 0]
+    radius = np.where(regular, np.linalg.norm(center, axis=1), np.inf)
+    return center + vertices[:, 0], radius
+
+
+def facet_planes(vertices, inside):
+    """
+    Planes of hull facets given by their vertices (shape (F, d, d)) in the convention of 'ConvexHull.equations': unit
+    normals pointing away from the point 'inside', followed by the offset. Degenerate facets get NaN planes.
+    """
+    edges = vertices[:, 1:] - vertices[:, :1]
+    if vertices.shape[2] == 2:
+        normal = np.stack((edges[:, 0, 1], -edges[:, 0, 0]), axis=1)
+    else:
+        normal = np.cross(edges[:, 0], edges[:, 1])
+    with np.errstate(all='ignore'):
+        normal /= np.linalg.norm(normal, axis=1)[:, None]
+    offset = -np.einsum('ij,ij->i', normal, vertices[:, 0])
+    flip = np.einsum('ij,j->i', normal, inside) + offset > 0
+    normal[flip] *= -1
+    offset[flip] *= -1
+    return np.c_[normal, offset]
+
+
+def _sector_densities(task):
+    """
+    Internal use only.
+    Tessellates the particles of a sector and its ghost layer in a worker process.
+    Returns the densities of the owned particles, the circumspheres of their simplices that reach beyond the ghost
+    layer and their hull facets.
+    """
+    points, m, owned, lower, upper, margin = task
+    if points.shape[1] == 2:
+        from src.DTFE import DTFE
+    else:
+        from src.DTFE3D import DTFE
+    dtfe = DTFE(points, np.zeros_like(points), m)
+
+    simplices = dtfe.delaunay.simplices[(dtfe.delaunay.simplices < owned).any(axis=1)]
+    center, radius = circumspheres(points[simplices])
+    with np.errstate(invalid='ignore'):
+        uncertain = ~(sector_distance(center, lower, upper) + radius <= margin)
+    hull = dtfe.delaunay.convex_hull
+    facets = hull[(hull < owned).any(axis=1)]
+    return dtfe.rho[:owned].astype('float64'), simplices[uncertain], center[uncertain], radius[uncertain], facets
+
+
+class PartitionedDTFE:
+    """
+    DTFE densities at the particle positions, computed on overlapping sectors of orbital phase in separate processes.
+    Gives the same densities as 'DTFE.DTFE' and 'DTFE3D.DTFE' at the particle positions.
+    """
+
+    @profiled
+    def __init__(self, points, m, center=None, sectors=8, margin=None, processes=None, attempts=0):
+        """
+        Arguments
+        ---------
+        points : array-like (shape (N, 2) or (N, 3))
+            Particle positions.
+        m : float or array-like (shape (N,))
+            Mass (weight) of the particles.
+        center : array-like     (default: None)
+            Center of the sectors, e.g. the position of the source's primary. Defaults to the center of mass.
+        sectors : int   (default: 8)
+            Number of sectors. More sectors need less memory per process.
+        margin : float      (default: None)
+            Width of the ghost layer. Defaults to four mean particle spacings within the bounding box.
+        processes : int     (default: None)
+            Number of worker processes (default: number of CPUs). Bounds the number of tessellations held in memory.
+        attempts : int      (default: 0)
+            Number of times the margin of a sector is doubled if some of its densities could not be verified.
+            Unverified particles are marked in 'verified'. Typically, these lie on the inner edge of a ring, where
+            the simplices of the full tessellation span the central hole, which only a margin of the size of the
+            hole resolves.
+        """
+        points = np.asarray(points, dtype='float64')
+        n, d = points.shape
+        m = np.broadcast_to(np.asarray(m, dtype='float64'), (n,))
+        if center is None:
+            center = np.average(points, axis=0, weights=m)
+        points = points - np.asarray(center, dtype='float64')
+        sectors = max(2, int(sectors))
+        if margin is None:
+            margin = 4 * (np.prod(np.ptp(points, axis=0)) / n) ** (1 / d)
+
+        self.points = points
+        self.center = np.asarray(center, dtype='float64')
+        self.delaunay = None
+        self.rho = np.empty(n)
+        # Whether the density of a particle is verified to be the density of the full tessellation.
+        self.verified = np.zeros(n, dtype=bool)
+
+        edges = np.linspace(-np.pi, np.pi, sectors + 1)
+        phi = np.arctan2(points[:, 1], points[:, 0])
+        owner = np.clip(np.searchsorted(edges, phi, side='right') - 1, 0, sectors - 1)
+        members = [np.flatnonzero(owner == i) for i in range(sectors)]
+        margins = np.full(sectors, float(margin))
+
+        tree = None
+        hull = None
+        # A point inside the hull of the cloud and the length scale of the offsets of facet planes.
+        interior = points.mean(axis=0)
+        scale = np.ptp(points, axis=0).max() or 1.
+        pending = [i for i in range(sectors) if len(members[i]) > 0]
+        processes = min(processes or multiprocessing.cpu_count(), len(pending))
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(processes=processes) as pool:
+            for attempt in range(attempts + 1):
+                blocks = []
+                for i in pending:
+                    ghost = sector_distance(points, edges[i], edges[i + 1]) < margins[i]
+                    ghost[members[i]] = False
+                    blocks.append(np.concatenate((members[i], np.flatnonzero(ghost))))
+                tasks = [(points[block], m[block], len(members[i]), edges[i], edges[i + 1], margins[i])
+                         for i, block in zip(pending, blocks)]
+
+                failed = []
+                for i, block, (rho, simplices, centers, radii, facets) in zip(pending, blocks,
+                                                                              pool.imap(_sector_densities, tasks)):
+                    self.rho[members[i]] = rho
+                    self.verified[members[i]] = True
+                    violated = [np.zeros(0, dtype=int)]
+                    if len(radii) > 0:
+                        # Circumspheres reaching beyond the ghost layer need to be empty of all particles.
+                        if tree is None:
+                            tree = cKDTree(points)
+                        inside = tree.query_ball_point(np.nan_to_num(centers), np.nan_to_num(radii * (1 - 1e-9)),
+                                                       return_length=True, workers=-1)
+                        violated.append(simplices[(inside > 0) | ~np.isfinite(radii)].ravel())
+                    if len(facets) > 0:
+                        # Hull facets of the sector need to lie in hull facets of the full cloud. Facets are compared
+                        # by their planes, since coplanar facets may be triangulated differently.
+                        if hull is None:
+                            equations = ConvexHull(points).equations
+                            equations[:, -1] /= scale
+                            hull = cKDTree(equations)
+                        planes = facet_planes(points[block[facets]], interior)
+                        planes[:, -1] /= scale
+                        regular = np.isfinite(planes).all(axis=1)
+                        inner = ~regular
+                        inner[regular] = hull.query(planes[regular], workers=-1)[0] > 1e-8
+                        violated.append(facets[inner].ravel())
+                    vertices = np.unique(np.concatenate(violated))
+                    vertices = vertices[vertices < len(members[i])]
+                    if len(vertices) > 0:
+                        self.verified[members[i][vertices]] = False
+                        failed.append(i)
+
+                if not failed or attempt == attempts:
+                    break
+                pending = failed
+                margins[pending] *= 2
+
+        if not self.verified.all():
+            warnings.warn(f"PartitionedDTFE: densities of {np.sum(~self.verified)} particles could not be verified.")
+
+    def density(self, *coords):
+        """
+        Densities at the particle positions. Other query points are not supported, since the tessellation is not
+        kept.
+        """
+        q = np.c_[coords] - self.center
+        if q.shape != self.points.shape or not np.array_equal(q, self.points):
+            raise ValueError("PartitionedDTFE only provides densities at the particle positions.")
+        return self.rho.copy()
@@ -0,0 +1,216 @@
+"""
+Opt-in profiling of SERPENS hot paths.
+
+Profiling is switched on by the environment variable SERPENS_PROFILE or by 'profile' in the integration specifics.
+Valid modes are
+    "cprofile"  Deterministic cProfile of the main thread, dumped as pstats file per advance.
+    "sample"    Statistical stack sampling of all threads, dumped as collapsed stacks per advance
+                (compatible with flamegraph.pl and speedscope).
+Both modes additionally record call counts and wall time of all functions decorated with '@profiled', including calls
+from worker threads (particle creation, integration, weight operator).
+Output is written to SERPENS_PROFILE_DIR (default: 'profiles' in the working directory).
+
+If profiling is disabled, decorated functions only check a module variable before being called.
+"""
+
+import os
+import sys
+import time
+import atexit
+import cProfile
+import functools
+import itertools
+import threading
+from collections import defaultdict
+
+_profiler = None
+_segment_ids = itertools.count()
+
+
+class Profiler:
+    """
+    Collects profiling data between 'start' and 'stop' and dumps it to disk labeled by a segment name
+    (e.g. 'advance_0003').
+    """
+
+    def __init__(self, mode, output_dir="profiles", interval=0.005):
+        """
+        Arguments
+        ---------
+        mode : str
+            "cprofile" or "sample".
+        output_dir : str    (default: 'profiles')
+            Directory the profiles are written to.
+        interval : float    (default: 0.005)
+            Sampling interval in seconds (only used by the "sample" mode).
+        """
+        if mode not in ("cprofile", "sample"):
+            raise ValueError(f"Invalid profiling mode '{mode}'. Use 'cprofile' or 'sample'.")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.interval = interval
+        self.label = None
+
+        self._lock = threading.Lock()
+        self._functions = defaultdict(lambda: [0, 0.])
+        self._profile = None
+        self._samples = None
+        self._sampler = None
+        self._stop_sampling = threading.Event()
+
+    @property
+    def active(self):
+        return self.label is not None
+
+    def start(self, label):
+        """
+        Start a new profiling segment. A running segment is stopped (and dumped) first.
+        """
+        if self.active:
+            self.stop()
+        self.label = label
+        self._functions.clear()
+
+        if self.mode == "cprofile":
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._samples = defaultdict(int)
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(target=self._sample, name="serpens-profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def stop(self):
+        """
+        Stop the current segment and write its profile to disk.
+        """
+        if not self.active:
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, self.label)
+
+        if self.mode == "cprofile":
+            self._profile.disable()
+            self._profile.dump_stats(f"{path}.pstats")
+            self._profile = None
+        else:
+            self._stop_sampling.set()
+            self._sampler.join()
+            with open(f"{path}.folded", "w") as f:
+                for stack, count in sorted(self._samples.items()):
+                    f.write(f"{stack} {count}\n")
+
+        with self._lock:
+            functions = sorted(self._functions.items(), key=lambda item: item[1][1], reverse=True)
+        with open(f"{path}_functions.txt", "w") as f:
+            f.write(f"{'function':<60} {'calls':>10} {'total [s]':>12} {'mean [ms]':>12}\n")
+            for name, (calls, total) in functions:
+                f.write(f"{name:<60} {calls:>10} {total:>12.4f} {1e3 * total / calls:>12.4f}\n")
+
+        self.label = None
+
+    def record(self, name, elapsed):
+        """
+        Add a call of a decorated function to the current segment.
+        """
+        with self._lock:
+            entry = self._functions[name]
+            entry[0] += 1
+            entry[1] += elapsed
+
+    def _sample(self):
+        """
+        Internal use only.
+        Sampler thread. Periodically collects the stacks of all other threads.
+        """
+        own = threading.get_ident()
+        while not self._stop_sampling.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples[";".join(reversed(stack))] += 1
+
+
+def configure(mode=None, output_dir=None):
+    """
+    Enables or disables profiling. Called on initialization of 'SerpensSimulation' and 'SerpensAnalyzer'.
+
+    Arguments
+    ---------
+    mode : str      (default: None)
+        "cprofile", "sample" or None. If None, the environment variable SERPENS_PROFILE is used, and otherwise
+        'profile' of the integration specifics. Profiling is disabled if neither is set.
+    output_dir : str    (default: None)
+        Directory the profiles are written to. Defaults to SERPENS_PROFILE_DIR or 'profiles'.
+    """
+    global _profiler
+    if mode is None:
+        mode = os.environ.get("SERPENS_PROFILE") or None
+    if mode is None:
+        from src.parameters import Parameters
+        Parameters()
+        mode = Parameters.int_spec.get("profile")
+    if output_dir is None:
+        output_dir = os.environ.get("SERPENS_PROFILE_DIR", "profiles")
+
+    if _profiler is not None:
+        if _profiler.mode == mode and _profiler.output_dir == output_dir:
+            return _profiler
+        _profiler.stop()
+        _profiler = None
+    if mode:
+        _profiler = Profiler(mode, output_dir=output_dir)
+    return _profiler
+
+
+def start(label):
+    """
+    Start a profiling segment (e.g. an advance). Does nothing if profiling is disabled.
+    """
+    if _profiler is not None:
+        _profiler.start(label)
+
+
+def stop():
+    """
+    Stop the current profiling segment and write it to disk. Does nothing if profiling is disabled.
+    """
+    if _profiler is not None:
+        _profiler.stop()
+
+
+def profiled(func):
+    """
+    Decorator recording call count and wall time of a function if profiling is enabled.
+    Outermost calls from the main thread outside a running segment (e.g. 'pull_data' called by the user) are profiled
+    as their own segment.
+    """
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return func(*args, **kwargs)
+
+        own_segment = not profiler.active and threading.current_thread() is threading.main_thread()
+        if own_segment:
+            profiler.start(f"{func.__qualname__}_{time.strftime('%Y%m%d-%H%M%S')}_{next(_segment_ids)}")
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.record(name, time.perf_counter() - start_time)
+            if own_segment:
+                profiler.stop()
+    return wrapper
+
+
+atexit.register(stop)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+def shadow_mask(points, star_xyz, star_r, bodies_xyz, bodies_r):
+    """
+    Whether points lie in the shadow of one of the bodies, as seen from the star. The shadow is the umbra cone behind
+    a body (see '_add_shadow_polygon' in src/visualize.py), or a cylinder if the star is not larger than the body.
+    All points are tested against a body at once, bodies are few.
+
+    Arguments
+    ---------
+    points : array-like (shape (N, 3))
+        Positions to test.
+    star_xyz : array-like (shape (3,))
+        Position of the star.
+    star_r : float
+        Radius of the star.
+    bodies_xyz : array-like (shape (B, 3))
+        Positions of the shadow casting bodies.
+    bodies_r : array-like (shape (B,))
+        Radii of the shadow casting bodies. Bodies without radius cast no shadow.
+    """
+    points = np.asarray(points, dtype="float64")
+    star_xyz = np.asarray(star_xyz, dtype="float64")
+    mask = np.zeros(len(points), dtype=bool)
+    for body_xyz, body_r in zip(np.asarray(bodies_xyz, dtype="float64"), np.asarray(bodies_r, dtype="float64")):
+        if not body_r > 0:
+            continue
+        axis = body_xyz - star_xyz
+        distance = np.linalg.norm(axis)
+        axis /= distance
+
+        relative = points - body_xyz
+        behind = relative @ axis
+        off_axis = np.sqrt(np.maximum(np.einsum('ij,ij->i', relative, relative) - behind ** 2, 0))
+        if star_r > body_r:
+            # Umbra cone with its apex at 'length' behind the body.
+            length = distance * body_r / (star_r - body_r)
+            radius = body_r * (1 - behind / length)
+        else:
+            radius = body_r
+        mask |= (behind > 0) & (off_axis < radius)
+    return mask
@@ -0,0 +1,130 @@
+import atexit
+import os
+import queue
+import threading
+from src.instrumentation import simulation_nbytes
+
+
+def _save_simulation(sim, filename, active_only):
+    """
+    Internal use only.
+    Appends a (private) simulation copy to a simulation archive. Returns the number of bytes written.
+    """
+    if active_only:
+        for j in reversed(range(sim.N_active, sim.N)):
+            sim.remove(index=j)
+    size_before = os.path.getsize(filename) if os.path.exists(filename) else 0
+    sim.save_to_file(filename)
+    return os.path.getsize(filename) - size_before
+
+
+class SnapshotWriter:
+    """
+    Background writer for SERPENS snapshots.
+    Snapshots are handed over as independent copies of the simulation state and get written to disk by a worker
+    thread, such that the next advance can be integrated while the previous one is being saved.
+    The queue is bounded: if the writer falls behind by more than 'max_queued' snapshots, submitting blocks until a
+    slot becomes available. Pending snapshots are flushed on interpreter exit.
+    """
+
+    def __init__(self, max_queued=2):
+        """
+        Arguments
+        ---------
+        max_queued : int    (default: 2)
+            Maximum number of snapshots waiting to be written.
+        """
+        self._queue = queue.Queue(maxsize=max(1, int(max_queued)))
+        self._error = None
+        self.bytes_written = 0
+        self.pending_bytes = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._work, name="serpens-snapshot-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                write, args, nbytes = job
+                try:
+                    written = write(*args)
+                    if isinstance(written, int):
+                        self.bytes_written += written
+                finally:
+                    with self._lock:
+                        self.pending_bytes -= nbytes
+            except Exception as exc:
+                self._error = exc
+            finally:
+                self._queue.task_done()
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            exc, self._error = self._error, None
+            raise RuntimeError("Writing a snapshot in the background failed.") from exc
+
+    @property
+    def pending(self):
+        """
+        Number of snapshots that are queued or being written.
+        """
+        return self._queue.unfinished_tasks
+
+    def submit(self, write, *args, nbytes=0):
+        """
+        Queue a write job. 'write' gets called as write(*args) on the writer thread.
+        All arguments need to be private copies that are not modified by the caller afterwards.
+        If 'write' returns the number of bytes written, it is added to 'bytes_written'.
+
+        Arguments
+        ---------
+        write : callable
+            Function performing the actual write.
+        args :
+            Arguments passed to 'write'.
+        nbytes : int    (default: 0)
+            Memory held by the arguments until the job is done. Counted in 'pending_bytes'.
+        """
+        self._raise_pending_error()
+        if not self._thread.is_alive():
+            raise RuntimeError("Snapshot writer has already been closed.")
+        with self._lock:
+            self.pending_bytes += nbytes
+        self._queue.put((write, args, nbytes))
+
+    def submit_simulation(self, sim, filename, active_only=False):
+        """
+        Queue a REBOUND simulation snapshot to be appended to a simulation archive.
+
+        Arguments
+        ---------
+        sim : rebound.Simulation
+            Simulation to save. A deep copy is taken before returning, so the caller may continue to modify 'sim'.
+        filename : str
+            Path to the simulation archive.
+        active_only : bool  (default: False)
+            Only save the active (gravitationally interacting) particles.
+        """
+        copy = sim.copy()
+        self.submit(_save_simulation, copy, filename, active_only, nbytes=simulation_nbytes(copy))
+
+    def flush(self):
+        """
+        Block until all queued snapshots have been written.
+        """
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self):
+        """
+        Flush pending snapshots and stop the writer thread.
+        """
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._raise_pending_error()
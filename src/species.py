@@ -1,4 +1,5 @@
-from src.network import Network
+import numpy as np
+from src.network import Network, CompiledNetwork, product_counts
 
 
 class SpeciesSpecifics:
@@ -68,7 +69,7 @@ class Species(SpeciesSpecifics):
         self.electron_density = kwargs.get("n_e", None)
 
         if self.electron_density is not None:
-            self.network = Network(self.species_id, e_scaling=self.electron_density).network
+            self.network = Network(species_id, e_scaling=self.electron_density).network
 
         if self.tau is not None:
             self.network = self.tau
@@ -137,3 +138,180 @@ class Species(SpeciesSpecifics):
             num_per_sup = num
         return num_per_sup
 
+
+def total_lifetime(network):
+    """
+    Lifetime of a species given its network. A network is either a lifetime in seconds or a compiled network of
+    reactions (see src/network.py).
+    """
+    if network is None:
+        return np.inf
+    if isinstance(network, CompiledNetwork):
+        return network.lifetime
+    return float(network)
+
+
+def reaction_tables(networks):
+    """
+    Branching and velocity change tables of a set of networks, padded to the largest number of reactions.
+    A lifetime without network counts as a single reaction without products and velocity change.
+    Returns the cumulative branching ratios (padded with 1), the velocity changes (padded with 0) and the products.
+    """
+    compiled = [n if isinstance(n, CompiledNetwork) else None for n in networks]
+    width = max([len(n) for n in compiled if n is not None], default=1)
+    branching = np.ones((len(compiled), width), dtype="float64")
+    delta_v = np.zeros((len(compiled), width), dtype="float64")
+    products = []
+    for code, network in enumerate(compiled):
+        if network is None:
+            products.append(((),))
+            continue
+        branching[code, :len(network)] = network.branching
+        delta_v[code, :len(network)] = network.delta_v
+        products.append(network.products)
+    return branching, delta_v, tuple(products)
+
+
+def daughter_tables(products, names):
+    """
+    Codes and multiplicities of the daughter species of every reaction (see 'reaction_tables'), padded with -1 and 0.
+    Only products that are species of the set (by name, the first species of a name wins) are daughters.
+    """
+    code_of_name = {}
+    for code, name in enumerate(names):
+        code_of_name.setdefault(name, code)
+
+    counts = [[{code_of_name[n]: c for n, c in product_counts(p).items() if n in code_of_name} for p in reactions]
+              for reactions in products]
+    width = max([len(reactions) for reactions in products], default=1)
+    depth = max([len(c) for reactions in counts for c in reactions], default=0)
+    daughters = np.full((len(products), width, depth), -1, dtype="int")
+    multiplicity = np.zeros((len(products), width, depth), dtype="float64")
+    for code, reactions in enumerate(counts):
+        for reaction, c in enumerate(reactions):
+            daughters[code, reaction, :len(c)] = list(c.keys())
+            multiplicity[code, reaction, :len(c)] = list(c.values())
+    return daughters, multiplicity
+
+
+def smyth_speed_table(v_b, v_M, a, size=4096):
+    """
+    Tabulated cumulative distribution of the speed distribution of the sputtering model by Smyth.
+    Returns the cumulative probabilities and the speeds at which they are evaluated, such that speeds are sampled by
+    interpolating the inverse (see 'create_particle.random_vel_sputter').
+    """
+    speeds = np.linspace(0, np.sqrt(v_M ** 2 - v_b ** 2), size)
+    f_v = 1 / v_b * (speeds / v_b) ** 3 * (v_b ** 2 / (v_b ** 2 + speeds ** 2)) ** a \
+        * (1 - np.sqrt((speeds ** 2 + v_b ** 2) / (v_M ** 2)))
+    cdf = np.concatenate(([0.], np.cumsum((f_v[1:] + f_v[:-1]) / 2 * np.diff(speeds))))
+    return cdf / cdf[-1], speeds
+
+
+class SpeciesRegistry:
+    """
+    Precomputed lookup tables of a set of species.
+    Every species gets a dense code (its position in the set), and all properties needed in hot paths are stored as
+    read-only arrays indexed by that code. The registry is a snapshot: it is rebuilt by 'Parameters' whenever the
+    species change, not when attributes of a single species instance are modified afterwards.
+    """
+    sput_models = {"maxwell": 0, "wurz": 1, "smyth": 2}
+
+    def __init__(self, species):
+        """
+        Arguments
+        ---------
+        species : list
+            Species instances. The code of a species is its index in this list.
+        """
+        self.species = tuple(species)
+        self.ids = np.array([s.id for s in self.species], dtype="int")
+
+        # Like the former linear scan of 'Parameters.get_species', the first species with a given id wins.
+        self.code = {}
+        for code, species_id in enumerate(self.ids.tolist()):
+            self.code.setdefault(species_id, code)
+        self.code_of_id = np.full(self.ids.max(initial=0) + 1, -1, dtype="int")
+        for species_id, code in self.code.items():
+            self.code_of_id[species_id] = code
+
+        self.mass = np.array([s.m for s in self.species], dtype="float64")
+        self.beta = np.array([s.beta for s in self.species], dtype="float64")
+        self.lifetime = np.array([total_lifetime(s.network) for s in self.species], dtype="float64")
+        self.loss_rate = 1 / self.lifetime
+        # Per species code: cumulative branching ratios and velocity changes of the reactions, and their products.
+        self.branching, self.delta_v, self.products = reaction_tables([s.network for s in self.species])
+        # Per species code and reaction: codes and multiplicities of the products that are species of this set.
+        self.daughters, self.multiplicity = daughter_tables(self.products, [s.name for s in self.species])
+        # Lifetime in the shadow of a body. Species without shielded lifetime decay as in sunlight.
+        self.shielded_lifetime = np.array([total_lifetime(s.network) if s.tau_shielded is None else s.tau_shielded
+                                           for s in self.species], dtype="float64")
+
+        sput_specs = [s.sput_spec for s in self.species]
+        self.sput_model = np.array([self.sput_models[spec["sput_model"]] for spec in sput_specs], dtype="int")
+        self.maxwell_max = np.array([spec["model_maxwell_max"] for spec in sput_specs], dtype="float64")
+        self.smyth_v_b = np.array([spec["model_smyth_v_b"] for spec in sput_specs], dtype="float64")
+        self.smyth_v_M = np.array([spec["model_smyth_v_M"] for spec in sput_specs], dtype="float64")
+        self.smyth_a = np.array([spec["model_smyth_a"] for spec in sput_specs], dtype="float64")
+        # Inverse transform sampling tables. Only needed for species that are sputtered with the Smyth model.
+        self.smyth_table = [smyth_speed_table(*(s.sput_spec[f"model_smyth_{k}"] for k in ("v_b", "v_M", "a")))
+                            if s.sput_spec["sput_model"] == "smyth" and s.n_sp else None
+                            for s in self.species]
+
+        for array in (self.ids, self.code_of_id, self.mass, self.beta, self.lifetime, self.loss_rate,
+                      self.branching, self.delta_v, self.daughters, self.multiplicity, self.shielded_lifetime,
+                      self.sput_model, self.maxwell_max, self.smyth_v_b, self.smyth_v_M, self.smyth_a,
+                      *(a for table in self.smyth_table if table is not None for a in table)):
+            array.flags.writeable = False
+
+        self._decay_cache = {}
+
+    def __len__(self):
+        return len(self.species)
+
+    def get(self, species_id):
+        """
+        Returns the species instance with the given id or None.
+        """
+        code = self.code.get(species_id)
+        return None if code is None else self.species[code]
+
+    def codes(self, species_ids):
+        """
+        Maps an array of species ids to species codes. Unknown ids (e.g. of active particles) are mapped to -1.
+        """
+        species_ids = np.asarray(species_ids, dtype="int")
+        codes = np.full(species_ids.shape, -1, dtype="int")
+        known = (species_ids >= 0) & (species_ids < len(self.code_of_id))
+        codes[known] = self.code_of_id[species_ids[known]]
+        return codes
+
+    def decay_factors(self, dt, shielded=False):
+        """
+        Weight multiplicators exp(-dt/lifetime) per species code for a timestep dt.
+        The factors of the last timestep are cached, since dt rarely changes.
+        """
+        cached_dt, decay = self._decay_cache.get(shielded, (None, None))
+        if dt != cached_dt:
+            decay = np.exp(-dt / self.shielded_lifetime) if shielded else np.exp(-dt * self.loss_rate)
+            decay.flags.writeable = False
+            self._decay_cache[shielded] = (dt, decay)
+        return decay
+
+    def particles_per_weight(self, advance):
+        """
+        Number of physical particles a unit weight stands for, per species code, if 'advance' seconds of injection
+        are released per advance. Weights of injected species count their superparticles (see
+        'Species.particles_per_superparticle'), weights of species that are only spawned as daughters count physical
+        particles.
+        """
+        return np.array([s.particles_per_superparticle(s.mass_per_sec * advance)
+                         if s.mass_per_sec and s.n_th + s.n_sp > 0 else 1. for s in self.species], dtype="float64")
+
+    def select_reactions(self, codes, u):
+        """
+        Indices of the reactions undergone by particles of the given species codes, selected by uniform samples u in
+        [0, 1) according to the branching ratios of their species' networks. Use with 'products' and 'delta_v'.
+        """
+        codes = np.asarray(codes, dtype="int")
+        branching = self.branching[codes]
+        return np.minimum((np.asarray(u)[..., None] >= branching).sum(axis=-1), branching.shape[-1] - 1)
@@ -1,3 +1,4 @@
+import os
 import matplotlib as mpl
 
 # Constant configurations for Matplotlib
@@ -7,8 +8,10 @@ try:
     TEX_CONFIG = {'preamble': r'\usepackage{amssymb}'}
     DEFAULT_FACECOLOR = 'yellow'
 
-    # Setting the backend and configurations for Matplotlib
-    mpl.use('TkAgg')
+    # Setting the backend and configurations for Matplotlib. An explicitly chosen backend (e.g. 'Agg' in the worker
+    # processes of the parallel analysis) is kept.
+    if "MPLBACKEND" not in os.environ:
+        mpl.use('TkAgg')
     mpl.rc('font', **FONT_CONFIG)
     mpl.rc('text', **TEXT_CONFIG)
     mpl.rc('text.latex', **TEX_CONFIG)
@@ -23,6 +26,7 @@ import matplotlib.gridspec as gridspec
 import matplotlib.colors as colors
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from src.parameters import Parameters
+from src.profiling import profiled
 from matplotlib.widgets import Slider, RangeSlider
 
 
@@ -281,6 +285,7 @@ class Visualize(BaseVisualizer):
         self.scatter_axs = []
         self.interactive = interactive      # TODO: Need to fix non-interactive
 
+    @profiled
     def __call__(self, save_path=None, show_bool=True, **kwargs):
 
         if save_path is not None:
@@ -349,6 +354,7 @@ class Visualize(BaseVisualizer):
         # Redraw the figure to ensure it updates
         self.fig.canvas.draw_idle()
 
+    @profiled
     def add_densityscatter(self, ax_index: int, x, y, density, d=3, **kwargs):
         self.vis_params.update(kwargs)
 
@@ -408,6 +414,7 @@ class Visualize(BaseVisualizer):
         else:
             self.colorbar_interact[-1].ax.set_title(fr'[cm$^{{{-d}}}$]', fontsize=22, loc='left', pad=20, color='w')
 
+    @profiled
     def add_triplot(self, ax_index, x, y, simplices, trialpha=.8, **kwargs):
         self.vis_params.update(kwargs)
 
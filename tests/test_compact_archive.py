@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from src.compact_archive import CompactArchive, write_compact_snapshot, CHUNK_SIZE
+
+
+def random_block(rng, n, source_hash, primary_state):
+    particles = {
+        "hash": rng.integers(0, 2 ** 32, n, dtype="uint32"),
+        "species": rng.integers(1, 12, n),
+        "weight": rng.random(n),
+        "xyz": primary_state[:3] + rng.normal(scale=1e8, size=(n, 3)),
+        "vxyz": primary_state[3:] + rng.normal(scale=1e4, size=(n, 3))
+    }
+    return source_hash, primary_state, particles
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    filename = str(tmp_path / "archive_compact.bin")
+    primary = np.array([7.4e11, -2.1e11, 3e9, 3.5e3, 1.2e4, -10.])
+    snapshots = [
+        (0., []),
+        (3600., [random_block(rng, 10, 11, primary)]),
+        (7200., [random_block(rng, CHUNK_SIZE + 5, 11, primary), random_block(rng, 3, 12, -primary)])
+    ]
+    for t, blocks in snapshots:
+        assert write_compact_snapshot(filename, t, blocks) > 0
+
+    archive = CompactArchive(filename)
+    assert len(archive) == len(snapshots)
+    for index, (t, blocks) in enumerate(snapshots):
+        snapshot = archive[index]
+        assert snapshot["t"] == t
+        if not blocks:
+            assert len(snapshot["hash"]) == 0
+            continue
+        expected = {k: np.concatenate([np.asarray(b[2][k]) for b in blocks]) for k in blocks[0][2]}
+        np.testing.assert_array_equal(snapshot["hash"], expected["hash"])
+        np.testing.assert_array_equal(snapshot["species"], expected["species"])
+        np.testing.assert_array_equal(snapshot["source_hash"],
+                                      np.concatenate([np.full(len(b[2]["hash"]), b[0]) for b in blocks]))
+        np.testing.assert_allclose(snapshot["weight"], expected["weight"], rtol=1e-7)
+        # Coordinates are stored as float32 relative to the primary.
+        np.testing.assert_allclose(snapshot["xyz"], expected["xyz"], rtol=0, atol=1e8 * 1e-6)
+        np.testing.assert_allclose(snapshot["vxyz"], expected["vxyz"], rtol=0, atol=1e4 * 1e-6)
+
+
+def test_incomplete_trailing_snapshot_is_ignored(tmp_path):
+    rng = np.random.default_rng(1)
+    filename = str(tmp_path / "archive_compact.bin")
+    write_compact_snapshot(filename, 0., [random_block(rng, 100, 1, np.zeros(6))])
+    write_compact_snapshot(filename, 1., [random_block(rng, 100, 1, np.zeros(6))])
+    with open(filename, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 10)
+    assert len(CompactArchive(filename)) == 1
+
+
+def test_analyzer_merge_rotates_like_rebound():
+    rebound = pytest.importorskip("rebound")
+    reboundx = pytest.importorskip("reboundx")
+    from serpens_analyzer import SerpensAnalyzer
+
+    sim = rebound.Simulation()
+    sim.add(m=1.989e30, hash="star")
+    sim.add(m=1.898e27, a=7.78e11, inc=0.3, f=1.1, hash="planet", primary=sim.particles[0])
+    sim.add(m=8.9e22, a=4.2e8, inc=0.05, f=0.4, hash="moon", primary=sim.particles[1])
+    rebx = reboundx.Extras(sim)
+    rebx.register_param('source_primary', 'REBX_TYPE_INT')
+    sim.particles["moon"].params["source_primary"] = sim.particles["planet"].hash.value
+
+    rng = np.random.default_rng(2)
+    xyz = np.asarray(sim.particles["planet"].xyz) + rng.normal(scale=1e9, size=(20, 3))
+    vxyz = np.asarray(sim.particles["planet"].vxyz) + rng.normal(scale=1e4, size=(20, 3))
+    for p, v in zip(xyz, vxyz):
+        sim.add(x=p[0], y=p[1], z=p[2], vx=v[0], vy=v[1], vz=v[2])
+
+    rotation = SerpensAnalyzer._rotate_reference_system(sim, "moon")
+    rotated = np.array([sim.particles[i].xyz for i in range(3, sim.N)])
+    rotated_v = np.array([sim.particles[i].vxyz for i in range(3, sim.N)])
+
+    empty = {"positions": np.zeros((0, 3)), "velocities": np.zeros((0, 3)), "hashes": np.zeros(0, "uint32"),
+             "species": np.zeros(0, "int"), "weights": np.zeros(0), "source_hashes": np.zeros(0, "uint32")}
+    compact = {"xyz": xyz, "vxyz": vxyz, "hash": np.arange(20, dtype="uint32"), "species": np.ones(20, "int"),
+               "weight": np.ones(20), "source_hash": np.zeros(20, "uint32")}
+    merged = SerpensAnalyzer._merge_compact(empty, compact, rotation)
+    np.testing.assert_allclose(merged["positions"], rotated, rtol=1e-12, atol=1e-3)
+    np.testing.assert_allclose(merged["velocities"], rotated_v, rtol=1e-12, atol=1e-9)
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from src import create_particle
+from src.create_particle import set_seed, get_rng_state, set_rng_state, uniform_samples
+from src.parameters import Parameters
+
+
+def test_rng_state_restores_random_streams():
+    set_seed(5)
+    create_particle.rng.random(10)
+    np.random.random(3)
+    state = get_rng_state()
+    expected = create_particle.rng.random(10), np.random.random(3)
+
+    set_seed(6)
+    set_rng_state(state)
+    np.testing.assert_array_equal(create_particle.rng.random(10), expected[0])
+    np.testing.assert_array_equal(np.random.random(3), expected[1])
+
+
+def test_thermal_creation_from_day_side_map():
+    params = Parameters()
+    symmetric = params.therm_spec["spherical_symm_ejection"]
+    params.therm_spec["spherical_symm_ejection"] = False
+    try:
+        set_seed(7)
+        source = [np.array([0., 1e11, 0.]), np.array([3e4, 0., 0.])]
+        out = create_particle.create_particle(1, "thermal", source, 1e6, num=20000)
+    finally:
+        params.therm_spec["spherical_symm_ejection"] = symmetric
+
+    relative = out[:, :3] - source[0]
+    np.testing.assert_allclose(np.linalg.norm(relative, axis=1), 1e6)
+    speed = np.linalg.norm(out[:, 3:] - source[1], axis=1)
+    # The star lies in -y direction of the source, the day side is hotter.
+    day_side = relative[:, 1] < -0.5e6
+    night_side = relative[:, 1] > 0.5e6
+    assert speed[day_side].mean() > 1.1 * speed[night_side].mean()
+
+
+@pytest.fixture
+def qmc_sampler():
+    """
+    Sets the 'qmc_sampler' of the integration specifics for a test.
+    """
+    int_spec = Parameters().int_spec
+    default = int_spec.get("qmc_sampler")
+
+    def set_sampler(sampler):
+        int_spec["qmc_sampler"] = sampler
+
+    yield set_sampler
+    int_spec["qmc_sampler"] = default
+
+
+@pytest.mark.parametrize("sampler", [None, "sobol", "halton"])
+@pytest.mark.parametrize("num", [1, 100, 1000])
+def test_uniform_samples(qmc_sampler, sampler, num):
+    qmc_sampler(sampler)
+    set_seed(8)
+    u = uniform_samples(num, 3)
+    assert u.shape == (num, 3)
+    assert np.all((u >= 0) & (u < 1))
+    # Every call uses new samples.
+    assert not np.array_equal(u, uniform_samples(num, 3))
+
+
+def test_uniform_samples_invalid_sampler(qmc_sampler):
+    qmc_sampler("latin")
+    with pytest.raises(ValueError):
+        uniform_samples(10, 2)
+
+
+@pytest.mark.parametrize("sampler", ["sobol", "halton"])
+def test_uniform_samples_discrepancy(qmc_sampler, sampler):
+    from scipy.stats import qmc
+    set_seed(9)
+    qmc_sampler(sampler)
+    low = np.mean([qmc.discrepancy(uniform_samples(1000, 3)) for _ in range(5)])
+    qmc_sampler(None)
+    random = np.mean([qmc.discrepancy(uniform_samples(1000, 3)) for _ in range(5)])
+    assert low < random / 4
+
+
+@pytest.mark.parametrize("process", ["thermal", "sputter"])
+def test_create_parallel_is_independent_of_threads(process):
+    Parameters()
+    source = [np.array([7e11, 1e10, 0.]), np.array([1e3, 1.3e4, 0.])]
+    results = []
+    for threads in (1, 2, 3, 2):
+        set_seed(10)
+        results.append(create_particle.create_parallel(1, process, source, 1e6, 83, threads))
+    assert results[0].shape == (83, 6)
+    for result in results[1:]:
+        np.testing.assert_array_equal(result, results[0])
+
+    # The next batch continues the random streams.
+    assert not np.array_equal(create_particle.create_parallel(1, process, source, 1e6, 83, 2), results[0])
+    set_seed(11)
+    assert not np.array_equal(create_particle.create_parallel(1, process, source, 1e6, 83, 2), results[0])
+
+
+def test_create_is_reproducible_with_threads():
+    pytest.importorskip("reboundx")
+    from serpens_simulation import create
+
+    params = Parameters()
+    species = params.get_species(num=1)
+    source = np.array([[7e11, 1e10, 0.], [1e3, 1.3e4, 0.]])
+    threads = params.int_spec["num_threads"]
+    results = []
+    try:
+        for num_threads in (2, 2, 3):
+            params.int_spec["num_threads"] = num_threads
+            set_seed(12)
+            results.append(create(source, 1.56e6, "sputter", species))
+    finally:
+        params.int_spec["num_threads"] = threads
+    assert results[0].shape == (species.n_sp, 6)
+    np.testing.assert_array_equal(results[1], results[0])
+    np.testing.assert_array_equal(results[2], results[0])
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from src import DTFE, DTFE3D
+
+MODULES = {2: DTFE, 3: DTFE3D}
+
+
+def cloud(d, n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    points = rng.normal(size=(n, d))
+    velocities = rng.normal(size=(n, d))
+    m = rng.uniform(0.5, 2, n)
+    return points, velocities, m
+
+
+@pytest.mark.parametrize("d", [2, 3])
+def test_location_cache(d):
+    points, velocities, m = cloud(d)
+    dtfe = MODULES[d].DTFE(points, velocities, m)
+    q = np.random.default_rng(1).uniform(-1, 1, size=(500, d))
+
+    first = dtfe._locate(*q.T)
+    # Equal query points (in a new array) reuse the cached location.
+    assert dtfe._locate(*q.copy().T)[0] is first[0]
+    np.testing.assert_array_equal(first[0], dtfe.delaunay.find_simplex(q))
+    # Other query points are located anew.
+    other = dtfe._locate(*(q[::-1]).T)
+    np.testing.assert_array_equal(other[0], first[0][::-1])
+
+
+@pytest.mark.parametrize("d", [2, 3])
+def test_vertex_shortcut(d):
+    points, velocities, m = cloud(d)
+    # A duplicate particle is not a vertex of any simplex and falls back to the usual point location.
+    points = np.vstack((points, points[:1]))
+    velocities = np.vstack((velocities, velocities[:1]))
+    m = np.r_[m, m[:1]]
+    dtfe = MODULES[d].DTFE(points, velocities, m)
+
+    simplexIndex, _, pointIndex = dtfe._locate(*points.T)
+    assert np.all(simplexIndex >= 0)
+    # Every particle lies in its located simplex, and its reference vertex is one of the simplex' vertices.
+    assert np.all((dtfe.delaunay.simplices[simplexIndex] == pointIndex[:, None]).any(axis=1))
+    barycentric = np.einsum('ijk,ik->ij', dtfe.delaunay.transform[simplexIndex, :d],
+                            points - dtfe.delaunay.transform[simplexIndex, d])
+    barycentric = np.c_[barycentric, 1 - barycentric.sum(axis=1)]
+    assert np.all(barycentric > -1e-9)
+
+    # At the vertices, the interpolated density is the density of the vertex.
+    vertices = np.unique(dtfe.delaunay.simplices)
+    density = dtfe.density(*points.T)
+    np.testing.assert_allclose(density[vertices], dtfe.rho[vertices], rtol=1e-10)
+    # Both copies of the duplicate particle get the density of the copy that is a vertex.
+    assert density[0] == pytest.approx(density[-1], rel=1e-12)
+
+
+@pytest.mark.parametrize("d", [2, 3])
+def test_linear_velocity_field(d):
+    points, _, m = cloud(d)
+    # An asymmetric gradient, so a transposed gradient would not pass.
+    gradient = np.arange(1., d * d + 1).reshape(d, d)
+    velocities = points @ gradient.T + 1.
+    dtfe = MODULES[d].DTFE(points, velocities, m)
+
+    q = np.random.default_rng(1).uniform(-0.5, 0.5, size=(200, d))
+    np.testing.assert_allclose(dtfe.v(*q.T), q @ gradient.T + 1., rtol=1e-8, atol=1e-8)
+    np.testing.assert_allclose(dtfe.theta(*q.T), np.trace(gradient), rtol=1e-8)
+
+
+def test_morton_order():
+    points = np.random.default_rng(2).uniform(size=(1000, 2))
+    order = DTFE.morton_order(points)
+    np.testing.assert_array_equal(np.sort(order), np.arange(len(points)))
+    # Cells of a regular 4x4 grid follow the Z-curve.
+    grid = np.stack(np.meshgrid(np.arange(4.), np.arange(4.), indexing='xy'), axis=-1).reshape(-1, 2)
+    z = DTFE.morton_order(grid)
+    np.testing.assert_array_equal(grid[z[:4]], [[0, 0], [1, 0], [0, 1], [1, 1]])
+    # Equal points keep their order.
+    np.testing.assert_array_equal(DTFE.morton_order(np.ones((5, 3))), np.arange(5))
+
+
+@pytest.mark.parametrize("d", [2, 3])
+def test_spatial_sort(d):
+    points, velocities, m = cloud(d)
+    unsorted = MODULES[d].DTFE(points, velocities, m)
+    dtfe = MODULES[d].DTFE(points, velocities, m, spatial_sort=True)
+    np.testing.assert_array_equal(dtfe.order[dtfe._inverse], np.arange(len(points)))
+    np.testing.assert_array_equal(dtfe.delaunay.points[dtfe._inverse], points)
+
+    # Interpolated fields do not depend on the order, neither at the particles nor elsewhere.
+    q = np.vstack((points, np.random.default_rng(1).uniform(-1, 1, size=(500, d))))
+    np.testing.assert_allclose(dtfe.density(*q.T), unsorted.density(*q.T), rtol=1e-8)
+    np.testing.assert_allclose(dtfe.v(*q.T), unsorted.v(*q.T), rtol=1e-8, atol=1e-8)
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from scipy.stats import truncnorm, kstest
+
+from src import create_particle
+from src.create_particle import random_temp, set_seed
+from src.emission import AliasTable, EmissionMap, surface_map, day_side_map
+from src.parameters import Parameters
+
+
+def test_alias_table_frequencies():
+    weights = np.array([0.5, 0., 3., 1., 0.25, 2.])
+    table = AliasTable(weights)
+    n = 400000
+    counts = np.bincount(table.sample(n, np.random.default_rng(0)), minlength=len(weights))
+    expected = n * weights / weights.sum()
+    assert counts[1] == 0
+    # Within five standard deviations of the multinomial counts.
+    np.testing.assert_array_less(np.abs(counts - expected), 5 * np.sqrt(expected) + 1)
+
+
+@pytest.mark.parametrize("weights", [[], [0., 0.], [1., -1.]])
+def test_alias_table_invalid_weights(weights):
+    with pytest.raises(ValueError):
+        AliasTable(weights)
+
+
+def test_emission_map_cells():
+    lat_edges, long_edges = np.array([-1., 0., 0.5]), np.array([0., 1., 2., 4.])
+    weights = np.array([[1., 0., 2.], [3., 1., 1.]])
+    emission_map = EmissionMap(lat_edges, long_edges, weights)
+    n = 200000
+    lat, long, field = emission_map.sample(n, np.random.default_rng(1))
+    assert field is None
+    i = np.searchsorted(lat_edges, lat, side='right') - 1
+    j = np.searchsorted(long_edges, long, side='right') - 1
+    counts = np.bincount(i * 3 + j, minlength=6).reshape(2, 3)
+    expected = n * weights / weights.sum()
+    np.testing.assert_array_less(np.abs(counts - expected), 5 * np.sqrt(expected) + 1)
+    # Uniform within the cells.
+    cell = (i == 1) & (j == 0)
+    assert kstest(lat[cell], "uniform", args=(0., 0.5)).statistic < 0.01
+    assert kstest(long[cell], "uniform", args=(0., 1.)).statistic < 0.01
+
+    with pytest.raises(ValueError):
+        EmissionMap(lat_edges, long_edges, weights[:, :2])
+    with pytest.raises(ValueError):
+        EmissionMap(lat_edges, long_edges, weights, field=np.zeros((2, 3)))
+
+
+def test_emission_map_field_is_bilinear():
+    edges = np.array([0., 1., 2.])
+    field = np.add.outer(2 * edges, 3 * edges) + 1
+    emission_map = EmissionMap(edges, edges, np.ones((2, 2)), field=field)
+    lat, long, values = emission_map.sample(1000, np.random.default_rng(2))
+    np.testing.assert_allclose(values, 2 * lat + 3 * long + 1)
+
+
+def test_truncnorm_surface_map():
+    # Mean and standard deviation of the normal distribution before truncation to [a, b].
+    lat_params = (-1., 1.2, 0.3, 0.4)
+    emission_map = surface_map("truncnorm", "uniform", lat_params, (-np.pi, np.pi, 0, 1))
+    lat, long, _ = emission_map.sample(200000, np.random.default_rng(3))
+    a, b = (lat_params[0] - lat_params[2]) / lat_params[3], (lat_params[1] - lat_params[2]) / lat_params[3]
+    assert kstest(lat, truncnorm(a, b, loc=lat_params[2], scale=lat_params[3]).cdf).statistic < 0.005
+    assert kstest(long, "uniform", args=(-np.pi, 2 * np.pi)).statistic < 0.005
+
+
+def test_day_side_temperatures():
+    emission_map = day_side_map()
+    set_seed(4)
+    lat, long, insolation = emission_map.sample(100000, create_particle.rng)
+    phase = 0.7
+    source = [np.array([np.cos(phase), np.sin(phase), 0.]) * 1e11, np.zeros(3)]
+
+    params = Parameters()
+    symmetric = params.therm_spec["spherical_symm_ejection"]
+    params.therm_spec["spherical_symm_ejection"] = False
+    try:
+        expected = random_temp(source, 100., 600., lat, long + phase)
+    finally:
+        params.therm_spec["spherical_symm_ejection"] = symmetric
+    np.testing.assert_allclose(100. + 500. * insolation ** (1 / 4), expected, rtol=0, atol=1e-2)
+    # Latitudes and longitudes are uniform.
+    assert kstest(lat, "uniform", args=(-np.pi / 2, np.pi)).statistic < 0.01
+    assert kstest(long, "uniform", args=(0, 2 * np.pi)).statistic < 0.01
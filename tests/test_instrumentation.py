@@ -0,0 +1,54 @@
+import csv
+import json
+
+import pytest
+
+from src.instrumentation import AdvanceRecorder, worker_copies_within_budget
+
+
+def record_advances(recorder, advances, **fields):
+    for advance in advances:
+        recorder.start(advance)
+        with recorder.phase("integrate"):
+            pass
+        for name, value in fields.items():
+            recorder.set(name, value)
+        recorder.stop()
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".jsonl"])
+def test_resumed_recorder_appends(tmp_path, suffix):
+    path = str(tmp_path / f"log{suffix}")
+    record_advances(AdvanceRecorder(log_path=path), range(3), injected=10)
+    # A simulation resumed from a checkpoint starts with a new recorder.
+    record_advances(AdvanceRecorder(log_path=path), range(3, 5), injected=10, spawned=4)
+
+    with open(path, "r", newline="") as f:
+        rows = list(csv.DictReader(f)) if suffix == ".csv" else [json.loads(line) for line in f]
+    assert [int(row["advance"]) for row in rows] == list(range(5))
+    if suffix == ".csv":
+        # Columns of later advances extend the header, earlier rows stay empty there.
+        assert [row["spawned"] for row in rows] == ["", "", "", "4", "4"]
+        assert all(row["injected"] == "10" for row in rows)
+
+
+def peak_nbytes(copies, num_particles=10000, num_active=10, particle_nbytes=1000, used_nbytes=0):
+    return used_nbytes + particle_nbytes * (2 * num_particles - num_active + copies * num_active)
+
+
+def test_worker_copies_without_pressure():
+    assert worker_copies_within_budget(8, 10000, 10, 1000, 0, 10 ** 12) == 8
+
+
+def test_worker_copies_reduced_to_fit():
+    # Room for exactly 3 copies of the active particles on top of the copy-independent part.
+    budget = peak_nbytes(3)
+    copies = worker_copies_within_budget(8, 10000, 10, 1000, 0, budget)
+    assert copies == 3
+    assert peak_nbytes(copies) <= budget < peak_nbytes(copies + 1)
+
+
+def test_worker_copies_kept_if_nothing_fits():
+    # The transient full copy alone exceeds the budget: dropping copies would not help.
+    assert worker_copies_within_budget(8, 10000, 10, 1000, 0, peak_nbytes(1) - 1) == 8
+    assert worker_copies_within_budget(8, 10000, 10, 1000, 5 * 10 ** 9, peak_nbytes(8)) == 8
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy.integrate import quad
+
+from src.KDE import KDE, cubic_spline
+
+# Surface of the unit sphere in 1, 2 and 3 dimensions.
+SPHERE_SURFACE = {1: 2, 2: 2 * np.pi, 3: 4 * np.pi}
+
+
+@pytest.mark.parametrize("d", [1, 2, 3])
+@pytest.mark.parametrize("h", [0.3, 2.])
+def test_kernel_normalization(d, h):
+    integral, _ = quad(lambda r: cubic_spline(r, h, d) * SPHERE_SURFACE[d] * r ** (d - 1), 0, 2 * h)
+    assert integral == pytest.approx(1, rel=1e-10)
+    assert cubic_spline(2 * h, h, d) == 0
+
+
+@pytest.mark.parametrize("d", [2, 3])
+def test_uniform_density(d):
+    rng = np.random.default_rng(0)
+    n = 40000 if d == 2 else 100000
+    points = rng.uniform(0, 1, size=(n, d))
+    kde = KDE(points, np.zeros_like(points), 2.)
+
+    # Away from the boundary, the density of a uniform cloud is its mass per volume.
+    interior = np.all(np.abs(points - 0.5) < 0.3, axis=1)
+    assert np.mean(kde.rho[interior]) == pytest.approx(2. * n, rel=0.02)
+
+    q = rng.uniform(0.3, 0.7, size=(1000, d))
+    assert np.mean(kde.density(*q.T)) == pytest.approx(2. * n, rel=0.02)
+
+
+def test_velocity_of_uniform_flow():
+    rng = np.random.default_rng(1)
+    points = rng.normal(size=(5000, 2))
+    kde = KDE(points, np.tile([3., -1.], (5000, 1)), rng.uniform(0.5, 2, 5000))
+    np.testing.assert_allclose(kde.v(*rng.normal(size=(100, 2)).T), np.tile([3., -1.], (100, 1)))
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from src.network import CompiledNetwork, Network, product_counts, spawn_daughters
+from src.species import Species, SpeciesRegistry
+
+
+@pytest.mark.parametrize("products, expected", [
+    (("O+", "O+", "H+", "2e"), {"O+": 2, "H+": 1, "e": 2}),
+    (("O++", "O", "3e"), {"O++": 1, "O": 1, "e": 3}),
+    (("O2+", "H2"), {"O2+": 1, "H2": 1}),
+    ((), {})
+])
+def test_product_counts(products, expected):
+    assert product_counts(products) == expected
+
+
+def test_compiled_network():
+    network = CompiledNetwork(["e", "y", "H+"], ["O+ 2e", "O+ e", "O+ H"], [2., 4., 4.], [0., 0., 10.])
+    assert len(network) == 3
+    assert network.products == (("O+", "2e"), ("O+", "e"), ("O+", "H"))
+    assert network.total_rate == pytest.approx(1.)
+    assert network.lifetime == pytest.approx(1.)
+    np.testing.assert_allclose(network.branching, [0.5, 0.75, 1.])
+    with pytest.raises(ValueError):
+        network.rates[0] = 0.
+
+    # Reaction i is selected on [branching[i-1], branching[i]).
+    np.testing.assert_array_equal(network.select(np.array([0., 0.49, 0.5, 0.74, 0.75, 0.999])), [0, 0, 1, 1, 2, 2])
+    # Samples at (or, by rounding, beyond) the upper end select the last reaction.
+    np.testing.assert_array_equal(network.select(np.array([1., 1.5])), [2, 2])
+
+
+def test_selection_follows_branching_ratios():
+    network = Network(4).network
+    n = 1000000
+    counts = np.bincount(network.select(np.random.default_rng(0).random(n)), minlength=len(network))
+    expected = n * network.rates / network.total_rate
+    np.testing.assert_array_less(np.abs(counts - expected), 5 * np.sqrt(expected) + 1)
+
+
+def test_spawned_daughters_carry_the_lost_particles():
+    registry = SpeciesRegistry([
+        Species('O2', n_th=5, mass_per_sec=1e3),
+        Species('O', n_sp=10, mass_per_sec=50.),
+        Species('O+')
+    ])
+    particles_per_weight = registry.particles_per_weight(3600.)
+    assert particles_per_weight[0] == pytest.approx(1e3 * 3600 / registry.mass[0] / 5)
+    assert particles_per_weight[1] == pytest.approx(50. * 3600 / registry.mass[1] / 10)
+    # Species that are not injected count physical particles.
+    assert particles_per_weight[2] == 1.
+
+    n = 200000
+    rng = np.random.default_rng(0)
+    lost = rng.uniform(0, 0.1, n)
+    parents, daughter_ids, weights, velocities = spawn_daughters(
+        registry, np.full(n, 4), lost, np.zeros((n, 3)), rng, particles_per_weight=particles_per_weight)
+    daughter_codes = registry.codes(daughter_ids)
+    particles = weights * particles_per_weight[daughter_codes]
+    lost_particles = lost[parents] * particles_per_weight[0]
+
+    # Every daughter carries the particles lost by its parent times the multiplicity of the product.
+    multiplicities = particles / lost_particles
+    np.testing.assert_allclose(multiplicities, np.round(multiplicities), rtol=1e-12)
+    assert set(np.round(multiplicities).astype(int)) <= {1, 2, 3}
+
+    # In total, the expected number of daughters per lost parent particle.
+    network = registry.species[0].network
+    probability = network.rates / network.total_rate
+    for code, name in ((1, "O"), (2, "O+")):
+        expected = sum(p * product_counts(products).get(name, 0)
+                       for p, products in zip(probability, network.products))
+        spawned = particles[daughter_codes == code].sum() / (lost.sum() * particles_per_weight[0])
+        assert spawned == pytest.approx(expected, rel=0.02)
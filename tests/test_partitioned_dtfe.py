@@ -0,0 +1,43 @@
+import warnings
+
+import numpy as np
+import pytest
+
+from src import DTFE, DTFE3D
+from src.partitioned_dtfe import PartitionedDTFE, facet_planes
+
+MODULES = {2: DTFE, 3: DTFE3D}
+
+
+@pytest.mark.parametrize("d", [2, 3])
+def test_equals_full_dtfe(d):
+    rng = np.random.default_rng(0)
+    points = rng.normal(size=(3000, d))
+    m = rng.uniform(0.5, 2, len(points))
+    full = MODULES[d].DTFE(points, np.zeros_like(points), m)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        partitioned = PartitionedDTFE(points, m, center=np.zeros(d), sectors=4, processes=1, attempts=6)
+    assert partitioned.verified.all()
+    np.testing.assert_allclose(partitioned.density(*points.T), full.rho, rtol=1e-10)
+
+
+def test_unverified_densities_warn():
+    # Particles on the inner edge of a ring can't be verified without a margin of the size of the hole.
+    rng = np.random.default_rng(1)
+    phi = rng.uniform(0, 2 * np.pi, 2000)
+    r = rng.uniform(1, 1.1, 2000)
+    points = np.c_[r * np.cos(phi), r * np.sin(phi)]
+    with pytest.warns(UserWarning, match="could not be verified"):
+        partitioned = PartitionedDTFE(points, 1., center=np.zeros(2), sectors=8, margin=0.05, processes=1)
+    assert not partitioned.verified.all()
+
+
+def test_coplanar_facets_match_by_plane():
+    # The faces of a cube are split into triangles along either diagonal, the planes are the same.
+    cube = np.array([[x, y, z] for x in (0., 1.) for y in (0., 1.) for z in (0., 1.)])
+    planes = facet_planes(cube[[[0, 1, 3], [0, 3, 2], [0, 1, 2]]], cube.mean(axis=0))
+    np.testing.assert_allclose(planes, [[-1, 0, 0, 0]] * 3, atol=1e-15)
+    # Degenerate facets have no plane.
+    assert np.isnan(facet_planes(cube[[[0, 1, 1]]], cube.mean(axis=0))).all()
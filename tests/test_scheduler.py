@@ -0,0 +1,73 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("dill")
+pytest.importorskip("reboundx")
+
+from scheduler import parameter_hash, find_cached_result
+from src.parameters import NewParams, Parameters
+from src.species import Species
+
+
+def apply(int_spec=None, **species_kwargs):
+    NewParams(species=[Species('Na', n_th=0, n_sp=10, mass_per_sec=1e4, **species_kwargs)],
+              int_spec={"seed": 1, **(int_spec or {})}, celestial_name="Jupiter (Io-Source)")()
+
+
+def test_parameter_hash_is_stable():
+    apply()
+    first = parameter_hash()
+    apply()
+    assert parameter_hash() == first
+
+
+def test_parameter_hash_ignores_run_settings():
+    apply()
+    reference = parameter_hash()
+    apply(int_spec={"num_threads": 3, "num_sim_advances": 99, "memory_budget": 512})
+    assert parameter_hash() == reference
+
+
+@pytest.mark.parametrize("int_spec, species_kwargs", [
+    ({"seed": 2}, {}),
+    ({"sim_advance": 0.02}, {}),
+    ({}, {"lifetime": 100}),
+    ({}, {"beta": 3.19})
+])
+def test_parameter_hash_changes_with_results(int_spec, species_kwargs):
+    apply()
+    reference = parameter_hash()
+    apply(int_spec=int_spec, **species_kwargs)
+    assert parameter_hash() != reference
+
+
+def write_manifest(directory, key):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "cache.json"), "w") as f:
+        json.dump({"key": key, "advances": 10}, f)
+
+
+def test_find_cached_result(tmp_path):
+    archive = str(tmp_path)
+    assert find_cached_result(archive, "abc") is None
+
+    write_manifest(os.path.join(archive, "simulation-a"), "abc")
+    write_manifest(os.path.join(archive, "simulation-b"), "def")
+    # Incomplete manifest of an interrupted simulation.
+    os.makedirs(os.path.join(archive, "simulation-c"))
+    with open(os.path.join(archive, "simulation-c", "cache.json"), "w") as f:
+        f.write('{"key": "ab')
+
+    assert find_cached_result(archive, "abc") == os.path.join(archive, "simulation-a")
+    assert find_cached_result(archive, "def") == os.path.join(archive, "simulation-b")
+    assert find_cached_result(archive, "xyz") is None
+
+
+def test_find_cached_result_prefers_own_directory(tmp_path):
+    archive = str(tmp_path)
+    write_manifest(os.path.join(archive, "simulation-a"), "abc")
+    write_manifest(os.path.join(archive, "simulation-b"), "abc")
+    preferred = os.path.join(archive, "simulation-b")
+    assert find_cached_result(archive, "abc", preferred=preferred) == preferred
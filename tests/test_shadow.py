@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.shadow import shadow_mask
+
+
+def test_umbra_cone():
+    # Star of radius 3 at the origin, body of radius 1 at x = 10: the umbra ends at x = 15.
+    points = np.array([
+        [11., 0., 0.],      # just behind the body
+        [14.9, 0., 0.],     # before the apex
+        [15.1, 0., 0.],     # beyond the apex
+        [9., 0., 0.],       # in front of the body
+        [12.5, 0.45, 0.],   # inside the cone (radius 0.5 at x = 12.5)
+        [12.5, 0., 0.55],   # outside the cone
+        [10.5, -3., 0.]     # beside the body
+    ])
+    np.testing.assert_array_equal(shadow_mask(points, np.zeros(3), 3., [[10., 0., 0.]], [1.]),
+                                  [True, True, False, False, True, False, False])
+
+
+def test_cylinder_for_small_stars():
+    points = np.array([[100., 0.9, 0.], [100., 1.1, 0.], [-100., 0., 0.]])
+    np.testing.assert_array_equal(shadow_mask(points, np.zeros(3), 0., [[10., 0., 0.]], [1.]), [True, False, False])
+    np.testing.assert_array_equal(shadow_mask(points, np.zeros(3), 1., [[10., 0., 0.]], [1.]), [True, False, False])
+
+
+def test_several_bodies():
+    star = np.array([1., 2., 3.])
+    bodies = np.array([[11., 2., 3.], [1., -8., 3.], [1., 2., 13.]])
+    points = np.array([[12., 2., 3.], [1., -9., 3.], [1., 2., 14.], [1., 2., -7.]])
+    np.testing.assert_array_equal(shadow_mask(points, star, 3., bodies, [1., 1., 0.]), [True, True, False, False])
+    # Bodies without radius cast no shadow.
+    assert not shadow_mask(points, star, 3., bodies, np.zeros(3)).any()
+    assert shadow_mask(np.zeros((0, 3)), star, 3., bodies, np.ones(3)).shape == (0,)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from src.species import Species, SpeciesRegistry
+
+
+@pytest.fixture
+def registry():
+    return SpeciesRegistry([
+        Species('Na', n_sp=10, mass_per_sec=1e4, beta=3.19, lifetime=240, shielded_lifetime=10800),
+        Species('O', n_th=5, mass_per_sec=1e3),
+        Species('Na', duplicate=2, n_sp=10, mass_per_sec=1e4, lifetime=100, sput_spec={"sput_model": "maxwell"}),
+        Species('Na', n_sp=1, mass_per_sec=1., lifetime=1)
+    ])
+
+
+def test_codes(registry):
+    assert len(registry) == 4
+    np.testing.assert_array_equal(registry.ids, [1, 3, 12, 1])
+    # The first species of an id wins.
+    assert registry.code == {1: 0, 3: 1, 12: 2}
+    assert registry.get(12) is registry.species[2]
+    assert registry.get(99) is None
+    np.testing.assert_array_equal(registry.codes([3, 1, 12, 7, -1, 1000]), [1, 0, 2, -1, -1, -1])
+
+
+def test_properties(registry):
+    np.testing.assert_allclose(registry.mass, [s.m for s in registry.species])
+    np.testing.assert_allclose(registry.beta, [3.19, 0, 0, 0])
+    assert registry.lifetime[0] == 240
+    assert registry.lifetime[2] == 100
+    # Lifetime of the O network: inverse of the summed reaction rates.
+    assert registry.lifetime[1] == pytest.approx(1 / (4.5e-6 + 3.5e-9 + 1.0e-7 + 5.1e-6 + 1.7e-8))
+    assert registry.sput_model[2] == SpeciesRegistry.sput_models["maxwell"]
+    assert registry.smyth_table[2] is None and registry.smyth_table[0] is not None
+    with pytest.raises(ValueError):
+        registry.mass[0] = 1.
+
+
+def test_decay_factors(registry):
+    decay = registry.decay_factors(60.)
+    np.testing.assert_allclose(decay, np.exp(-60. / registry.lifetime))
+    assert registry.decay_factors(60.) is decay
+    np.testing.assert_allclose(registry.decay_factors(60., shielded=True)[0], np.exp(-60. / 10800))
+    # Without shielded lifetime, species decay in the shadow as in sunlight.
+    np.testing.assert_allclose(registry.decay_factors(60., shielded=True)[1:], decay[1:])